@@ -0,0 +1,271 @@
+# bench/replay.py
+"""Replay recorded Evolution webhook payloads against the FastAPI app with local dependency stubs.
+
+    python -m bench.replay --messages 200 --concurrency 20 --openai-latency 0.8 --output run.json
+    python -m bench.replay --baseline run.json --env STREAM_REPLIES=true
+
+The app runs in-process (ASGI) with its lifespan, against stub servers for OpenAI, Supabase and
+Evolution. Each in-flight slot posts one message and waits until the pipeline has finished it, so
+end-to-end latency covers queueing, every dependency call and the reply sends. The report is JSON.
+"""
+import argparse
+import asyncio
+import copy
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter as StatusCounter
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.stubs import start_stubs, stop_stubs
+
+DEFAULT_PAYLOADS = os.path.join(os.path.dirname(__file__), "payloads.jsonl")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": round(max(values), 4) if values else None,
+    }
+
+
+def load_payloads(path: str) -> List[Dict]:
+    payloads = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            # Accept raw webhook bodies or {"payload": {...}} wrappers.
+            payload = row.get("payload", row)
+            if isinstance(payload, dict) and isinstance(payload.get("data"), dict):
+                payloads.append(payload)
+    if not payloads:
+        raise SystemExit(f"Nenhum payload de webhook válido em {path}")
+    return payloads
+
+
+def configure_environment(stubs, workdir: str, overrides: Dict[str, str]) -> None:
+    """Point the app at the stubs and keep its local state in a throwaway directory."""
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{stubs['openai'].url}/v1",
+        "OPENAI_AGENTS_DISABLE_TRACING": "1",
+        "SUPABASE_URL": stubs["supabase"].url,
+        "SUPABASE_KEY": "bench.bench.bench",
+        "EVOLUTION_API_URL": stubs["evolution"].url,
+        "EVOLUTION_API_TOKEN": "bench",
+        "EVOLUTION_INSTANCE_NAME": "bench",
+        "TTS_PREWARM": "false",
+        "CACHE_BACKEND": "memory",
+        "CONVERSATION_DB_PATH": os.path.join(workdir, "conversations.sqlite3"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embeddings_cache"),
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts_cache"),
+        "INTENT_TRAINING_PATH": os.path.join(workdir, "intent_training.jsonl"),
+        "IDEMPOTENCY_SQLITE_PATH": "",
+        "LLM_CACHE_SQLITE_PATH": os.path.join(workdir, "llm_cache.sqlite3"),
+    })
+    os.environ.update(overrides)
+
+
+def build_message(template: Dict, index: int, users: int) -> Dict:
+    payload = copy.deepcopy(template)
+    key = payload["data"].setdefault("key", {})
+    key["id"] = f"BENCH{index:08d}"
+    key["fromMe"] = False
+    key["remoteJid"] = f"55849{index % users:08d}@s.whatsapp.net"
+    return payload
+
+
+class CompletionTracker:
+    """Wraps main.process_webhook to resolve a future per message id when processing finishes."""
+
+    def __init__(self, main_module):
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.statuses: StatusCounter = StatusCounter()
+        original = main_module.process_webhook
+
+        async def tracked(data: Dict) -> Dict:
+            result = await original(data)
+            self.statuses[result.get("status", "unknown")] += 1
+            future = self.pending.pop(data.get("data", {}).get("key", {}).get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(result)
+            return result
+
+        main_module.process_webhook = tracked
+
+    def expect(self, message_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        return future
+
+
+async def replay(args) -> Dict:
+    latency = {"openai": args.openai_latency, "supabase": args.supabase_latency, "evolution": args.evolution_latency}
+    stubs = await start_stubs(latency, jitter=args.jitter, products=args.products, stream_chunk_delay=args.stream_chunk_delay)
+    overrides = dict(item.split("=", 1) for item in args.env)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_environment(stubs, workdir, overrides)
+    main = importlib.import_module("main")
+    tracker = CompletionTracker(main)
+    templates = load_payloads(args.payloads)
+
+    accept_times: List[float] = []
+    end_to_end: List[float] = []
+    rejected = StatusCounter()
+    counter = {"next": 0}
+
+    async def worker(client: httpx.AsyncClient, total: int) -> None:
+        while counter["next"] < total:
+            index = counter["next"]
+            counter["next"] += 1
+            payload = build_message(templates[index % len(templates)], index, args.users)
+            done = tracker.expect(payload["data"]["key"]["id"])
+            started = time.perf_counter()
+            response = await client.post("/webhook", json=payload)
+            accept_times.append(time.perf_counter() - started)
+            status = response.json().get("status") if response.headers.get("content-type", "").startswith("application/json") else None
+            if status != "queued":
+                rejected[status or str(response.status_code)] += 1
+                tracker.pending.pop(payload["data"]["key"]["id"], None)
+                continue
+            try:
+                await asyncio.wait_for(done, timeout=args.timeout)
+                end_to_end.append(time.perf_counter() - started)
+            except asyncio.TimeoutError:
+                rejected["timeout"] += 1
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            if args.warmup:
+                counter["next"] = 0
+                await asyncio.gather(*(worker(client, args.warmup) for _ in range(min(args.concurrency, args.warmup))))
+                accept_times.clear()
+                end_to_end.clear()
+                rejected.clear()
+                tracker.statuses.clear()
+                for stub in stubs.values():
+                    stub.calls.clear()
+                    stub.tokens.clear()
+            counter["next"] = args.warmup
+            total = args.warmup + args.messages
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client, total) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            # Let background work triggered by the run (lead flushes, thread mirroring) reach the stubs.
+            await asyncio.sleep(args.settle)
+    await stop_stubs(stubs)
+
+    completed = len(end_to_end)
+    return {
+        "config": {
+            "payloads": args.payloads,
+            "templates": len(templates),
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "latency": latency,
+            "jitter": args.jitter,
+            "env": overrides,
+        },
+        "duration_seconds": round(elapsed, 4),
+        "completed": completed,
+        "throughput_rps": round(completed / elapsed, 3) if elapsed else None,
+        "end_to_end_seconds": summarize(end_to_end),
+        "accept_seconds": summarize(accept_times),
+        "statuses": dict(tracker.statuses),
+        "rejected": dict(rejected),
+        "calls": {
+            name: {
+                "total": stub.total_calls,
+                "per_message": round(stub.total_calls / completed, 3) if completed else None,
+                "routes": dict(sorted(stub.calls.items())),
+                **({"prompt_tokens": dict(stub.tokens)} if stub.tokens else {}),
+            }
+            for name, stub in stubs.items()
+        },
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> Dict:
+    """Relative change of the headline numbers against a previous report; flags regressions past `tolerance`."""
+    def ratio(new, old):
+        return round(new / old, 4) if new is not None and old else None
+
+    checks = {
+        "throughput_rps": (ratio(report["throughput_rps"], baseline.get("throughput_rps")), "higher"),
+        "p50": (ratio(report["end_to_end_seconds"]["p50"], baseline.get("end_to_end_seconds", {}).get("p50")), "lower"),
+        "p95": (ratio(report["end_to_end_seconds"]["p95"], baseline.get("end_to_end_seconds", {}).get("p95")), "lower"),
+        "p99": (ratio(report["end_to_end_seconds"]["p99"], baseline.get("end_to_end_seconds", {}).get("p99")), "lower"),
+    }
+    for name in report["calls"]:
+        checks[f"{name}_calls_per_message"] = (
+            ratio(report["calls"][name]["per_message"], baseline.get("calls", {}).get(name, {}).get("per_message")), "lower"
+        )
+    regressions = [
+        name for name, (value, better) in checks.items()
+        if value is not None and (value > 1 + tolerance if better == "lower" else value < 1 - tolerance)
+    ]
+    return {"ratios": {name: value for name, (value, _) in checks.items()}, "regressions": regressions}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay webhook payloads against the app with stubbed dependencies")
+    parser.add_argument("--payloads", default=DEFAULT_PAYLOADS, help="JSONL file of Evolution webhook bodies")
+    parser.add_argument("--messages", type=int, default=100, help="messages to replay (templates are cycled)")
+    parser.add_argument("--concurrency", type=int, default=10, help="messages in flight at once")
+    parser.add_argument("--users", type=int, default=50, help="distinct remoteJids the messages are spread over")
+    parser.add_argument("--warmup", type=int, default=0, help="messages replayed before measuring")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds added to each OpenAI call")
+    parser.add_argument("--supabase-latency", type=float, default=0.05, help="seconds added to each PostgREST call")
+    parser.add_argument("--evolution-latency", type=float, default=0.1, help="seconds added to each Evolution call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency is drawn uniformly from ±jitter")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.02, help="delay between streamed OpenAI deltas")
+    parser.add_argument("--products", type=int, default=40, help="products served by the Supabase stub")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-message completion timeout")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait for background calls after the run")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app configuration")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression vs. the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(replay(args))
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["comparison"]["regressions"] else 0
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
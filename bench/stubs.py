@@ -0,0 +1,314 @@
+# bench/stubs.py
+"""Local stand-ins for OpenAI, Supabase (PostgREST) and the Evolution API.
+
+Each stub is a small aiohttp app on its own port. A middleware injects the configured latency and
+counts every call per dependency and route, so the harness can report outbound calls per message.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import random
+import time
+from collections import Counter as CallCounter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from aiohttp import web
+
+EMBEDDING_DIM = 64
+
+
+@dataclass
+class StubServer:
+    name: str
+    latency: float
+    jitter: float
+    calls: CallCounter = field(default_factory=CallCounter)
+    tokens: CallCounter = field(default_factory=CallCounter)
+    runner: Optional[web.AppRunner] = None
+    url: str = ""
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def _latency_middleware(stub: StubServer):
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else request.path
+        stub.calls[f"{request.method} {route}"] += 1
+        if stub.latency > 0:
+            await asyncio.sleep(max(0.0, random.uniform(stub.latency * (1 - stub.jitter), stub.latency * (1 + stub.jitter))))
+        return await handler(request)
+    return middleware
+
+
+async def _serve(stub: StubServer, app: web.Application, host: str = "127.0.0.1") -> StubServer:
+    stub.runner = web.AppRunner(app, access_log=None)
+    await stub.runner.setup()
+    site = web.TCPSite(stub.runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    stub.url = f"http://{host}:{port}"
+    return stub
+
+
+# --- OpenAI -----------------------------------------------------------------------------------
+
+PRODUCT_WORDS = ("tênis", "tenis", "sandália", "sandalia", "bota", "sapato", "modelo", "foto")
+
+
+def _last_user_message(body: Dict) -> str:
+    items = body.get("input", "")
+    if isinstance(items, str):
+        return items.rsplit("Nova mensagem:", 1)[-1]
+    for item in reversed(items):
+        if item.get("role") == "user":
+            content = item.get("content", "")
+            return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    return ""
+
+
+def _agent_reply(body: Dict, products: List[Dict]) -> str:
+    last_message = _last_user_message(body).lower()
+    if any(word in last_message for word in PRODUCT_WORDS):
+        return json.dumps({"products": products[:3]}, ensure_ascii=False)
+    return json.dumps({
+        "text": "Claro! Posso te ajudar com isso. Temos vários modelos disponíveis em nossa loja. "
+                "Você gostaria de saber mais sobre algum tamanho ou cor específica?"
+    }, ensure_ascii=False)
+
+
+class PromptCache:
+    """Mimics OpenAI prompt caching: prompts of 1024+ tokens reuse the longest seen prefix, in 128-token steps."""
+
+    CHARS_PER_TOKEN = 4
+    MIN_TOKENS = 1024
+    STEP_TOKENS = 128
+
+    def __init__(self):
+        self.prefixes = set()
+
+    def usage(self, body: Dict) -> Tuple[int, int]:
+        prompt = json.dumps([body.get("instructions"), body.get("tools"), body.get("input")], ensure_ascii=False)
+        tokens = len(prompt) // self.CHARS_PER_TOKEN
+        cached = 0
+        for size in range(self.MIN_TOKENS, tokens + 1, self.STEP_TOKENS):
+            digest = hashlib.sha1(prompt[:size * self.CHARS_PER_TOKEN].encode("utf-8")).digest()
+            if digest in self.prefixes:
+                cached = size
+            self.prefixes.add(digest)
+        return tokens, cached
+
+
+def _response_object(text: str, model: str, input_tokens: int = 900, cached_tokens: int = 0) -> Dict:
+    return {
+        "id": f"resp_{random.getrandbits(48):x}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": f"msg_{random.getrandbits(48):x}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": cached_tokens},
+            "output_tokens": max(1, len(text) // 4),
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + max(1, len(text) // 4),
+        },
+    }
+
+
+def _sse(event: Dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def openai_app(stub: StubServer, products: List[Dict], stream_chunk_delay: float) -> web.Application:
+    prompt_cache = PromptCache()
+
+    async def responses(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        text = _agent_reply(body, products)
+        input_tokens, cached_tokens = prompt_cache.usage(body)
+        stub.tokens["input"] += input_tokens
+        stub.tokens["cached"] += cached_tokens
+        response = _response_object(text, body.get("model", "gpt-4o-mini"), input_tokens, cached_tokens)
+        if not body.get("stream"):
+            return web.json_response(response)
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        in_progress = dict(response, status="in_progress", output=[])
+        sequence = 0
+        await stream.write(_sse({"type": "response.created", "response": in_progress, "sequence_number": sequence}))
+        item_id = response["output"][0]["id"]
+        for start in range(0, len(text), 12):
+            sequence += 1
+            await stream.write(_sse({
+                "type": "response.output_text.delta", "item_id": item_id, "output_index": 0, "content_index": 0,
+                "delta": text[start:start + 12], "sequence_number": sequence,
+            }))
+            if stream_chunk_delay:
+                await asyncio.sleep(stream_chunk_delay)
+        await stream.write(_sse({"type": "response.completed", "response": response, "sequence_number": sequence + 1}))
+        await stream.write_eof()
+        return stream
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("response_format"):
+            content = json.dumps({"tipo": None, "sentimento": "neutro", "idioma": "pt-BR"})
+        else:
+            content = "Tênis esportivo preto com detalhes brancos e solado de borracha."
+        return web.json_response({
+            "id": f"chatcmpl-{random.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320},
+        })
+
+    async def embeddings(request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = []
+        for index, text in enumerate(inputs):
+            digest = hashlib.sha256(str(text).encode("utf-8")).digest() * (EMBEDDING_DIM // 32)
+            vector = [(byte - 127.5) / 127.5 for byte in digest[:EMBEDDING_DIM]]
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        return web.json_response({"object": "list", "data": data, "model": body.get("model"), "usage": {"prompt_tokens": 1, "total_tokens": 1}})
+
+    async def transcriptions(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"text": "Oi, vocês têm tênis no número 38?"})
+
+    async def speech(request: web.Request) -> web.Response:
+        await request.read()
+        return web.Response(body=b"ID3" + bytes(4096), content_type="audio/mpeg")
+
+    async def create_thread(request: web.Request) -> web.Response:
+        return web.json_response({"id": f"thread_{random.getrandbits(48):x}", "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+    async def thread_message(request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response({
+            "id": f"msg_{random.getrandbits(48):x}", "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": request.match_info["thread_id"], "role": body.get("role", "user"), "status": "completed",
+            "content": [{"type": "text", "text": {"value": str(body.get("content", "")), "annotations": []}}],
+            "attachments": [], "metadata": {},
+        })
+
+    async def list_messages(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [], "has_more": False, "first_id": None, "last_id": None})
+
+    app = web.Application(middlewares=[_latency_middleware(stub)], client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/responses", responses)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/audio/transcriptions", transcriptions)
+    app.router.add_post("/v1/audio/speech", speech)
+    app.router.add_post("/v1/threads", create_thread)
+    app.router.add_post("/v1/threads/{thread_id}/messages", thread_message)
+    app.router.add_get("/v1/threads/{thread_id}/messages", list_messages)
+    return app
+
+
+# --- Supabase (PostgREST) ---------------------------------------------------------------------
+
+def make_products(count: int) -> List[Dict]:
+    names = ("Tênis Puma RS-X", "Tênis Nike Revolution", "Sandália Rasteira Dourada", "Bota Cano Curto Preta",
+             "Sapatilha Bico Fino", "Tênis Olympikus Corre", "Chinelo Slide Branco", "Scarpin Salto Alto Nude")
+    colors = ("preto", "branco", "azul", "vermelho", "nude", "dourado")
+    return [
+        {
+            "id": index + 1,
+            "name": f"{names[index % len(names)]} {colors[index % len(colors)]}",
+            "description": f"Modelo {colors[index % len(colors)]} confortável para o dia a dia",
+            "size": f"{34 + index % 6}-{39 + index % 6}",
+            "price": f"{99.9 + 10 * (index % 15):.2f}",
+            "image_url": f"https://example.invalid/products/{index + 1}.jpg",
+        }
+        for index in range(count)
+    ]
+
+
+def postgrest_app(stub: StubServer, products: List[Dict]) -> web.Application:
+    async def select(request: web.Request) -> web.Response:
+        table = request.match_info["table"]
+        return web.json_response(products if table == "products" else [])
+
+    async def upsert(request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response(body if isinstance(body, list) else [body], status=201)
+
+    app = web.Application(middlewares=[_latency_middleware(stub)])
+    app.router.add_get("/rest/v1/{table}", select)
+    app.router.add_post("/rest/v1/{table}", upsert)
+    app.router.add_patch("/rest/v1/{table}", upsert)
+    return app
+
+
+# --- Evolution API ----------------------------------------------------------------------------
+
+def _sample_media() -> Dict[str, str]:
+    try:
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new("RGB", (1280, 960), (30, 30, 30)).save(buffer, format="JPEG", quality=80)
+        image = buffer.getvalue()
+    except ImportError:
+        image = b"\xff\xd8\xff\xe0" + bytes(2048)
+    audio = b"OggS" + bytes(16 * 1024)
+    return {"image": base64.b64encode(image).decode("ascii"), "audio": base64.b64encode(audio).decode("ascii")}
+
+
+def evolution_app(stub: StubServer) -> web.Application:
+    media = _sample_media()
+
+    async def send(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"key": {"id": f"BENCH{random.getrandbits(48):X}", "fromMe": True}, "status": "PENDING"}, status=201)
+
+    async def presence(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({}, status=201)
+
+    async def get_base64(request: web.Request) -> web.Response:
+        body = await request.json()
+        kind = "image" if body.get("convertToMp4") else "audio"
+        return web.json_response({"base64": media[kind], "mediaType": kind}, status=201)
+
+    app = web.Application(middlewares=[_latency_middleware(stub)])
+    app.router.add_post("/message/{kind}/{instance}", send)
+    app.router.add_post("/chat/sendPresence/{instance}", presence)
+    app.router.add_post("/chat/getBase64FromMediaMessage/{instance}", get_base64)
+    return app
+
+
+async def start_stubs(latency: Dict[str, float], jitter: float = 0.2, products: int = 40, stream_chunk_delay: float = 0.0) -> Dict[str, StubServer]:
+    catalog = make_products(products)
+    stubs = {name: StubServer(name, latency.get(name, 0.0), jitter) for name in ("openai", "supabase", "evolution")}
+    await _serve(stubs["openai"], openai_app(stubs["openai"], catalog, stream_chunk_delay))
+    await _serve(stubs["supabase"], postgrest_app(stubs["supabase"], catalog))
+    await _serve(stubs["evolution"], evolution_app(stubs["evolution"]))
+    return stubs
+
+
+async def stop_stubs(stubs: Dict[str, StubServer]) -> None:
+    for stub in stubs.values():
+        if stub.runner is not None:
+            await stub.runner.cleanup()
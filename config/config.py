@@ -9,4 +9,122 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 EVOLUTION_API_URL = os.getenv("EVOLUTION_API_URL")
 EVOLUTION_API_TOKEN = os.getenv("EVOLUTION_API_TOKEN")
-EVOLUTION_INSTANCE_NAME = os.getenv("EVOLUTION_INSTANCE_NAME")
\ No newline at end of file
+EVOLUTION_INSTANCE_NAME = os.getenv("EVOLUTION_INSTANCE_NAME")
+# Webhook processing queue
+WEBHOOK_QUEUE_MAXSIZE = int(os.getenv("WEBHOOK_QUEUE_MAXSIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+
+# Per-conversation scheduling: burst of short text messages merged into one agent run
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "0"))
+COALESCE_MAX_CHARS = int(os.getenv("COALESCE_MAX_CHARS", "80"))
+# Messages waiting behind a busy conversation, per conversation and in total
+SCHEDULER_MAX_PENDING_PER_CHAT = int(os.getenv("SCHEDULER_MAX_PENDING_PER_CHAT", "20"))
+SCHEDULER_MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", "1000"))
+
+# Shared Supabase client
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "10"))
+
+# Evolution API HTTP client
+EVOLUTION_CONNECTION_LIMIT = int(os.getenv("EVOLUTION_CONNECTION_LIMIT", "20"))
+EVOLUTION_TIMEOUT_SECONDS = float(os.getenv("EVOLUTION_TIMEOUT_SECONDS", "30"))
+EVOLUTION_MAX_RETRIES = int(os.getenv("EVOLUTION_MAX_RETRIES", "3"))
+# Separate connections for "digitando..." presence, which Evolution holds open for the whole delay
+EVOLUTION_PRESENCE_CONNECTION_LIMIT = int(os.getenv("EVOLUTION_PRESENCE_CONNECTION_LIMIT", "4"))
+
+# Write-behind lead store
+LEAD_FLUSH_INTERVAL_SECONDS = float(os.getenv("LEAD_FLUSH_INTERVAL_SECONDS", "0.5"))
+LEAD_FLUSH_MAX_PENDING = int(os.getenv("LEAD_FLUSH_MAX_PENDING", "50"))
+LEAD_FLUSH_MAX_ATTEMPTS = int(os.getenv("LEAD_FLUSH_MAX_ATTEMPTS", "8"))
+LEAD_FLUSH_MAX_BACKOFF_SECONDS = float(os.getenv("LEAD_FLUSH_MAX_BACKOFF_SECONDS", "30"))
+
+# Lead/thread caches: CACHE_BACKEND is "memory" (per worker) or "sqlite" (shared by workers on one host)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache.sqlite3")
+LEAD_CACHE_TTL_SECONDS = float(os.getenv("LEAD_CACHE_TTL_SECONDS", "300"))
+LEAD_CACHE_MAX_ENTRIES = int(os.getenv("LEAD_CACHE_MAX_ENTRIES", "10000"))
+THREAD_CACHE_TTL_SECONDS = float(os.getenv("THREAD_CACHE_TTL_SECONDS", "86400"))
+
+# Local conversation history
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.sqlite3")
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "30"))
+CONVERSATION_CACHE_USERS = int(os.getenv("CONVERSATION_CACHE_USERS", "5000"))
+OPENAI_THREAD_MIRROR = os.getenv("OPENAI_THREAD_MIRROR", "true").lower() in ("1", "true", "yes")
+
+# In-memory product catalog index
+PRODUCT_CATALOG_REFRESH_SECONDS = float(os.getenv("PRODUCT_CATALOG_REFRESH_SECONDS", "300"))
+
+# Semantic product search
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embeddings_cache")
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.4"))
+# Keyword results below this count are topped up with semantic matches
+SEMANTIC_FILL_BELOW = int(os.getenv("SEMANTIC_FILL_BELOW", "3"))
+
+# Text-to-speech audio cache
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+TTS_PREWARM = os.getenv("TTS_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# Voice-note transcription cache (by message id and by audio content hash)
+TRANSCRIPTION_CACHE_TTL_SECONDS = float(os.getenv("TRANSCRIPTION_CACHE_TTL_SECONDS", "86400"))
+TRANSCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPTION_CACHE_MAX_ENTRIES", "5000"))
+
+# Image pipeline (vision input size, worker threads, description cache by perceptual hash)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+VISION_IMAGE_MAX_SIZE = int(os.getenv("VISION_IMAGE_MAX_SIZE", "512"))
+VISION_DETAIL = os.getenv("VISION_DETAIL", "low")
+VISION_CACHE_MAX_ENTRIES = int(os.getenv("VISION_CACHE_MAX_ENTRIES", "1000"))
+# Bits two perceptual hashes may differ by and still share a description (0: identical hashes only)
+VISION_CACHE_MAX_DISTANCE = int(os.getenv("VISION_CACHE_MAX_DISTANCE", "0"))
+
+# Local intent router in front of the triage agent
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+INTENT_TRAINING_PATH = os.getenv("INTENT_TRAINING_PATH", "intent_training.jsonl")
+# Appending routed customer messages to INTENT_TRAINING_PATH stores customer text on disk: off by default
+INTENT_TRAINING_LOG = os.getenv("INTENT_TRAINING_LOG", "false").lower() in ("1", "true", "yes")
+INTENT_TRAINING_MAX_BYTES = int(os.getenv("INTENT_TRAINING_MAX_BYTES", str(5 * 1024 * 1024)))
+INTENT_ROUTE_THRESHOLD = float(os.getenv("INTENT_ROUTE_THRESHOLD", "0.85"))
+INTENT_CANNED_THRESHOLD = float(os.getenv("INTENT_CANNED_THRESHOLD", "0.95"))
+
+# Streamed agent replies: text is sent sentence by sentence and product images as soon as they are known
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() in ("1", "true", "yes")
+STREAM_MIN_CHUNK_CHARS = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "60"))
+
+# Product image fan-out (per-reply cap and per-number send rate limits)
+MEDIA_MAX_IMAGES_PER_REPLY = int(os.getenv("MEDIA_MAX_IMAGES_PER_REPLY", "5"))
+MEDIA_RATE_PER_NUMBER = float(os.getenv("MEDIA_RATE_PER_NUMBER", "1"))
+MEDIA_BURST_PER_NUMBER = float(os.getenv("MEDIA_BURST_PER_NUMBER", "3"))
+PRODUCT_PAGE_TTL_SECONDS = float(os.getenv("PRODUCT_PAGE_TTL_SECONDS", "1800"))
+
+# Webhook idempotency (Evolution redeliveries), keyed by data.key.id; set IDEMPOTENCY_SQLITE_PATH to persist
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "")
+
+# Logging: LOG_LEVELS sets per-module levels ("tools.whatsapp_tools=DEBUG,utils.cache=WARNING")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "512"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "4000"))
+LOG_HASHED_FIELDS = os.getenv("LOG_HASHED_FIELDS", "base64,audio,media,jpegThumbnail,mediaKey,fileSha256,fileEncSha256")
+
+# Agent input: history is sent as role items after the static instructions and trimmed to a token budget
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-4o-mini")
+
+# Memoized model calls (lead classification, image descriptions, query embeddings): memory LRU over SQLite,
+# opened at startup; LLM_CACHE_SQLITE_PATH is relative to the working directory, empty keeps it in memory
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "2000"))
+
+# Outbound dispatcher: ordered send queue per remoteJid, shared workers and an instance-wide send rate
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+OUTBOUND_MAX_BATCH = int(os.getenv("OUTBOUND_MAX_BATCH", "20"))
+OUTBOUND_MAX_TEXT_CHARS = int(os.getenv("OUTBOUND_MAX_TEXT_CHARS", "4000"))
+OUTBOUND_PRESENCE = os.getenv("OUTBOUND_PRESENCE", "true").lower() in ("1", "true", "yes")
+OUTBOUND_RATE_PER_INSTANCE = float(os.getenv("OUTBOUND_RATE_PER_INSTANCE", "20"))
+OUTBOUND_BURST_PER_INSTANCE = float(os.getenv("OUTBOUND_BURST_PER_INSTANCE", "40"))
@@ -1,40 +1,153 @@
 # main.py
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 import json
 import re
 from openai import AsyncOpenAI
-from config.config import OPENAI_API_KEY
-from tools.supabase_tools import get_lead, upsert_lead
-from tools.whatsapp_tools import send_whatsapp_message, send_whatsapp_audio, send_whatsapp_image, fetch_media_base64
-from tools.audio_tools import text_to_speech
-from tools.image_tools import analyze_image
+from config.config import (
+    OPENAI_API_KEY, WEBHOOK_QUEUE_MAXSIZE, WEBHOOK_WORKERS, COALESCE_WINDOW_SECONDS, COALESCE_MAX_CHARS,
+    SCHEDULER_MAX_PENDING_PER_CHAT, SCHEDULER_MAX_PENDING,
+    LEAD_CACHE_MAX_ENTRIES, THREAD_CACHE_TTL_SECONDS, HISTORY_WINDOW, OPENAI_THREAD_MIRROR, SEMANTIC_MIN_SCORE,
+    TTS_PREWARM, INTENT_ROUTER_ENABLED, STREAM_REPLIES, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES,
+    IDEMPOTENCY_SQLITE_PATH,
+)
+from tools.supabase_tools import get_lead, upsert_lead, lead_cache
+from tools.supabase_client import supabase_pool
+from tools.lead_store import lead_store
+from tools.conversation_store import conversation_store, build_agent_input, Turn
+from tools.evolution_client import evolution_client, evolution_presence_client
+from tools.whatsapp_tools import fetch_media_base64
+from tools.outbound_dispatcher import outbound
+from tools.audio_tools import text_to_speech, prewarm_tts_cache, audio_cache
+from tools.image_tools import analyze_image, vision_cache
 from tools.extract_lead_info import extract_lead_info
-from tools.product_tools import ProductQuery, query_products
-from utils.image_processing import resize_image_to_thumbnail
+from tools.product_tools import ProductQuery, search_products
+from tools.product_catalog import product_catalog
+from tools.product_embeddings import product_embeddings
+from tools.reply_streamer import stream_agent_reply
+from tools.media_sender import media_sender, is_more_request
+from tools.intent_router import intent_router, route_metrics, AGENT_INTENTS, PRODUCT, SUPPORT
+from utils.image_processing import prepare_image_for_vision
 from models.lead_data import LeadData
 from bot_agents.triage_agent import triage_agent
 from bot_agents.product_agent import product_agent
+from bot_agents.support_agent import support_agent
 from agents import Runner
 from utils.logging_setup import setup_logging
+from utils.webhook_queue import WebhookQueue, QueueFullError
+from utils.conversation_scheduler import ConversationScheduler
+from utils.idempotency import IdempotencyStore, skip_reason
+from utils.tracing import trace, traced, span, record_run_usage, new_request_id
+from utils import metrics
+from utils.cache import Cache, make_backend
+from utils.llm_cache import llm_cache
+from utils.token_budget import load_tokenizer
 from datetime import datetime
-import os
-from typing import Dict, Optional
-import base64
+from typing import Dict, List, Optional, Set, Tuple, Union
+import asyncio
+import copy
+import time
+from dataclasses import dataclass
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-app = FastAPI()
-threads = {}
+product_catalog.add_listener(product_embeddings.sync)
+thread_cache = Cache("threads", make_backend(LEAD_CACHE_MAX_ENTRIES), ttl=THREAD_CACHE_TTL_SECONDS)
+background_tasks: Set[asyncio.Task] = set()
+mirror_tails: Dict[str, asyncio.Task] = {}
+SPECIALIST_AGENTS = {PRODUCT: product_agent, SUPPORT: support_agent}
+IMAGE_MARKDOWN = re.compile(r'!\[.*?\]\((.*?)\)')
+reply_latency = metrics.histogram("reply_latency_seconds", "Tempo entre o recebimento do webhook e o envio da resposta")
 
-async def get_or_create_thread(user_id: str, push_name: Optional[str] = None) -> str:
-    if user_id in threads:
-        logger.debug(f"Reusing in-memory thread for user {user_id}: {threads[user_id]}")
-        return threads[user_id]
+
+async def _handle_queued_webhook(data: Dict) -> None:
+    result = await process_webhook(data)
+    if result.get("status") != "success":
+        logger.warning("Webhook processado com status %s: %s", result.get('status'), result.get('message'))
+
+
+def _is_coalescable(data: Dict) -> bool:
+    text = data.get("data", {}).get("message", {}).get("conversation")
+    return bool(text) and len(text) <= COALESCE_MAX_CHARS
+
+
+def _merge_payloads(batch: list) -> Dict:
+    """Merge a burst of short text payloads into the last one, joining the texts in order."""
+    merged = copy.deepcopy(batch[-1])
+    texts = [item["data"]["message"]["conversation"] for item in batch]
+    merged["data"]["message"] = {"conversation": "\n".join(texts)}
+    if "_received_at" in batch[0]:
+        merged["_received_at"] = batch[0]["_received_at"]
+    return merged
+
+
+conversation_scheduler = ConversationScheduler(
+    _handle_queued_webhook,
+    coalesce_window=COALESCE_WINDOW_SECONDS,
+    can_coalesce=_is_coalescable,
+    merge=_merge_payloads,
+    max_pending_per_key=SCHEDULER_MAX_PENDING_PER_CHAT,
+    max_pending=SCHEDULER_MAX_PENDING,
+)
+
+
+async def _dispatch_webhook(data: Dict) -> None:
+    remote_jid = data["data"]["key"]["remoteJid"]
+    await conversation_scheduler.run(remote_jid, data)
+
+
+webhook_queue = WebhookQueue(_dispatch_webhook, maxsize=WEBHOOK_QUEUE_MAXSIZE, workers=WEBHOOK_WORKERS)
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, maxsize=IDEMPOTENCY_MAX_ENTRIES, sqlite_path=IDEMPOTENCY_SQLITE_PATH or None)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await evolution_client.start()
+    await evolution_presence_client.start()
+    await llm_cache.start()
+    await asyncio.to_thread(load_tokenizer)
+    await outbound.start()
+    await webhook_queue.start()
+    if supabase_pool.configured:
+        product_catalog.start()
+    if TTS_PREWARM:
+        spawn_background(prewarm_tts_cache())
+    try:
+        yield
+    finally:
+        await webhook_queue.stop()
+        await product_catalog.stop()
+        if background_tasks:
+            await asyncio.wait(set(background_tasks), timeout=10)
+        await outbound.stop()
+        await lead_store.close()
+        await conversation_store.close()
+        idempotency_store.close()
+        await supabase_pool.close()
+        await evolution_client.close()
+        await evolution_presence_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+@traced("get_or_create_thread")
+async def get_or_create_thread(user_id: str, push_name: Optional[str] = None) -> Optional[str]:
+    """Return the user's OpenAI thread id, creating the lead (and, with OPENAI_THREAD_MIRROR, the thread) if needed.
+
+    Without mirroring no thread is created; users that never had one get None.
+    """
+    cached_thread_id = thread_cache.get(user_id)
+    if cached_thread_id:
+        logger.debug("Reusing cached thread for user %s: %s", user_id, cached_thread_id)
+        return cached_thread_id
     lead = await get_lead(user_id)
-    if lead and "thread_id" in lead and lead["thread_id"]:
-        threads[user_id] = lead["thread_id"]
-        logger.debug(f"Reusing Supabase thread for user {user_id}: {lead['thread_id']}")
+    if lead and (lead.get("thread_id") or not OPENAI_THREAD_MIRROR):
+        thread_id = lead.get("thread_id")
+        if thread_id:
+            thread_cache.set(user_id, thread_id)
+            logger.debug("Reusing Supabase thread for user %s: %s", user_id, thread_id)
         if push_name and (not lead.get("nome_cliente") or not lead.get("pushname")):
             lead_data = LeadData(
                 remotejid=user_id,
@@ -42,290 +155,492 @@ async def get_or_create_thread(user_id: str, push_name: Optional[str] = None) ->
                 pushname=push_name,
                 telefone=user_id.replace("@s.whatsapp.net", ""),
                 data_cadastro=lead.get("data_cadastro", datetime.now().isoformat()),
-                thread_id=lead["thread_id"]
             )
-            logger.debug(f"Updating nome_cliente and pushname for {user_id}: {push_name}")
+            if thread_id:
+                lead_data.thread_id = thread_id
+            logger.debug("Updating nome_cliente and pushname for %s: %s", user_id, push_name)
             await upsert_lead(user_id, lead_data)
-        return lead["thread_id"]
-    thread = await client.beta.threads.create()
-    threads[user_id] = thread.id
-    logger.debug(f"Created new thread for user {user_id}: {thread.id}")
+        return thread_id
+    thread_id = None
+    if OPENAI_THREAD_MIRROR:
+        thread = await client.beta.threads.create()
+        thread_id = thread.id
+        thread_cache.set(user_id, thread_id)
+        logger.debug("Created new thread for user %s: %s", user_id, thread_id)
     lead_data = LeadData(
         remotejid=user_id,
         nome_cliente=push_name,
         pushname=push_name,
         telefone=user_id.replace("@s.whatsapp.net", ""),
         data_cadastro=datetime.now().isoformat(),
-        thread_id=thread.id
     )
-    logger.debug(f"Preparing to upsert lead data: {lead_data.dict(exclude_unset=True)}")
+    if thread_id:
+        lead_data.thread_id = thread_id
+    logger.debug("Preparing to upsert lead data: %s", lead_data.dict(exclude_unset=True))
     await upsert_lead(user_id, lead_data)
-    return thread.id
+    return thread_id
 
-async def get_thread_history(thread_id: str, limit: int = 10) -> str:
+async def fetch_thread_turns(thread_id: str, limit: int = HISTORY_WINDOW) -> list:
+    """Read the last turns stored in the OpenAI thread, oldest first."""
     try:
         messages = await client.beta.threads.messages.list(thread_id=thread_id, limit=limit)
-        history = []
-        for msg in reversed(messages.data):
-            role = msg.role
-            content = msg.content[0].text.value if msg.content else ""
-            history.append(f"{role.capitalize()}: {content}")
-        return "\n".join(history) if history else "No previous messages."
+        return [(msg.role, msg.content[0].text.value if msg.content else "") for msg in reversed(messages.data)]
     except Exception as e:
-        logger.error(f"Error retrieving thread history for thread {thread_id}: {str(e)}")
-        return "Error retrieving conversation history."
+        logger.error("Error retrieving thread history for thread %s: %s", thread_id, str(e))
+        return []
 
-@app.post("/webhook")
-async def webhook(request: Request):
+
+@traced("get_thread_history")
+async def get_conversation_history(user_id: str, thread: Union[str, "asyncio.Future[str]", None] = None) -> List[Turn]:
+    """Return the last HISTORY_WINDOW turns from the local log, importing the OpenAI thread once if it is empty.
+
+    `thread` may be the task still creating the thread; it is only awaited when there is something to import.
+    Without OPENAI_THREAD_MIRROR the local log is the only history and nothing is imported.
+    """
+    turns = await conversation_store.last_turns(user_id)
+    if not turns and thread is not None and OPENAI_THREAD_MIRROR:
+        thread_id = await thread if isinstance(thread, asyncio.Future) else thread
+        turns = await fetch_thread_turns(thread_id) if thread_id else []
+        await conversation_store.seed(user_id, turns)
+    return turns
+
+
+async def _mirror_to_thread(thread_id: str, role: str, content: str, previous: Optional[asyncio.Task]) -> None:
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        await client.beta.threads.messages.create(thread_id=thread_id, role=role, content=content)
+        logger.debug("Mirrored %s message to thread %s", role, thread_id)
+    except Exception as e:
+        logger.error("Failed to mirror %s message to thread %s: %s", role, thread_id, str(e))
+
+
+async def record_turn(user_id: str, thread_id: Optional[str], role: str, content: str) -> None:
+    """Append a turn to the local log and, if enabled, mirror it to the OpenAI thread in the background."""
+    await conversation_store.append(user_id, role, content)
+    if OPENAI_THREAD_MIRROR and thread_id:
+        # Chain mirrors per thread so they reach OpenAI in the order they happened.
+        task = spawn_background(_mirror_to_thread(thread_id, role, content, mirror_tails.get(thread_id)))
+        mirror_tails[thread_id] = task
+        task.add_done_callback(lambda t: mirror_tails.pop(thread_id, None) if mirror_tails.get(thread_id) is t else None)
+
+
+async def describe_similar_products(description: str, k: int = 5) -> str:
+    """List catalog products semantically close to an image description, for the product agent's input."""
+    if not product_embeddings.ready:
+        return ""
+    try:
+        matches = await product_embeddings.search(description, k=k, min_score=SEMANTIC_MIN_SCORE)
+    except Exception as e:
+        logger.error("Erro na busca semântica por imagem: %s", str(e))
+        return ""
+    if not matches:
+        return ""
+    lines = [
+        f"- {p.get('name', 'Produto')}, tamanho {p.get('size', 'N/A')}, R${p.get('price', 'N/A')}, image_url: {p.get('image_url')}"
+        for p, score in matches
+    ]
+    return "Produtos do catálogo semelhantes à imagem:\n" + "\n".join(lines) + "\n\n"
+
+
+async def enrich_lead(user_id: str, message: str) -> None:
+    """Extract lead fields from the message and persist them with a single upsert."""
+    try:
+        lead = await get_lead(user_id)
+        extracted_info = await extract_lead_info(message, remotejid=user_id, known_idioma=lead.get("idioma"))
+        extracted_data = json.loads(extracted_info)
+        if "error" in extracted_data:
+            extracted_data = {}
+        if extracted_data:
+            await upsert_lead(user_id, LeadData(**extracted_data))
+            logger.debug("[%s] Lead data saved: %s", user_id, extracted_data)
+    except Exception as e:
+        logger.error("[%s] Failed to extract or save lead info: %s", user_id, str(e))
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine off the reply path, keeping a reference so it is not garbage-collected."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@dataclass
+class IncomingMessage:
+    """What the media stage made of a webhook: the text to answer, or the reply explaining why there is none."""
+    text: Optional[str] = None
+    is_audio: bool = False
+    is_image: bool = False
+    prefer_audio: bool = False
+    image_description: Optional[str] = None
+    # Catalog candidates for the image; context for product_agent only, never part of `text`.
+    similar_products: str = ""
+    error_reply: Optional[Dict] = None
+
+
+async def load_incoming_message(message_data: Dict, message_key_id: str, user_id: str) -> IncomingMessage:
+    """Media stage: take the text, transcribe the audio or fetch and describe the image. Never raises."""
+    incoming = IncomingMessage()
+    if message_data.get("conversation"):
+        incoming.text = message_data["conversation"]
+        incoming.prefer_audio = "responda em áudio" in str(incoming.text).lower()
+    elif message_data.get("audioMessage"):
+        incoming.is_audio = True
+        try:
+            media_result = await fetch_media_base64(message_key_id, "audio", remotejid=user_id)
+        except Exception as e:
+            media_result = {"error": str(e)}
+        if "error" in media_result:
+            logger.error("[%s] Falha ao processar áudio: %s", user_id, media_result['error'])
+            incoming.error_reply = {"text": f"Falha ao processar áudio: {media_result['error']}"}
+        elif media_result.get("type") == "audio":
+            incoming.text = media_result["transcription"]
+            logger.info("Transcribed audio to: %s", incoming.text)
+            incoming.prefer_audio = True
+    elif message_data.get("imageMessage"):
+        incoming.is_image = True
+        logger.info("[%s] Buscando imagem completa via fetch_media_base64", user_id)
+        try:
+            media_result = await fetch_media_base64(message_key_id, "image", remotejid=user_id)
+            if "error" in media_result:
+                logger.error("[%s] Falha ao buscar imagem completa: %s", user_id, media_result['error'])
+                incoming.error_reply = {"text": f"Falha ao buscar imagem completa: {media_result['error']}"}
+            elif media_result.get("type") == "image":
+                logger.debug("[%s] Imagem completa obtida, mimetype: %s, %s bytes", user_id, media_result['mimetype'], len(media_result['data']))
+                prepared = await prepare_image_for_vision(media_result["data"])
+                if not prepared:
+                    logger.error("[%s] Falha ao redimensionar imagem", user_id)
+                    incoming.error_reply = {"text": "Falha ao redimensionar imagem. Por favor, envie outra imagem ou descreva o produto."}
+                else:
+                    image_description = await analyze_image(content=prepared.base64, mimetype=prepared.mimetype, image_hash=prepared.phash, image_digest=prepared.digest)
+                    if image_description.startswith("Erro"):
+                        logger.error("[%s] Falha ao analisar imagem: %s", user_id, image_description)
+                        incoming.error_reply = {"text": f"Falha ao analisar imagem: {image_description}"}
+                    else:
+                        logger.info("[%s] Imagem analisada, descrição: %s", user_id, image_description)
+                        incoming.image_description = image_description
+                        incoming.text = f"Imagem recebida: {image_description}"
+                        incoming.similar_products = await describe_similar_products(image_description)
+        except Exception as e:
+            logger.error("[%s] Erro ao processar imagem: %s", user_id, e)
+            incoming.error_reply = {"text": f"Erro ao processar imagem: {str(e)}"}
+    return incoming
+
+
+def _parse_agent_output(output) -> Dict:
+    response_data = str(output)
+    logger.debug("Resposta do agente (final_output): %s", response_data)
+    try:
+        response_data = json.loads(response_data)
+        if not isinstance(response_data, dict):
+            response_data = {"text": str(response_data)}
+    except json.JSONDecodeError:
+        logger.warning("Resposta não é um JSON válido, tratando como texto puro: %s", response_data)
+        response_data = {"text": response_data}
+    return response_data
+
+
+async def deliver_reply(
+    phone_number: str,
+    user_id: str,
+    response_data: Dict,
+    message: Optional[str],
+    message_key_id: str,
+    prefer_audio: bool,
+    is_audio_message: bool,
+) -> Tuple[bool, Dict]:
+    """Send stage: deliver the reply as audio, product images, an image or text.
+
+    Returns whether it was delivered and the reply as it should be recorded. Never raises.
+    """
+    success = False
+    try:
+        if prefer_audio and response_data.get("text"):
+            audio_path = await text_to_speech(response_data["text"])
+            if not audio_path.startswith("Erro"):
+                success = await outbound.send_audio(
+                    phone_number=phone_number,
+                    audio_path=audio_path,
+                    remotejid=user_id,
+                    message_key_id=message_key_id,
+                    message_text=message if not is_audio_message else None
+                )
+            else:
+                logger.error("Failed to generate audio: %s", audio_path)
+                response_data = {"text": "Desculpe, houve um problema ao gerar o áudio. Como posso ajudar?"}
+                success = await outbound.send_text(phone_number, response_data["text"], remotejid=user_id)
+        elif isinstance(response_data, dict) and response_data.get("products"):
+            batch = await media_sender.send_products(
+                phone_number, response_data["products"], message, remotejid=user_id, message_key_id=message_key_id,
+                message_text=message if not is_audio_message else None
+            )
+            response_data = {"text": batch.summary_text()}
+            success = await outbound.send_text(phone_number, response_data["text"], remotejid=user_id)
+        elif response_data.get("text"):
+            image_url_match = IMAGE_MARKDOWN.match(response_data.get("text", ""))
+            if image_url_match:
+                image_url = image_url_match.group(1)
+                caption = response_data.get("text", "").split("]")[0][2:] or "Imagem do produto"
+                success = await outbound.send_image(
+                    phone_number=phone_number,
+                    image_url=image_url,
+                    caption=caption,
+                    remotejid=user_id,
+                    message_key_id=message_key_id,
+                    message_text=message if not is_audio_message else None
+                )
+                if success:
+                    response_data = {"text": ""}  # Clear text to avoid duplication
+                else:
+                    logger.error("[%s] Falha ao enviar imagem: %s", user_id, image_url)
+                    response_data = {"text": "Desculpe, houve um problema ao enviar a imagem."}
+            if response_data.get("text"):  # Only send text if not empty
+                success = await outbound.send_text(phone_number, response_data["text"], remotejid=user_id)
+    except Exception as e:
+        logger.error("[%s] Erro ao enviar resposta: %s", user_id, str(e))
+        success = False
+    return success, response_data
+
+
+async def record_reply(user_id: str, thread_id: Optional[str], response_data: Dict) -> None:
+    """Append the assistant's reply to the conversation log. Never raises."""
+    try:
+        if response_data.get("text") or (isinstance(response_data, dict) and response_data.get("products")):
+            await record_turn(user_id, thread_id, "assistant", response_data.get("text", json.dumps(response_data)))
+            logger.debug("Added assistant response to conversation %s: %s", user_id, response_data)
+    except Exception as e:
+        logger.error("Failed to add assistant response to conversation %s: %s", user_id, str(e))
+
+
+def _root_cause(error: BaseException) -> BaseException:
+    while isinstance(error, BaseExceptionGroup) and error.exceptions:
+        error = error.exceptions[0]
+    return error
+
+
+async def process_webhook(data: Dict) -> Dict:
+    with trace(data.get("_request_id"), data.get("data", {}).get("key", {}).get("remoteJid")):
+        return await _process_webhook(data)
+
+
+async def _process_webhook(data: Dict) -> Dict:
+    """Process one webhook as a stage graph; independent stages run concurrently in task groups.
+
+    1. thread (get or create) ‖ history (waits for the thread only to import it) ‖ media
+    2. agent / product search, which needs all three
+    3. send ‖ recording the reply, when the recorded text does not depend on how the send went
+
+    A failing thread or history stage cancels its siblings and fails the webhook, as the sequential code
+    did; the media, send and record stages turn their errors into replies or log lines instead.
+    """
     try:
-        data = await request.json()
-        logger.info(f"Payload recebido: {data}")
-        
         user_id = data.get("data", {}).get("key", {}).get("remoteJid", "")
         phone_number = user_id
         push_name = data.get("data", {}).get("pushName", None)
-        logger.debug(f"Extracted phone_number: {phone_number}, user_id: {user_id}, pushName: {push_name}")
+        logger.debug("Extracted phone_number: %s, user_id: %s, pushName: %s", phone_number, user_id, push_name)
 
         if not phone_number or not user_id:
             logger.warning("Nenhum número de telefone ou user_id encontrado no payload")
             return {"status": "error", "message": "No phone number or user_id found"}
 
-        thread_id = await get_or_create_thread(user_id, push_name=push_name)
-        thread_history = await get_thread_history(thread_id)
-        logger.debug(f"Thread history for {thread_id}: {thread_history}")
-
         message_data = data.get("data", {}).get("message", {})
-        message = None
-        is_audio_message = False
-        is_image_message = False
         message_key_id = data.get("data", {}).get("key", {}).get("id", "")
-        response_data = {"text": "Desculpe, houve um problema ao processar sua mensagem. Como posso ajudar?"}
-        prefer_audio = False
-
-        if message_data.get("conversation"):
-            message = message_data["conversation"]
-            prefer_audio = "responda em áudio" in str(message).lower()
-        elif message_data.get("audioMessage"):
-            is_audio_message = True
-            media_result = await fetch_media_base64(message_key_id, "audio", remotejid=user_id)
-            if "error" in media_result:
-                logger.error(f"[{user_id}] Falha ao processar áudio: {media_result['error']}")
-                response_data = {"text": f"Falha ao processar áudio: {media_result['error']}"}
-            elif media_result.get("type") == "audio":
-                message = media_result["transcription"]
-                logger.info(f"Transcribed audio to: {message}")
-                prefer_audio = True
-        elif message_data.get("imageMessage"):
-            is_image_message = True
-            logger.info(f"[{user_id}] Buscando imagem completa via fetch_media_base64")
+
+        async with asyncio.TaskGroup() as stages:
+            thread_task = stages.create_task(get_or_create_thread(user_id, push_name=push_name))
+            history_task = stages.create_task(get_conversation_history(user_id, thread_task))
+            incoming_task = stages.create_task(load_incoming_message(message_data, message_key_id, user_id))
+        thread_id = thread_task.result()
+        thread_history = history_task.result()
+        incoming = incoming_task.result()
+        logger.debug("Conversation history for %s: %s", user_id, thread_history)
+
+        message = incoming.text
+        is_audio_message = incoming.is_audio
+        is_image_message = incoming.is_image
+        prefer_audio = incoming.prefer_audio
+        response_data = incoming.error_reply or {"text": "Desculpe, houve um problema ao processar sua mensagem. Como posso ajudar?"}
+        streamed = False
+        success = False
+
+        if incoming.image_description:
             try:
-                media_result = await fetch_media_base64(message_key_id, "image", remotejid=user_id)
-                if "error" in media_result:
-                    logger.error(f"[{user_id}] Falha ao buscar imagem completa: {media_result['error']}")
-                    response_data = {"text": f"Falha ao buscar imagem completa: {media_result['error']}"}
-                elif media_result.get("type") == "image":
-                    base64_data = media_result["base64"]
-                    mimetype = media_result["mimetype"]
-                    logger.debug(f"[{user_id}] Imagem completa obtida, mimetype: {mimetype}, tamanho base64: {len(base64_data)}")
-                    decoded_data = base64.b64decode(base64_data)
-                    resized_base64 = await resize_image_to_thumbnail(decoded_data, max_size=512)
-                    if not resized_base64:
-                        logger.error(f"[{user_id}] Falha ao redimensionar imagem")
-                        response_data = {"text": "Falha ao redimensionar imagem. Por favor, envie outra imagem ou descreva o produto."}
-                    else:
-                        image_description = await analyze_image(content=resized_base64, mimetype=mimetype)
-                        if image_description.startswith("Erro"):
-                            logger.error(f"[{user_id}] Falha ao analisar imagem: {image_description}")
-                            response_data = {"text": f"Falha ao analisar imagem: {image_description}"}
-                        else:
-                            message = f"Imagem recebida: {image_description}\n\nHistórico da conversa:\n{thread_history}"
-                            logger.info(f"[{user_id}] Imagem analisada, descrição: {image_description}")
-                            await client.beta.threads.messages.create(
-                                thread_id=thread_id,
-                                role="user",
-                                content=message
-                            )
-                            logger.debug(f"Added image description to thread {thread_id}: {message}")
-                            response = await Runner.run(product_agent, input=message)
-                            logger.debug(f"RunResult: {response}")
-                            response_data = str(response.final_output)
-                            logger.debug(f"Resposta do agente (final_output): {response_data}")
-                            try:
-                                response_data = json.loads(response_data)
-                                if not isinstance(response_data, dict):
-                                    response_data = {"text": str(response_data)}
-                            except json.JSONDecodeError:
-                                logger.warning(f"Resposta não é um JSON válido, tratando como texto puro: {response_data}")
-                                response_data = {"text": response_data}
+                await record_turn(user_id, thread_id, "user", f"Imagem recebida: {incoming.image_description}")
+                logger.debug("Added image description to conversation %s: %s", user_id, incoming.image_description)
+                with span("agent_run"):
+                    agent_message = f"{message}\n\n{incoming.similar_products}".rstrip()
+                    response = await Runner.run(product_agent, input=build_agent_input(thread_history, agent_message))
+                record_run_usage(response)
+                logger.debug("RunResult: %s", response)
+                response_data = _parse_agent_output(response.final_output)
             except Exception as e:
-                logger.error(f"[{user_id}] Erro ao processar imagem: {e}")
+                logger.error("[%s] Erro ao processar imagem: %s", user_id, e)
                 response_data = {"text": f"Erro ao processar imagem: {str(e)}"}
 
         if not message:
             logger.warning("Nenhuma mensagem de texto, áudio ou imagem válida encontrada no payload")
-            response_data = {"text": "Nenhuma mensagem válida encontrada. Como posso ajudar?"}
+            if not incoming.error_reply:
+                response_data = {"text": "Nenhuma mensagem válida encontrada. Como posso ajudar?"}
 
-        # Extract and save lead information
+        # Enrich the lead in the background; the reply does not depend on it
         if message:
-            try:
-                extracted_info = await extract_lead_info(message, remotejid=user_id)
-                extracted_data = json.loads(extracted_info)
-                if "error" not in extracted_data:
-                    lead_data = LeadData(**extracted_data)
-                    await upsert_lead(user_id, lead_data)
-                    logger.debug(f"[{user_id}] Lead data saved: {extracted_data}")
-            except Exception as e:
-                logger.error(f"[{user_id}] Failed to extract or save lead info: {str(e)}")
+            spawn_background(enrich_lead(user_id, message))
+
+        # "ver mais" after a product list sends the next page of images
+        more_page = None
+        if message and is_more_request(message):
+            more_page = await media_sender.next_page(phone_number, remotejid=user_id, message_key_id=message_key_id, message_text=message)
 
+        if more_page:
+            response_data = {"text": more_page.summary_text()}
         # Handle product queries
-        if message and any(keyword in message.lower() for keyword in ["tênis", "sapato", "produto", "catálogo"]):
+        elif message and not is_image_message and any(keyword in message.lower() for keyword in ["tênis", "sapato", "produto", "catálogo"]):
             try:
                 product_query = ProductQuery(query=message)
-                product_result = await query_products(product_query)
+                product_result = await search_products(product_query)
                 product_data = json.loads(product_result)
                 if "error" not in product_data:
-                    for product in product_data:
-                        caption = f"{product.get('name', 'Produto')}, tamanho {product.get('size', 'N/A')}, R${product.get('price', 'N/A')}"
-                        image_url = product.get('image_url')
-                        if image_url:
-                            success = await send_whatsapp_image(
-                                phone_number=phone_number,
-                                image_url=image_url,
-                                caption=caption,
-                                remotejid=user_id,
-                                message_key_id=message_key_id,
-                                message_text=message
-                            )
-                            if not success:
-                                logger.error(f"[{user_id}] Falha ao enviar imagem do produto: {image_url}")
-                                response_data = {"text": f"Falha ao enviar imagem do produto: {product.get('name', 'Produto')}"}
-                        else:
-                            logger.warning(f"[{user_id}] Produto sem image_url: {product.get('name')}")
-                            response_data = {"text": f"{caption}. Imagem não disponível."}
-                    response_data = {"text": f"Encontrei {len(product_data)} produto(s) para '{message}'. Deseja prosseguir com o pedido?"}
+                    batch = await media_sender.send_products(
+                        phone_number, product_data, message, remotejid=user_id, message_key_id=message_key_id, message_text=message
+                    )
+                    response_data = {"text": batch.summary_text()}
                 else:
                     response_data = {"text": product_data["error"]}
             except Exception as e:
-                logger.error(f"[{user_id}] Failed to query products: {str(e)}")
+                logger.error("[%s] Failed to query products: %s", user_id, str(e))
                 response_data = {"text": f"Erro ao consultar produtos: {str(e)}"}
         # Handle image requests or other messages
         elif message and not is_image_message:
             try:
-                full_message = f"Histórico da conversa:\n{thread_history}\n\nNova mensagem: {message}"
-                await client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="user",
-                    content=message
-                )
-                logger.debug(f"Added user message to thread {thread_id}: {message}")
-                agent = triage_agent if not any(keyword in message.lower() for keyword in ["imagem", "foto"]) else product_agent
-                response = await Runner.run(agent, input=full_message)
-                logger.debug(f"RunResult: {response}")
-                response_data = str(response.final_output)
-                logger.debug(f"Resposta do agente (final_output): {response_data}")
-                try:
-                    response_data = json.loads(response_data)
-                    if not isinstance(response_data, dict):
-                        response_data = {"text": str(response_data)}
-                except json.JSONDecodeError:
-                    logger.warning(f"Resposta não é um JSON válido, tratando como texto puro: {response_data}")
-                    response_data = {"text": response_data}
+                agent_input = build_agent_input(thread_history, message)
+                await record_turn(user_id, thread_id, "user", message)
+                logger.debug("Added user message to conversation %s: %s", user_id, message)
+                decision = intent_router.classify(message) if INTENT_ROUTER_ENABLED else None
+                route = decision.route if decision else "triage"
+                route_count, route_time = route_metrics(route)
+                route_count.inc()
+                route_started = time.monotonic()
+                logger.info("[%s] Rota '%s' (intenção=%s, confiança=%.2f)", user_id, route, decision.intent if decision else None, decision.confidence if decision else 0)
+                if decision and decision.canned_reply:
+                    response_data = {"text": decision.canned_reply}
+                else:
+                    agent = SPECIALIST_AGENTS[decision.specialist] if decision and decision.specialist else triage_agent
+                    if STREAM_REPLIES and not prefer_audio:
+                        response_data, success, last_agent = await stream_agent_reply(
+                            agent, agent_input, phone_number, user_id, message_key_id=message_key_id, message_text=message
+                        )
+                        streamed = True
+                    else:
+                        with span("agent_run"):
+                            response = await Runner.run(agent, input=agent_input)
+                        record_run_usage(response)
+                        logger.debug("RunResult: %s", response)
+                        last_agent = response.last_agent
+                        response_data = _parse_agent_output(response.final_output)
+                    if agent is triage_agent and INTENT_ROUTER_ENABLED:
+                        learned_intent = AGENT_INTENTS.get(getattr(last_agent, "name", None))
+                        if learned_intent:
+                            spawn_background(intent_router.log_example(message, learned_intent))
+                route_time.observe(time.monotonic() - route_started)
             except Exception as e:
-                logger.error(f"Failed to process message in thread {thread_id}: {str(e)}")
+                logger.error("Failed to process message in thread %s: %s", thread_id, str(e))
                 response_data = {"text": f"Erro ao processar mensagem: {str(e)}"}
 
-        # Handle response sending
-        success = False
-        if prefer_audio and response_data.get("text"):
-            audio_path = await text_to_speech(response_data["text"])
-            if not audio_path.startswith("Erro"):
-                success = await send_whatsapp_audio(
-                    phone_number=phone_number,
-                    audio_path=audio_path,
-                    remotejid=user_id,
-                    message_key_id=message_key_id,
-                    message_text=message if not is_audio_message else None
-                )
-                if os.path.exists(audio_path):
-                    os.remove(audio_path)
-                    logger.debug(f"Removed audio file: {audio_path}")
-            else:
-                logger.error(f"Failed to generate audio: {audio_path}")
-                response_data = {"text": "Desculpe, houve um problema ao gerar o áudio. Como posso ajudar?"}
-                success = await send_whatsapp_message(phone_number, response_data["text"], remotejid=user_id)
-        else:
-            if isinstance(response_data, dict) and response_data.get("products"):
-                for product in response_data["products"]:
-                    caption = f"{product.get('name', 'Produto')}, tamanho {product.get('size', 'N/A')}, R${product.get('price', 'N/A')}"
-                    image_url = product.get("image_url")
-                    if image_url:
-                        success = await send_whatsapp_image(
-                            phone_number=phone_number,
-                            image_url=image_url,
-                            caption=caption,
-                            remotejid=user_id,
-                            message_key_id=message_key_id,
-                            message_text=message
-                        )
-                        if not success:
-                            logger.error(f"[{user_id}] Falha ao enviar imagem do produto: {image_url}")
-                            response_data = {"text": f"Falha ao enviar imagem do produto: {product.get('name', 'Produto')}"}
-                    else:
-                        logger.warning(f"[{user_id}] Produto sem image_url: {product.get('name')}")
-                        response_data = {"text": f"{caption}. Imagem não disponível."}
-                response_data = {"text": f"Encontrei {len(response_data['products'])} produto(s) para '{message}'. Deseja prosseguir com o pedido?"}
-            elif response_data.get("text"):
-                image_url_match = re.match(r'!\[.*?\]\((.*?)\)', response_data.get("text", ""))
-                if image_url_match:
-                    image_url = image_url_match.group(1)
-                    caption = response_data.get("text", "").split("]")[0][2:] or "Imagem do produto"
-                    success = await send_whatsapp_image(
-                        phone_number=phone_number,
-                        image_url=image_url,
-                        caption=caption,
-                        remotejid=user_id,
-                        message_key_id=message_key_id,
-                        message_text=message if not is_audio_message else None
-                    )
-                    if success:
-                        response_data = {"text": ""}  # Clear text to avoid duplication
-                    else:
-                        logger.error(f"[{user_id}] Falha ao enviar imagem: {image_url}")
-                        response_data = {"text": "Desculpe, houve um problema ao enviar a imagem."}
-                if response_data.get("text"):  # Only send text if not empty
-                    success = await send_whatsapp_message(phone_number, response_data["text"], remotejid=user_id)
+        # Send the reply (streamed replies were already delivered). Plain text is recorded while it is
+        # being sent; audio, product and image replies are recorded as they turned out after the send.
+        reply_text = response_data.get("text") or ""
+        record_early = streamed or (not prefer_audio and not response_data.get("products") and not IMAGE_MARKDOWN.match(reply_text))
+        async with asyncio.TaskGroup() as stages:
+            if record_early:
+                stages.create_task(record_reply(user_id, thread_id, response_data))
+            if not streamed:
+                delivery = stages.create_task(deliver_reply(
+                    phone_number, user_id, response_data, message, message_key_id, prefer_audio, is_audio_message
+                ))
+        if not streamed:
+            success, response_data = delivery.result()
+        if not record_early:
+            await record_reply(user_id, thread_id, response_data)
 
-        try:
-            if response_data.get("text") or (isinstance(response_data, dict) and response_data.get("products")):
-                await client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="assistant",
-                    content=response_data.get("text", json.dumps(response_data))
-                )
-                logger.debug(f"Added assistant response to thread {thread_id}: {response_data}")
-        except Exception as e:
-            logger.error(f"Failed to add assistant response to thread {thread_id}: {str(e)}")
-            response_data = {"text": f"Erro ao salvar resposta do assistente: {str(e)}"}
-            success = await send_whatsapp_message(phone_number, response_data["text"], remotejid=user_id)
-
-        lead_data = LeadData(remotejid=user_id)
-        if message and "cidade:" in message.lower():
-            lead_data.cidade = message.lower().split("cidade:")[1].strip().split()[0]
-        if message and "estado:" in message.lower():
-            lead_data.estado = message.lower().split("estado:")[1].strip().split()[0]
-        if message and "email:" in message.lower():
-            lead_data.email = message.lower().split("email:")[1].strip().split()[0]
-        if any(field is not None for field in [lead_data.cidade, lead_data.estado, lead_data.email]):
-            logger.debug(f"Updating lead with additional info: {lead_data.dict(exclude_unset=True)}")
-            await upsert_lead(user_id, lead_data)
+        received_at = data.get("_received_at")
+        if success and received_at:
+            reply_latency.observe(time.monotonic() - received_at)
 
         if success:
-            logger.info(f"[{user_id}] Mensagem enviada com sucesso")
+            logger.info("[%s] Mensagem enviada com sucesso", user_id)
             return {"status": "success", "message": "Processed and responded"}
         else:
-            logger.error(f"[{user_id}] Falha ao enviar resposta para o WhatsApp")
+            logger.error("[%s] Falha ao enviar resposta para o WhatsApp", user_id)
             return {"status": "error", "message": "Failed to send response"}
 
     except Exception as e:
-        logger.error(f"Erro ao processar webhook: {str(e)}")
-        return {"status": "error", "message": f"Error processing webhook: {str(e)}"}
\ No newline at end of file
+        e = _root_cause(e)
+        logger.error("Erro ao processar webhook: %s", str(e))
+        return {"status": "error", "message": f"Error processing webhook: {str(e)}"}
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    try:
+        data = await request.json()
+    except Exception as e:
+        logger.warning("Payload inválido recebido: %s", str(e))
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Invalid JSON payload"})
+    logger.debug("Payload recebido: %s", data)
+
+    if not isinstance(data, dict) or not isinstance(data.get("data"), dict):
+        logger.warning("Payload sem campo 'data'")
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing data field"})
+    if not data["data"].get("key", {}).get("remoteJid"):
+        logger.warning("Nenhum número de telefone ou user_id encontrado no payload")
+        return {"status": "error", "message": "No phone number or user_id found"}
+    logger.info("Webhook recebido: evento=%s id=%s remoteJid=%s", data.get("event"), data["data"]["key"].get("id"), data["data"]["key"]["remoteJid"])
+
+    reason = skip_reason(data)
+    if reason:
+        metrics.counter("webhook_skipped_total", "Webhooks ignorados sem processamento", reason=reason).inc()
+        logger.debug("Webhook ignorado (%s)", reason)
+        return {"status": "ignored", "reason": reason}
+    message_id = data["data"]["key"].get("id")
+    if message_id and not idempotency_store.claim(message_id):
+        logger.info("Webhook duplicado ignorado: %s", message_id)
+        return {"status": "duplicate"}
+
+    data["_received_at"] = time.monotonic()
+    data["_request_id"] = message_id or new_request_id()
+    try:
+        conversation_scheduler.check_capacity(data["data"]["key"]["remoteJid"])
+        webhook_queue.put_nowait(data)
+    except QueueFullError as e:
+        logger.error(str(e))
+        if message_id:
+            idempotency_store.release(message_id)
+        return JSONResponse(status_code=503, content={"status": "error", "message": "Queue full, retry later"})
+    return {"status": "queued"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "webhook_queue": webhook_queue.stats(),
+        "conversation_scheduler": conversation_scheduler.stats(),
+        "supabase": supabase_pool.stats(),
+        "lead_store": lead_store.stats(),
+        "product_catalog": product_catalog.stats(),
+        "product_embeddings": product_embeddings.stats(),
+        "tts_cache": audio_cache.stats(),
+        "vision_cache": vision_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "intent_router": intent_router.stats(),
+        "media_sender": media_sender.stats(),
+        "outbound": outbound.stats(),
+        "idempotency": idempotency_store.stats(),
+        "caches": {"leads": lead_cache.stats(), "threads": thread_cache.stats()},
+        "metrics": metrics.snapshot(),
+    }
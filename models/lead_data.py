@@ -1,6 +1,6 @@
 # models/lead_data.py
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 
 class LeadData(BaseModel):
     nome_cliente: Optional[str] = Field(None, description="Nome completo do cliente")
@@ -33,4 +33,14 @@ class LeadData(BaseModel):
     verificador: Optional[int] = Field(None, description="Verificador do lead")
     id_kommo: Optional[int] = Field(None, description="ID do Kommo")
     msg_erro: Optional[str] = Field(None, description="Mensagem de erro associada")
-    sentimento: Optional[str] = Field(None, description="Sentimento da mensagem (positivo, negativo, neutro)")
\ No newline at end of file
+    sentimento: Optional[str] = Field(None, description="Sentimento da mensagem (positivo, negativo, neutro)")
+
+
+class LeadClassification(BaseModel):
+    """Campos do lead inferidos pelo LLM em uma única chamada com saída estruturada."""
+    tipo: Optional[Literal["lojista", "revendedor", "sacoleiro", "feirante"]] = Field(None, description="Tipo de comerciante mencionado na mensagem, ou null se nenhum")
+    sentimento: Literal["positivo", "negativo", "neutro"] = Field(..., description="Sentimento da mensagem")
+
+
+class LeadClassificationComIdioma(LeadClassification):
+    idioma: str = Field(..., description="Nome do idioma principal da mensagem em português (ex.: 'português')")
@@ -1,27 +1,163 @@
+import asyncio
 import hashlib
 import os
+from typing import Dict, Iterable, Optional
 from openai import AsyncOpenAI
-from config.config import OPENAI_API_KEY
+from config.config import OPENAI_API_KEY, TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+from utils import metrics
 from utils.logging_setup import setup_logging
+from utils.tracing import traced, record_llm_call
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def text_to_speech(text: str) -> str:
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+STREAM_CHUNK_SIZE = 16384
+
+# Fixed replies the agents and the webhook send verbatim; synthesized once at startup.
+PREWARM_PHRASES = (
+    "Olá! Como posso ajudar com seus calçados hoje?",
+    "Não encontrei esse produto, posso verificar com a equipe. Pode mandar mais detalhes, como cor ou tamanho?",
+    "Desculpe, houve um problema ao processar sua mensagem. Como posso ajudar?",
+    "Nenhuma mensagem válida encontrada. Como posso ajudar?",
+    "Por nada! Se precisar de mais alguma coisa, é só chamar.",
+)
+
+
+class AudioCache:
+    """Size-bounded on-disk LRU of synthesized audio, keyed by (text, voice, model).
+
+    Hits refresh the file's mtime; when the directory exceeds `max_bytes` the least recently used
+    files are removed first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = metrics.counter("tts_cache_hits_total", "Áudios servidos do cache")
+        self.misses = metrics.counter("tts_cache_misses_total", "Áudios sintetizados via API")
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\n{voice}\n{text.strip()}".encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"audio_{key}.mp3")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return [(e.path, e.stat()) for e in it if e.is_file() and e.name.endswith(".mp3")]
+        except FileNotFoundError:
+            return []
+
+    def _evict(self, added: int) -> None:
+        if self._total_bytes is None:
+            self._total_bytes = sum(stat.st_size for _, stat in self._entries())
+        else:
+            self._total_bytes += added
+        if self._total_bytes <= self.max_bytes:
+            return
+        for path, stat in sorted(self._entries(), key=lambda entry: entry[1].st_mtime):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= stat.st_size
+                logger.debug("Áudio removido do cache: %s", path)
+            except FileNotFoundError:
+                pass
+
+    async def _synthesize(self, key: str, text: str, voice: str, model: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        size = 0
+        try:
+            async with client.audio.speech.with_streaming_response.create(model=model, voice=voice, input=text.strip()) as response:
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.iter_bytes(chunk_size=STREAM_CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+            record_llm_call(model, operation="speech")
+            if size == 0:
+                raise ValueError("Resposta de áudio vazia")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(size)
+        return path
+
+    async def get_or_synthesize(self, text: str, voice: str, model: str) -> str:
+        key = self.key(text, voice, model)
+        path = self.get(key)
+        if path:
+            self.hits.inc()
+            return path
+        # Concurrent requests for the same phrase share one synthesis.
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+        self.misses.inc()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            path = await self._synthesize(key, text, voice, model)
+            future.set_result(path)
+            return path
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when no one else is waiting.
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        total = self.hits.value + self.misses.value
+        return {
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_rate": round(self.hits.value / total, 4) if total else None,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+audio_cache = AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+
+@traced("text_to_speech")
+async def text_to_speech(text: str, voice: str = TTS_VOICE, model: str = TTS_MODEL) -> str:
+    """Return the path of an MP3 for `text`, synthesizing and caching it on a miss.
+
+    The file belongs to the cache; callers must not delete it.
+    """
     try:
         if not text or not text.strip():
             raise ValueError("Texto vazio ou inválido")
-        logger.debug(f"Convertendo texto para áudio: {text[:50]}...")
-        response = await client.audio.speech.create(
-            model="tts-1",
-            voice="nova",
-            input=text.strip()
-        )
-        output_file = f"audio_{hashlib.md5(text.encode()).hexdigest()}.mp3"
-        with open(output_file, "wb") as f:
-            f.write(response.content)
-        logger.info(f"Áudio MP3 salvo: {output_file}")
+        logger.debug("Convertendo texto para áudio: %s...", text[:50])
+        output_file = await audio_cache.get_or_synthesize(text, voice, model)
+        logger.info("Áudio MP3 disponível: %s", output_file)
         return output_file
     except Exception as e:
-        logger.error(f"Erro ao processar áudio: {str(e)}")
-        return f"Erro ao processar áudio: {str(e)}"
\ No newline at end of file
+        logger.error("Erro ao processar áudio: %s", str(e))
+        return f"Erro ao processar áudio: {str(e)}"
+
+
+async def prewarm_tts_cache(phrases: Iterable[str] = PREWARM_PHRASES) -> None:
+    """Synthesize the fixed template replies ahead of time so their first use is a cache hit."""
+    for phrase in phrases:
+        result = await text_to_speech(phrase)
+        if result.startswith("Erro"):
+            logger.warning("Falha ao pré-aquecer áudio para: %s", phrase[:50])
@@ -0,0 +1,139 @@
+# tools/conversation_store.py
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+from config.config import CONVERSATION_DB_PATH, HISTORY_WINDOW, CONVERSATION_CACHE_USERS, HISTORY_TOKEN_BUDGET
+from utils import metrics
+from utils.logging_setup import setup_logging
+from utils.token_budget import count_tokens, ITEM_OVERHEAD_TOKENS
+
+logger = setup_logging(__name__)
+
+Turn = Tuple[str, str]
+
+history_tokens = metrics.histogram(
+    "agent_history_tokens", "Tokens de histórico enviados ao agente por mensagem", buckets=(50, 100, 250, 500, 1000, 1500, 2000, 4000, 8000)
+)
+history_trimmed = metrics.counter("agent_history_trimmed_turns_total", "Turnos de histórico descartados pelo orçamento de tokens")
+
+
+class ConversationStore:
+    """Append-only conversation log keyed by remoteJid.
+
+    Messages are persisted to SQLite (WAL) through a single-thread executor, so writes stay in
+    order and never block the event loop. The last `window` turns of recently active users are
+    kept in per-user ring buffers, so reading the history is O(1) and needs no I/O.
+    """
+
+    def __init__(self, path: str, window: int = 10, max_users: int = 5000):
+        self.path = path
+        self.window = window
+        self.max_users = max_users
+        self._rings: "OrderedDict[str, Deque[Turn]]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.ring_hits = metrics.counter("conversation_ring_hits_total", "Leituras de histórico servidas da memória")
+        self.ring_misses = metrics.counter("conversation_ring_misses_total", "Leituras de histórico carregadas do SQLite")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Runs on the executor thread only.
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, remotejid TEXT NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_remotejid_id ON messages (remotejid, id)")
+        return self._conn
+
+    def _insert(self, rows: List[Tuple[str, str, str, float]]) -> None:
+        self._connect().executemany(
+            "INSERT INTO messages (remotejid, role, content, created_at) VALUES (?, ?, ?, ?)", rows
+        )
+
+    def _select_last(self, remotejid: str, limit: int) -> List[Turn]:
+        rows = self._connect().execute(
+            "SELECT role, content FROM messages WHERE remotejid = ? ORDER BY id DESC LIMIT ?",
+            (remotejid, limit),
+        ).fetchall()
+        return [(role, content) for role, content in reversed(rows)]
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _remember(self, remotejid: str, turns: List[Turn]) -> Deque[Turn]:
+        ring = deque(turns, maxlen=self.window)
+        self._rings[remotejid] = ring
+        self._rings.move_to_end(remotejid)
+        while len(self._rings) > self.max_users:
+            self._rings.popitem(last=False)
+        return ring
+
+    async def append(self, remotejid: str, role: str, content: str) -> None:
+        """Record a turn. The in-memory view is updated before the write is persisted."""
+        ring = self._rings.get(remotejid)
+        if ring is not None:
+            ring.append((role, content))
+            self._rings.move_to_end(remotejid)
+        try:
+            await self._run(self._insert, [(remotejid, role, content, time.time())])
+        except Exception as e:
+            logger.error("[%s] Erro ao gravar mensagem no histórico local: %s", remotejid, e)
+
+    async def seed(self, remotejid: str, turns: List[Turn]) -> None:
+        """Import existing turns (e.g. from the OpenAI thread) for a user with no local history."""
+        if not turns:
+            return
+        now = time.time()
+        await self._run(self._insert, [(remotejid, role, content, now) for role, content in turns])
+        self._remember(remotejid, turns)
+
+    async def last_turns(self, remotejid: str, limit: Optional[int] = None) -> List[Turn]:
+        limit = min(limit or self.window, self.window)
+        ring = self._rings.get(remotejid)
+        if ring is not None:
+            self.ring_hits.inc()
+            self._rings.move_to_end(remotejid)
+        else:
+            self.ring_misses.inc()
+            # The executor is FIFO, so this read sees every write queued before it.
+            ring = self._remember(remotejid, await self._run(self._select_last, remotejid, self.window))
+        return list(ring)[-limit:]
+
+    async def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+
+
+def build_agent_input(turns: List[Turn], message: str, budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """Agent input as role items: the newest history turns that fit in `budget` tokens, then `message`.
+
+    Turns are passed verbatim, oldest first, and nothing volatile is rendered in front of them, so the
+    request starts with the agent's static instructions followed by the same bytes as the previous turn's
+    request. That keeps the prefix eligible for OpenAI's prompt caching until the budget starts trimming.
+    """
+    remaining = budget
+    kept: List[Dict[str, str]] = []
+    for role, content in reversed(turns):
+        cost = count_tokens(content) + ITEM_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        kept.append({"role": "assistant" if role == "assistant" else "user", "content": content})
+        remaining -= cost
+    kept.reverse()
+    if len(kept) < len(turns):
+        history_trimmed.inc(len(turns) - len(kept))
+    history_tokens.observe(budget - remaining)
+    return kept + [{"role": "user", "content": message}]
+
+
+conversation_store = ConversationStore(CONVERSATION_DB_PATH, window=HISTORY_WINDOW, max_users=CONVERSATION_CACHE_USERS)
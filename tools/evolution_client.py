@@ -0,0 +1,137 @@
+# tools/evolution_client.py
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import aiohttp
+from config.config import (
+    EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME,
+    EVOLUTION_CONNECTION_LIMIT, EVOLUTION_TIMEOUT_SECONDS, EVOLUTION_MAX_RETRIES, EVOLUTION_PRESENCE_CONNECTION_LIMIT,
+)
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class EvolutionResponse:
+    status: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (200, 201)
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class EvolutionClient:
+    """Evolution API client holding a single keep-alive aiohttp session for the whole app."""
+
+    def __init__(
+        self,
+        base_url: Optional[str],
+        token: Optional[str],
+        instance: Optional[str],
+        connection_limit: int = 20,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ):
+        self.base_url = (base_url or "").rstrip("/")
+        self.token = token
+        self.instance = instance
+        self.connection_limit = connection_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.retries = metrics.counter("evolution_retries_total", "Retentativas de chamadas à Evolution API")
+
+    @property
+    def configured(self) -> bool:
+        return all([self.base_url, self.token, self.instance])
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(limit_per_host=self.connection_limit, keepalive_timeout=60, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"apikey": self.token or "", "Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=min(10.0, self.timeout)),
+        )
+        logger.info("Sessão da Evolution API criada (limit_per_host=%s)", self.connection_limit)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: random point in [0, base * 2^attempt], capped.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def post(self, endpoint: str, payload: Dict[str, Any], remotejid: Optional[str] = None) -> EvolutionResponse:
+        """POST to `{base_url}/{endpoint}/{instance}`, retrying 429/5xx and failed connects with jittered backoff."""
+        if self._session is None or self._session.closed:
+            await self.start()
+        url = f"{self.base_url}/{endpoint}/{self.instance}"
+        latency = metrics.histogram("evolution_request_seconds", "Latência das chamadas à Evolution API", endpoint=endpoint)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                async with self._session.post(url, json=payload) as response:
+                    result = EvolutionResponse(response.status, await response.text())
+                    retry_after = response.headers.get("Retry-After")
+            except aiohttp.ClientConnectorError as e:
+                # Nothing reached the server, so retrying cannot duplicate a send.
+                latency.observe(time.monotonic() - started)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("[%s] Falha de conexão em %s: %s; nova tentativa em %.2fs", remotejid, endpoint, e, delay)
+            else:
+                latency.observe(time.monotonic() - started)
+                metrics.counter("evolution_responses_total", "Respostas da Evolution API por status", endpoint=endpoint, status=str(result.status)).inc()
+                if result.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return result
+                delay = self._backoff(attempt, retry_after)
+                logger.warning("[%s] %s retornou %s; nova tentativa em %.2fs", remotejid, endpoint, result.status, delay)
+            attempt += 1
+            self.retries.inc()
+            await asyncio.sleep(delay)
+
+
+evolution_client = EvolutionClient(
+    EVOLUTION_API_URL,
+    EVOLUTION_API_TOKEN,
+    EVOLUTION_INSTANCE_NAME,
+    connection_limit=EVOLUTION_CONNECTION_LIMIT,
+    timeout=EVOLUTION_TIMEOUT_SECONDS,
+    max_retries=EVOLUTION_MAX_RETRIES,
+)
+# sendPresence requests stay open for the whole presence delay; giving them their own small pool
+# keeps typing indicators from taking the connections replies are sent on.
+evolution_presence_client = EvolutionClient(
+    EVOLUTION_API_URL,
+    EVOLUTION_API_TOKEN,
+    EVOLUTION_INSTANCE_NAME,
+    connection_limit=EVOLUTION_PRESENCE_CONNECTION_LIMIT,
+    timeout=EVOLUTION_TIMEOUT_SECONDS,
+    max_retries=0,
+)
@@ -1,19 +1,113 @@
 # tools/extract_lead_info.py
 import re
 import json
+import unicodedata
 from typing import Dict, Optional
 from openai import AsyncOpenAI
 from config.config import OPENAI_API_KEY
-from models.lead_data import LeadData
+from models.lead_data import LeadData, LeadClassification, LeadClassificationComIdioma
 from utils.logging_setup import setup_logging
+from utils.tracing import traced, record_completion_usage
+from utils.llm_cache import llm_cache
 from datetime import datetime
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def extract_lead_info(message: str, remotejid: Optional[str] = None) -> str:
-    """Extract lead information from a message and return as JSON."""
-    logger.debug(f"Executing extract_lead_info for message: {message}, remotejid: {remotejid}")
+TRIVIAL_MESSAGES = {
+    "ok", "okay", "blz", "beleza", "certo", "sim", "nao", "s", "n", "ta", "ta bom", "tabom",
+    "obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw", "show", "top",
+    "entendi", "combinado", "perfeito", "kk", "kkk", "kkkk", "rs", "haha", "hum", "hmm",
+}
+
+CLASSIFICATION_MODEL = "gpt-4o-mini"
+
+CLASSIFICATION_PROMPT = """
+Analise a mensagem de um cliente de uma loja de calçados e classifique:
+- tipo: se o cliente mencionou ser um tipo de comerciante. Exemplos:
+  - "tenho loja", "sou lojista", "minha loja" → lojista
+  - "faço revenda", "sou revendedor", "vendo no atacado" → revendedor
+  - "vendo em casa", "sou sacoleiro", "vendo de porta em porta" → sacoleiro
+  - "vendo na feira", "sou feirante", "tenho barraca" → feirante
+  Use null se não for mencionado.
+- sentimento: positivo, negativo ou neutro. Exemplos:
+  - "Adorei os tênis!" → positivo
+  - "Não recebi meu pedido!" → negativo
+  - "Quero ver o catálogo" → neutro
+"""
+
+CLASSIFICATION_PROMPT_IDIOMA = "- idioma: nome do idioma principal da mensagem (ex.: 'português').\n"
+
+
+def _fold(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def is_trivial_message(message: str) -> bool:
+    """True for acknowledgements, emojis and punctuation, which carry nothing worth classifying."""
+    folded = re.sub(r"[^\w\s]", "", _fold(message)).strip()
+    folded = re.sub(r"\s+", " ", folded)
+    return not re.search(r"[a-z]", folded) or folded in TRIVIAL_MESSAGES
+
+
+async def classify_lead_message(message: str, include_idioma: bool = True, remotejid: Optional[str] = None) -> Dict:
+    """Return the LLM-inferred lead fields (tipo, sentimento and optionally idioma) validated against LeadData.
+
+    Results are memoized by normalized message, so repeated greetings and stock phrases skip the model.
+    """
+    response_format = LeadClassificationComIdioma if include_idioma else LeadClassification
+    prompt = CLASSIFICATION_PROMPT + (CLASSIFICATION_PROMPT_IDIOMA if include_idioma else "")
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": message}
+    ]
+
+    async def classify() -> Dict:
+        response = await client.beta.chat.completions.parse(
+            model=CLASSIFICATION_MODEL,
+            messages=messages,
+            response_format=response_format,
+            temperature=0.2
+        )
+        record_completion_usage(response, operation="lead_classification")
+        parsed = response.choices[0].message.parsed
+        if parsed is None:
+            logger.warning("[%s] Classificação recusada pelo modelo: %s", remotejid, response.choices[0].message.refusal)
+            return {}
+        fields = parsed.model_dump(exclude_none=True)
+        if "idioma" in fields and not fields["idioma"].strip():
+            del fields["idioma"]
+        return LeadData(**fields).model_dump(exclude_none=True)
+
+    try:
+        key = llm_cache.key(CLASSIFICATION_MODEL, messages, casefold=True, temperature=0.2, schema=response_format.__name__)
+        return await llm_cache.get_or_call("lead_classification", key, classify)
+    except Exception as e:
+        logger.error("[%s] Erro ao classificar mensagem do lead: %s", remotejid, str(e))
+        return {}
+
+
+def parse_inline_fields(message: str) -> Dict[str, str]:
+    """Parse the 'cidade: X', 'estado: Y' and 'email: Z' fields customers type into the message."""
+    fields = {}
+    lowered = message.lower()
+    for field in ("cidade", "estado", "email"):
+        marker = f"{field}:"
+        if marker in lowered:
+            value = lowered.split(marker)[1].strip().split()
+            if value:
+                fields[field] = value[0]
+    return fields
+
+
+@traced("extract_lead_info")
+async def extract_lead_info(message: str, remotejid: Optional[str] = None, known_idioma: Optional[str] = None) -> str:
+    """Extract lead information from a message and return as JSON.
+
+    Skips the LLM for trivial messages and leaves idioma out of the request when it is already known.
+    """
+    logger.debug("Executing extract_lead_info for message: %s, remotejid: %s", message, remotejid)
     try:
         lead_data = LeadData(remotejid=remotejid)
         extracted_data = {}
@@ -32,100 +126,27 @@ async def extract_lead_info(message: str, remotejid: Optional[str] = None) -> st
                 extracted_data[field] = match.group(0)
                 setattr(lead_data, field, match.group(0))
 
-        # Detect language using OpenAI
-        try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"Detecte o idioma principal da mensagem: '{message}'. Retorne apenas o nome do idioma (ex.: 'português')."
-                    }
-                ],
-                temperature=0.2
-            )
-            idioma = response.choices[0].message.content.strip()
-            if idioma:
-                extracted_data["idioma"] = idioma
-                lead_data.idioma = idioma
-        except Exception as e:
-            logger.error(f"[{remotejid}] Erro ao detectar idioma: {str(e)}")
-
-        # Map merchant type using OpenAI
-        merchant_types = {
-            "lojista": ["tenho loja", "sou lojista", "dono de loja", "tenho comércio", "sou comerciante", "gerencio uma loja", "minha loja"],
-            "revendedor": ["faço revenda", "sou revendedor", "revendo produtos", "sou vendedor", "vendo no atacado"],
-            "sacoleiro": ["vendo em casa", "sou sacoleiro", "vendo de porta em porta", "vendo por conta própria"],
-            "feirante": ["sou feirante", "vendo na feira", "tenho barraca", "trabalho na feira", "vendo no mercado"]
-        }
-        try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"""
-                        Analise a mensagem: '{message}'. 
-                        Determine se o usuário mencionou ser um tipo de comerciante (lojista, revendedor, sacoleiro, feirante).
-                        Exemplos:
-                        - "tenho loja" → lojista
-                        - "faço revenda" → revendedor
-                        - "vendo em casa" → sacoleiro
-                        - "vendo na feira" → feirante
-                        Retorne apenas o tipo de comerciante (ex.: 'lojista') ou 'nenhum' se não for mencionado.
-                        """
-                    }
-                ],
-                temperature=0.2
-            )
-            tipo = response.choices[0].message.content.strip()
-            if tipo != "nenhum":
-                extracted_data["tipo"] = tipo
-                lead_data.tipo = tipo
-        except Exception as e:
-            logger.error(f"[{remotejid}] Erro ao detectar tipo de comerciante: {str(e)}")
-
-        # Detect sentiment using OpenAI
-        try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"""
-                        Analise o sentimento da mensagem: '{message}'.
-                        Determine se o sentimento é positivo, negativo ou neutro.
-                        Exemplos:
-                        - "Adorei os tênis!" → positivo
-                        - "Não recebi meu pedido!" → negativo
-                        - "Quero ver o catálogo" → neutro
-                        Retorne apenas o sentimento (ex.: 'positivo', 'negativo', 'neutro').
-                        """
-                    }
-                ],
-                temperature=0.2
-            )
-            sentimento = response.choices[0].message.content.strip()
-            if sentimento in ["positivo", "negativo", "neutro"]:
-                extracted_data["sentimento"] = sentimento
-                lead_data.sentimento = sentimento
-        except Exception as e:
-            logger.error(f"[{remotejid}] Erro ao detectar sentimento: {str(e)}")
-
-        # Extract cidade and estado
-        if "cidade:" in message.lower():
-            extracted_data["cidade"] = message.lower().split("cidade:")[1].strip().split()[0]
-            lead_data.cidade = extracted_data["cidade"]
-        if "estado:" in message.lower():
-            extracted_data["estado"] = message.lower().split("estado:")[1].strip().split()[0]
-            lead_data.estado = extracted_data["estado"]
+        # Classify idioma, tipo and sentimento in a single structured-output call
+        if is_trivial_message(message):
+            logger.debug("[%s] Mensagem trivial, classificação via LLM ignorada", remotejid)
+        else:
+            classification = await classify_lead_message(message, include_idioma=not known_idioma, remotejid=remotejid)
+            for field, value in classification.items():
+                extracted_data[field] = value
+                setattr(lead_data, field, value)
+
+        # Typed "campo: valor" fields only fill what the patterns did not find (an email keeps its case)
+        for field, value in parse_inline_fields(message).items():
+            if field not in extracted_data:
+                extracted_data[field] = value
+                setattr(lead_data, field, value)
 
         # Update ult_contato
         extracted_data["ult_contato"] = datetime.now().isoformat()
         lead_data.ult_contato = extracted_data["ult_contato"]
 
-        logger.info(f"[{remotejid}] Extracted lead info: {extracted_data}")
+        logger.info("[%s] Extracted lead info: %s", remotejid, extracted_data)
         return json.dumps(extracted_data)
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao extrair informações do lead: {str(e)}")
+        logger.error("[%s] Erro ao extrair informações do lead: %s", remotejid, str(e))
         return json.dumps({"error": f"Erro ao extrair informações: {str(e)}"})
\ No newline at end of file
@@ -1,61 +1,153 @@
 # tools/image_tools.py
 import re
 import json
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
 from tenacity import retry, stop_after_attempt, wait_exponential
 from openai import AsyncOpenAI
 from config.config import OPENAI_API_KEY
 from tools.supabase_tools import upsert_lead
-from tools.whatsapp_tools import send_whatsapp_image
+from tools.outbound_dispatcher import outbound
 from utils.logging_setup import setup_logging
 from pydantic import BaseModel, Field
-from supabase import create_client, Client
-from config.config import SUPABASE_URL, SUPABASE_KEY
-import asyncio
-import base64
+from tools.supabase_client import supabase_pool
+from tools.product_catalog import product_catalog
 from agents import function_tool
+from config.config import VISION_DETAIL, VISION_CACHE_MAX_ENTRIES, VISION_CACHE_MAX_DISTANCE
+from utils import metrics
+from utils.tracing import traced, record_completion_usage
+from utils.llm_cache import llm_cache
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+VISION_MODEL = "gpt-4o-mini"
+
+class VisionDescriptionCache:
+    """Image descriptions keyed by the SHA-256 of the received bytes and by perceptual hash.
+
+    Byte-identical images (the same file forwarded again) always hit. A perceptual match only counts
+    within `max_distance` bits (0 by default: identical hashes), because two photos of different
+    products on the same backdrop can sit a few bits apart. Near matches are found through a
+    band index (any hash within d bits shares one of d+1 bands exactly) instead of a scan.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_distance: int = 0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._band_bits = 64 // (max_distance + 1)
+        self._by_digest: "OrderedDict[str, str]" = OrderedDict()
+        self._by_phash: "OrderedDict[int, str]" = OrderedDict()
+        self._bands: List[Dict[int, Set[int]]] = [{} for _ in range(max_distance + 1)]
+        self.hits = metrics.counter("vision_cache_hits_total", "Descrições de imagem servidas do cache")
+        self.misses = metrics.counter("vision_cache_misses_total", "Descrições de imagem geradas pelo modelo")
+
+    def _band_keys(self, image_hash: int) -> List[int]:
+        mask = (1 << self._band_bits) - 1
+        keys = [(image_hash >> (band * self._band_bits)) & mask for band in range(len(self._bands) - 1)]
+        # The last band takes the leftover bits when 64 does not divide evenly.
+        keys.append(image_hash >> ((len(self._bands) - 1) * self._band_bits))
+        return keys
+
+    def _match(self, image_hash: int) -> Optional[int]:
+        if image_hash in self._by_phash or not self.max_distance:
+            return image_hash if image_hash in self._by_phash else None
+        for band, key in zip(self._bands, self._band_keys(image_hash)):
+            for known in band.get(key, ()):
+                if (known ^ image_hash).bit_count() <= self.max_distance:
+                    return known
+        return None
+
+    def get(self, digest: Optional[str] = None, image_hash: Optional[int] = None) -> Optional[str]:
+        if digest is not None and digest in self._by_digest:
+            self.hits.inc()
+            self._by_digest.move_to_end(digest)
+            return self._by_digest[digest]
+        match = self._match(image_hash) if image_hash is not None else None
+        if match is None:
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        self._by_phash.move_to_end(match)
+        return self._by_phash[match]
+
+    def set(self, description: str, digest: Optional[str] = None, image_hash: Optional[int] = None) -> None:
+        if digest is not None:
+            self._by_digest[digest] = description
+            self._by_digest.move_to_end(digest)
+            while len(self._by_digest) > self.max_entries:
+                self._by_digest.popitem(last=False)
+        if image_hash is not None:
+            if image_hash not in self._by_phash:
+                for band, key in zip(self._bands, self._band_keys(image_hash)):
+                    band.setdefault(key, set()).add(image_hash)
+            self._by_phash[image_hash] = description
+            self._by_phash.move_to_end(image_hash)
+            while len(self._by_phash) > self.max_entries:
+                evicted, _ = self._by_phash.popitem(last=False)
+                for band, key in zip(self._bands, self._band_keys(evicted)):
+                    band[key].discard(evicted)
+                    if not band[key]:
+                        del band[key]
+
+    def stats(self) -> dict:
+        total = self.hits.value + self.misses.value
+        return {
+            "entries": len(self._by_phash),
+            "digests": len(self._by_digest),
+            "max_distance": self.max_distance,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_rate": round(self.hits.value / total, 4) if total else None,
+        }
+
+
+vision_cache = VisionDescriptionCache(max_entries=VISION_CACHE_MAX_ENTRIES, max_distance=VISION_CACHE_MAX_DISTANCE)
+
+
+@traced("analyze_image")
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-async def analyze_image(content: str, mimetype: str = "image/jpeg") -> str:
-    logger.debug(f"Analisando imagem... (tamanho base64: {len(content)})")
+async def analyze_image(content: str, mimetype: str = "image/jpeg", image_hash: Optional[int] = None, image_digest: Optional[str] = None) -> str:
+    """Describe the product in a base64 image; with `image_digest`/`image_hash`, repeated photos skip the vision call."""
+    logger.debug("Analisando imagem... (tamanho base64: %s)", len(content))
     try:
+        if image_hash is not None or image_digest is not None:
+            cached = vision_cache.get(image_digest, image_hash)
+            if cached:
+                logger.info("Descrição de imagem reaproveitada do cache (sha256 %s)", (image_digest or "-")[:12])
+                return cached
+
         match = re.match(r"^data:image/(?P<fmt>\w+);base64,(?P<data>.+)", content)
         if match:
             mimetype = f"image/{match.group('fmt')}"
             base64_data = match.group('data')
-            logger.info(f"Data URI detectado. Formato: {mimetype}")
+            logger.info("Data URI detectado. Formato: %s", mimetype)
         else:
             base64_data = content
-            logger.warning(f"Prefixo data:image não encontrado. Usando mimetype padrão: {mimetype}")
-
-        try:
-            base64.b64decode(base64_data, validate=True)
-            logger.info(f"Tamanho da imagem decodificada: {len(base64.b64decode(base64_data))} bytes")
-        except Exception as e:
-            logger.error(f"Erro ao decodificar imagem: {e}, Base64 inicial: {base64_data[:50]}")
-            return f"Erro ao decodificar imagem: {e}"
 
         image_data_url = f"data:{mimetype};base64,{base64_data}"
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Descreva o produto na imagem em português do Brasil."},
+                    {"type": "image_url", "image_url": {"url": image_data_url, "detail": VISION_DETAIL}}
+                ]
+            }
+        ]
 
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Descreva o produto na imagem em português do Brasil."},
-                        {"type": "image_url", "image_url": {"url": image_data_url}}
-                    ]
-                }
-            ],
-            temperature=0.4,
-        )
-        return response.choices[0].message.content
+        async def describe() -> Optional[str]:
+            response = await client.chat.completions.create(model=VISION_MODEL, messages=messages, temperature=0.4)
+            record_completion_usage(response, operation="vision")
+            return response.choices[0].message.content
+
+        # Exact repeats of the same bytes are also served across restarts from the persistent LLM cache.
+        description = await llm_cache.get_or_call("vision", llm_cache.key(VISION_MODEL, messages, temperature=0.4), describe)
+        if description:
+            vision_cache.set(description, image_digest, image_hash)
+        return description
     except Exception as e:
-        logger.error(f"Erro ao processar imagem: {e}")
+        logger.error("Erro ao processar imagem: %s", e)
         return f"Erro ao processar imagem: {e}"
 
 class ProductImageQuery(BaseModel):
@@ -64,44 +156,36 @@ class ProductImageQuery(BaseModel):
 
 @function_tool
 async def send_product_image(query: ProductImageQuery, phone_number: str, remotejid: Optional[str] = None) -> str:
-    if not all([SUPABASE_URL, SUPABASE_KEY]):
+    if not supabase_pool.configured:
         return json.dumps({"error": "Configurações do Supabase não estão completas"})
     try:
-        client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        loop = asyncio.get_running_loop()
-        query_lower = query.product_name.lower()
-        response = await loop.run_in_executor(None, lambda: client.table("products")
-            .select("name, size, price, image_url")
-            .ilike("name", f"%{query_lower}%")
-            .limit(1)
-            .execute())
-        if not response.data:
+        await product_catalog.ensure_loaded()
+        matches = product_catalog.search(query.product_name, k=1)
+        if not matches:
             return json.dumps({"error": f"Nenhum produto encontrado para: {query.product_name}"})
         
-        product = response.data[0]
+        product = matches[0]
         if not product.get("image_url"):
             return json.dumps({"error": f"Produto {product['name']} não tem imagem associada"})
 
         image_url = product["image_url"]
         if not re.match(r'^https?://', image_url):
-            logger.error(f"[{remotejid}] Formato de image_url inválido: {image_url}")
+            logger.error("[%s] Formato de image_url inválido: %s", remotejid, image_url)
             return json.dumps({"error": f"Formato de image_url inválido: {image_url}"})
         
         caption = f"{product['name']}, tamanho {product.get('size', 'N/A')}, R${product.get('price', 'N/A')}"
-        logger.debug(f"[{remotejid}] Preparando para enviar imagem, phone_number: {query.phone_number}")
-        success = await send_whatsapp_image(
+        logger.debug("[%s] Preparando para enviar imagem, phone_number: %s", remotejid, query.phone_number)
+        success = await outbound.send_image(
             phone_number=query.phone_number,
             image_url=image_url,
             caption=caption,
             remotejid=remotejid,
-            message_key_id=None,
-            message_text=None
         )
         if not success:
-            logger.error(f"[{remotejid}] Falha ao enviar imagem do produto {product['name']}")
+            logger.error("[%s] Falha ao enviar imagem do produto %s", remotejid, product['name'])
             return json.dumps({"error": f"Falha ao enviar imagem do produto {product['name']}"})
 
         return json.dumps({"text": ""})  # Return empty text to avoid duplicate messages
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao buscar ou enviar imagem do produto: {str(e)}")
+        logger.error("[%s] Erro ao buscar ou enviar imagem do produto: %s", remotejid, str(e))
         return json.dumps({"error": f"Erro ao buscar ou enviar imagem do produto: {str(e)}"})
\ No newline at end of file
@@ -0,0 +1,241 @@
+# tools/intent_router.py
+import asyncio
+import json
+import math
+import os
+import re
+from collections import Counter as TermCounter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from config.config import (
+    INTENT_TRAINING_PATH, INTENT_TRAINING_LOG, INTENT_TRAINING_MAX_BYTES, INTENT_ROUTE_THRESHOLD, INTENT_CANNED_THRESHOLD,
+)
+from tools.product_catalog import fold, stem
+from utils import metrics
+from utils.logging_setup import setup_logging, redact
+
+logger = setup_logging(__name__)
+
+# Contact details say nothing about intent; they are masked before an example is written.
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE_PATTERN = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+
+GREETING = "greeting"
+THANKS = "thanks"
+PRODUCT = "product"
+SUPPORT = "support"
+INTENTS = (GREETING, THANKS, PRODUCT, SUPPORT)
+
+# Replies sent without any model call; the greeting is the one the triage agent is instructed to use.
+CANNED_REPLIES = {
+    GREETING: "Olá! Como posso ajudar com seus calçados hoje?",
+    THANKS: "Por nada! Se precisar de mais alguma coisa, é só chamar.",
+}
+
+# Map the agent that produced a reply back to an intent label when logging traffic for training.
+AGENT_INTENTS = {"Product Agent": PRODUCT, "Support Agent": SUPPORT}
+
+_GREETING_WORDS = {
+    "oi", "oii", "oiii", "ola", "opa", "eai", "e", "ai", "bom", "boa", "dia", "tarde", "noite", "tudo",
+    "bem", "blz", "beleza", "hello", "hi", "salve", "como", "vai", "voce", "vc", "td",
+}
+_THANKS_WORDS = {
+    "obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw", "agradeco", "muito", "mt",
+    "ok", "certo", "show", "perfeito", "otimo", "ta", "bom", "entao", "de", "nada",
+}
+_THANKS_MARKERS = {"obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw", "agradeco"}
+_PRODUCT_RULE = re.compile(
+    r"\b(tenis|sapat\w*|sandalia\w*|chinel\w*|bota\w*|rasteir\w*|scarpin\w*|mocassi\w*|sapatilh\w*|"
+    r"catalogo|produto\w*|modelo\w*|numeracao|foto\w*|imagem|imagens|nike|adidas|puma|olympikus|mizuno)\b"
+)
+_SUPPORT_RULE = re.compile(
+    r"\b(pedido\w*|entreg\w*|rastrei\w*|codigo de rastreio|troca\w*|trocar|devolu\w*|devolver|reembols\w*|"
+    r"estorn\w*|cancel\w*|frete|prazo|pagamento|paguei|boleto|nota fiscal|garantia|defeito)\b"
+)
+
+# Seed examples so the classifier is usable before any traffic has been logged.
+SEED_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    ("oi", GREETING), ("olá, bom dia", GREETING), ("boa tarde", GREETING), ("boa noite, tudo bem?", GREETING),
+    ("opa, tudo bem?", GREETING), ("oi, td bem?", GREETING), ("bom dia!", GREETING), ("e aí", GREETING),
+    ("obrigado", THANKS), ("muito obrigada!", THANKS), ("valeu", THANKS), ("obg", THANKS),
+    ("ok, obrigado pela ajuda", THANKS), ("perfeito, obrigada", THANKS),
+    ("tem tênis nike?", PRODUCT), ("quero ver sandálias", PRODUCT), ("vocês têm bota feminina?", PRODUCT),
+    ("tem no número 38?", PRODUCT), ("quanto custa o puma?", PRODUCT), ("manda foto do modelo preto", PRODUCT),
+    ("tem rasteirinha branca?", PRODUCT), ("qual o preço da sapatilha?", PRODUCT), ("tem chinelo masculino?", PRODUCT),
+    ("quais cores vocês têm?", PRODUCT), ("tem tamanho 40?", PRODUCT),
+    ("onde está meu pedido?", SUPPORT), ("quero trocar um produto", SUPPORT), ("meu pedido não chegou", SUPPORT),
+    ("qual o prazo de entrega?", SUPPORT), ("como faço a devolução?", SUPPORT), ("quero cancelar a compra", SUPPORT),
+    ("qual o código de rastreio?", SUPPORT), ("o frete é grátis?", SUPPORT), ("já fiz o pagamento do pix", SUPPORT),
+    ("veio com defeito", SUPPORT),
+)
+
+
+def features(text: str) -> List[str]:
+    """Stemmed unigrams plus adjacent bigrams; stopwords are kept because they carry intent here."""
+    tokens = [stem(t) for t in re.findall(r"[a-z0-9]+", fold(text))]
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class NaiveBayesIntentModel:
+    """Multinomial Naive Bayes with Laplace smoothing over `features`."""
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts: TermCounter = TermCounter()
+        self.term_counts: Dict[str, TermCounter] = {}
+        self.total_terms: TermCounter = TermCounter()
+        self.vocabulary: set = set()
+
+    def fit(self, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesIntentModel":
+        for text, intent in examples:
+            terms = features(text)
+            if not terms:
+                continue
+            self.class_counts[intent] += 1
+            self.term_counts.setdefault(intent, TermCounter()).update(terms)
+            self.total_terms[intent] += len(terms)
+            self.vocabulary.update(terms)
+        return self
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Most likely intent and its posterior probability; (None, 0.0) when nothing is known."""
+        terms = [t for t in features(text) if t in self.vocabulary]
+        if not terms or not self.class_counts:
+            return None, 0.0
+        n_docs = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary)
+        scores = {}
+        for intent, docs in self.class_counts.items():
+            counts = self.term_counts[intent]
+            denominator = self.total_terms[intent] + self.alpha * vocab_size
+            scores[intent] = math.log(docs / n_docs) + sum(math.log((counts[t] + self.alpha) / denominator) for t in terms)
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        total = sum(math.exp(score - top) for score in scores.values())
+        return best, 1.0 / total
+
+
+@dataclass
+class IntentDecision:
+    intent: Optional[str]
+    confidence: float
+    source: str  # "rule", "model" or "none"
+
+    @property
+    def canned_reply(self) -> Optional[str]:
+        # Only exact rule matches get a canned reply; a model guess may hide a question behind a greeting.
+        if self.source == "rule" and self.intent in CANNED_REPLIES and self.confidence >= INTENT_CANNED_THRESHOLD:
+            return CANNED_REPLIES[self.intent]
+        return None
+
+    @property
+    def specialist(self) -> Optional[str]:
+        if self.intent in (PRODUCT, SUPPORT) and self.confidence >= INTENT_ROUTE_THRESHOLD:
+            return self.intent
+        return None
+
+    @property
+    def route(self) -> str:
+        if self.canned_reply:
+            return f"canned_{self.intent}"
+        return self.specialist or "triage"
+
+
+class IntentRouter:
+    """Rules first, then a Naive Bayes model trained on seed examples plus logged traffic.
+
+    With `log_examples`, traffic is logged as JSON lines ({"text": ..., "intent": ...}) at `training_path`,
+    labelled with the specialist the triage agent handed off to, so the model learns the routes triage
+    keeps choosing. Emails and phone numbers are masked, and the file rotates once at `max_bytes`.
+    """
+
+    def __init__(self, training_path: str, log_examples: bool = False, max_bytes: int = 5 * 1024 * 1024):
+        self.training_path = training_path
+        self.log_examples = log_examples
+        self.max_bytes = max_bytes
+        self.model = NaiveBayesIntentModel()
+        self.examples = 0
+        self.classify_time = metrics.histogram("intent_classify_seconds", "Tempo de classificação local de intenção")
+
+    def load(self) -> None:
+        examples = list(SEED_EXAMPLES)
+        for path in (f"{self.training_path}.1", self.training_path):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if row.get("intent") in INTENTS and row.get("text"):
+                            examples.append((row["text"], row["intent"]))
+            except Exception as e:
+                logger.error("Erro ao carregar exemplos de intenção de %s: %s", path, e)
+        self.model = NaiveBayesIntentModel().fit(examples)
+        self.examples = len(examples)
+        logger.info("Roteador de intenção treinado com %s exemplos", self.examples)
+
+    @staticmethod
+    def match_rules(text: str) -> Optional[str]:
+        folded = fold(text)
+        words = re.findall(r"[a-z]+", folded)
+        if not words or re.search(r"\d", folded):
+            return None
+        if set(words) <= _THANKS_WORDS and set(words) & _THANKS_MARKERS:
+            return THANKS
+        if set(words) <= _GREETING_WORDS and len(words) <= 6:
+            return GREETING
+        product = bool(_PRODUCT_RULE.search(folded))
+        support = bool(_SUPPORT_RULE.search(folded))
+        if product != support:
+            return PRODUCT if product else SUPPORT
+        return None
+
+    def classify(self, text: str) -> IntentDecision:
+        started = asyncio.get_running_loop().time()
+        try:
+            intent = self.match_rules(text)
+            if intent:
+                return IntentDecision(intent, 1.0, "rule")
+            intent, confidence = self.model.predict(text)
+            return IntentDecision(intent, confidence, "model" if intent else "none")
+        finally:
+            self.classify_time.observe(asyncio.get_running_loop().time() - started)
+
+    def _append(self, row: Dict) -> None:
+        line = json.dumps(row, ensure_ascii=False) + "\n"
+        try:
+            size = os.path.getsize(self.training_path)
+        except OSError:
+            size = 0
+        # Keep at most one rotated file, like logging's RotatingFileHandler with backupCount=1.
+        if size and size + len(line.encode("utf-8")) > self.max_bytes:
+            os.replace(self.training_path, f"{self.training_path}.1")
+        with open(self.training_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    async def log_example(self, text: str, intent: str) -> None:
+        """Record a labelled message (when INTENT_TRAINING_LOG is on); it is used the next time the router is trained."""
+        if not self.log_examples or intent not in INTENTS or not text:
+            return
+        text = PHONE_PATTERN.sub("<telefone>", EMAIL_PATTERN.sub("<email>", text))
+        try:
+            await asyncio.to_thread(self._append, redact({"text": text, "intent": intent}))
+        except Exception as e:
+            logger.error("Erro ao registrar exemplo de intenção: %s", e)
+
+    def stats(self) -> dict:
+        return {"examples": self.examples, "classify_seconds": self.classify_time.snapshot()}
+
+
+def route_metrics(route: str) -> Tuple[metrics.Counter, metrics.Histogram]:
+    return (
+        metrics.counter("intent_routes_total", "Mensagens por rota do roteador de intenção", route=route),
+        metrics.histogram("intent_route_seconds", "Tempo para gerar a resposta, por rota", route=route),
+    )
+
+
+intent_router = IntentRouter(INTENT_TRAINING_PATH, log_examples=INTENT_TRAINING_LOG, max_bytes=INTENT_TRAINING_MAX_BYTES)
+intent_router.load()
@@ -0,0 +1,189 @@
+# tools/lead_store.py
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+from postgrest.exceptions import APIError
+from config.config import LEAD_FLUSH_INTERVAL_SECONDS, LEAD_FLUSH_MAX_PENDING, LEAD_FLUSH_MAX_ATTEMPTS, LEAD_FLUSH_MAX_BACKOFF_SECONDS
+from tools.supabase_client import supabase_pool, SupabasePool
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+# SQLSTATE classes PostgREST answers with a 4xx: bad data (22), constraint violations (23), bad
+# columns or permissions (42). PGRST1xx/PGRST2xx are request and schema errors. Retrying won't help.
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+PERMANENT_PGRST_PREFIXES = ("PGRST1", "PGRST2")
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """True when Supabase rejected the request itself (4xx), as opposed to a timeout or an unavailable database."""
+    if not isinstance(error, APIError) or not error.code:
+        return False
+    code = str(error.code)
+    return code.startswith(PERMANENT_PGRST_PREFIXES) or (len(code) == 5 and code[:2] in PERMANENT_SQLSTATE_CLASSES)
+
+
+class LeadWriteBehindStore:
+    """Write-behind buffer for the `leads` table.
+
+    Field-level changes are merged per remotejid in memory and written in bulk upserts once the
+    flush timer fires or the number of pending leads reaches `max_pending`. Rows are grouped by
+    their column set before upserting, because PostgREST bulk upserts write every column of the
+    batch and would null out fields a row did not touch.
+
+    Transient failures are retried with exponential backoff, up to `max_attempts` per lead.
+    Rejected rows (see `is_permanent_error`) and rows out of attempts go to the dead-letter list
+    and the error log instead of being retried.
+    """
+
+    def __init__(self, pool: SupabasePool, flush_interval: float = 0.5, max_pending: int = 50, max_attempts: int = 8, max_backoff: float = 30.0):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._pending: Dict[str, Dict] = {}
+        self._inflight: Dict[str, Dict] = {}
+        self._attempts: Dict[str, int] = {}
+        self._failed_flushes = 0
+        self._dead_letters: Deque[Dict] = deque(maxlen=1000)
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.staged = metrics.counter("lead_store_staged_total", "Alterações de lead recebidas")
+        self.rows_written = metrics.counter("lead_store_rows_written_total", "Linhas gravadas no Supabase")
+        self.batches = metrics.counter("lead_store_batches_total", "Upserts em lote executados")
+        self.flush_errors = metrics.counter("lead_store_flush_errors_total", "Falhas ao gravar lote de leads")
+        self.dead_lettered = metrics.counter("lead_store_dead_letter_total", "Leads descartados após erro permanente ou tentativas esgotadas")
+
+    def stage(self, remotejid: str, fields: Dict) -> Dict:
+        """Merge `fields` into the pending row for `remotejid` and schedule a flush."""
+        row = self._pending.setdefault(remotejid, {"remotejid": remotejid})
+        row.update(fields)
+        self.staged.inc()
+        # While backing off, a full buffer waits for the retry timer instead of hammering Supabase.
+        if len(self._pending) >= self.max_pending and not self._failed_flushes:
+            self._spawn(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later())
+        return self.view(remotejid)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def view(self, remotejid: str, stored: Optional[Dict] = None) -> Dict:
+        """Return `stored` with unflushed and in-flight changes applied (read-your-writes)."""
+        merged = dict(stored or {})
+        merged.update(self._inflight.get(remotejid, {}))
+        merged.update(self._pending.get(remotejid, {}))
+        return merged
+
+    def has_pending(self, remotejid: str) -> bool:
+        return remotejid in self._pending or remotejid in self._inflight
+
+    def _retry_delay(self) -> float:
+        return min(self.flush_interval * 2 ** self._failed_flushes, self.max_backoff)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._retry_delay())
+        self._timer = None
+        await self.flush()
+
+    async def _upsert(self, rows: List[Dict]) -> None:
+        await self.pool.execute(lambda client: client.table("leads").upsert(
+            rows,
+            on_conflict="remotejid",
+            returning="minimal"
+        ), operation="upsert_leads_batch")
+        self.batches.inc()
+        self.rows_written.inc(len(rows))
+        for row in rows:
+            self._attempts.pop(row["remotejid"], None)
+
+    def _dead_letter(self, row: Dict, error: Exception) -> None:
+        self._attempts.pop(row["remotejid"], None)
+        self._dead_letters.append({"row": row, "error": str(error)})
+        self.dead_lettered.inc()
+        logger.error("Lead %s descartado após erro ao gravar: %s; linha: %s", row["remotejid"], error, row)
+
+    def _retry(self, row: Dict, error: Exception) -> None:
+        remotejid = row["remotejid"]
+        attempts = self._attempts.get(remotejid, 0) + 1
+        if attempts >= self.max_attempts:
+            self._dead_letter(row, error)
+            return
+        self._attempts[remotejid] = attempts
+        # Newer staged changes win over the failed ones.
+        self._pending[remotejid] = {**row, **self._pending.get(remotejid, {})}
+
+    async def _write_group(self, rows: List[Dict]) -> bool:
+        """Upsert one column group; returns False when rows were put back for a retry."""
+        try:
+            await self._upsert(rows)
+            logger.debug("Upsert em lote de %s leads: %s", len(rows), [row['remotejid'] for row in rows])
+            return True
+        except Exception as e:
+            self.flush_errors.inc()
+            if not is_permanent_error(e):
+                logger.error("Erro ao gravar lote de %s leads, serão regravados: %s", len(rows), e)
+                for row in rows:
+                    self._retry(row, e)
+                return False
+            if len(rows) == 1:
+                self._dead_letter(rows[0], e)
+                return True
+            logger.warning("Lote de %s leads rejeitado, gravando um a um: %s", len(rows), e)
+        # One bad row rejects the whole batch; write the rest individually so only it is dropped.
+        ok = True
+        for row in rows:
+            ok = await self._write_group([row]) and ok
+        return ok
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._inflight, self._pending = self._pending, {}
+            groups: Dict[frozenset, List[Dict]] = {}
+            for row in self._inflight.values():
+                groups.setdefault(frozenset(row), []).append(row)
+            ok = True
+            for rows in groups.values():
+                ok = await self._write_group(rows) and ok
+            self._failed_flushes = 0 if ok else self._failed_flushes + 1
+            self._inflight = {}
+        if self._pending and (self._timer is None or self._timer.done()):
+            self._timer = self._spawn(self._flush_later())
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        if self._pending:
+            logger.error("%s leads não puderam ser gravados no encerramento", len(self._pending))
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "staged": self.staged.value,
+            "rows_written": self.rows_written.value,
+            "batches": self.batches.value,
+            "flush_errors": self.flush_errors.value,
+            "retry_delay_seconds": self._retry_delay() if self._failed_flushes else 0.0,
+            "dead_lettered": self.dead_lettered.value,
+            "recent_dead_letters": [entry["row"]["remotejid"] for entry in list(self._dead_letters)[-10:]],
+        }
+
+
+lead_store = LeadWriteBehindStore(
+    supabase_pool,
+    flush_interval=LEAD_FLUSH_INTERVAL_SECONDS,
+    max_pending=LEAD_FLUSH_MAX_PENDING,
+    max_attempts=LEAD_FLUSH_MAX_ATTEMPTS,
+    max_backoff=LEAD_FLUSH_MAX_BACKOFF_SECONDS,
+)
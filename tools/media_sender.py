@@ -0,0 +1,187 @@
+# tools/media_sender.py
+import asyncio
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from config.config import (
+    MEDIA_MAX_IMAGES_PER_REPLY, MEDIA_RATE_PER_NUMBER, MEDIA_BURST_PER_NUMBER,
+    PRODUCT_PAGE_TTL_SECONDS,
+)
+from tools.product_catalog import fold
+from tools.outbound_dispatcher import outbound
+from utils import metrics
+from utils.cache import Cache, make_backend
+from utils.logging_setup import setup_logging
+from utils.rate_limiter import KeyedRateLimiter
+
+logger = setup_logging(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+NO_IMAGE = "no_image"
+
+# Replies that ask for the next page of a product list.
+MORE_REQUESTS = {"ver mais", "mais", "mostrar mais", "mostra mais", "manda mais", "mais opcoes", "quero ver mais", "tem mais"}
+
+
+def product_caption(product: Dict) -> str:
+    return f"{product.get('name', 'Produto')}, tamanho {product.get('size', 'N/A')}, R${product.get('price', 'N/A')}"
+
+
+def is_more_request(message: str) -> bool:
+    return " ".join(re.findall(r"[a-z]+", fold(message))) in MORE_REQUESTS
+
+
+@dataclass
+class MediaItemResult:
+    index: int
+    name: str
+    caption: str
+    status: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status == SENT
+
+
+@dataclass
+class ProductBatchResult:
+    query: str
+    total: int
+    items: List[MediaItemResult] = field(default_factory=list)
+    remaining: int = 0
+
+    @property
+    def sent(self) -> int:
+        return sum(item.ok for item in self.items)
+
+    @property
+    def failed(self) -> List[MediaItemResult]:
+        return [item for item in self.items if item.status == FAILED]
+
+    @property
+    def without_image(self) -> List[MediaItemResult]:
+        return [item for item in self.items if item.status == NO_IMAGE]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed and bool(self.items)
+
+    def summary_text(self) -> str:
+        lines = []
+        if self.without_image:
+            lines.append("Sem imagem disponível: " + "; ".join(item.caption for item in self.without_image) + ".")
+        if self.failed:
+            lines.append("Não consegui enviar a imagem de: " + ", ".join(item.name for item in self.failed) + ".")
+        if self.remaining:
+            lines.append(f"Tenho mais {self.remaining} produto(s). Responda \"ver mais\" para ver os próximos.")
+        lines.append(f"Encontrei {self.total} produto(s) para '{self.query}'. Deseja prosseguir com o pedido?")
+        return "\n".join(lines)
+
+
+class MediaSender:
+    """Queues product images on the outbound dispatcher, within a per-number rate limit.
+
+    Each reply carries at most `max_images` images; the rest of the list is kept per chat and sent
+    when the customer asks to "ver mais". The dispatcher's per-chat queue delivers them in list order;
+    captions are numbered ("2/7") so the customer can refer to a product by position.
+    """
+
+    def __init__(self, max_images: int, per_number: KeyedRateLimiter):
+        self.max_images = max_images
+        self.per_number = per_number
+        self.pages = Cache("product_pages", make_backend(), ttl=PRODUCT_PAGE_TTL_SECONDS)
+        self.send_time = metrics.histogram("media_send_seconds", "Tempo de envio de uma imagem, incluindo espera do limitador")
+        self.throttle_time = metrics.histogram("media_rate_limit_wait_seconds", "Espera imposta pelos limitadores de envio de mídia")
+
+    async def send_one(
+        self,
+        phone_number: str,
+        product: Dict,
+        index: int = 0,
+        total: int = 1,
+        remotejid: Optional[str] = None,
+        message_key_id: Optional[str] = None,
+        message_text: Optional[str] = None,
+    ) -> MediaItemResult:
+        remotejid = remotejid or phone_number
+        caption = product_caption(product)
+        numbered = f"{index + 1}/{total} · {caption}" if total > 1 else caption
+        name = product.get("name", "Produto")
+        image_url = product.get("image_url")
+        if not image_url:
+            logger.warning("[%s] Produto sem image_url: %s", remotejid, name)
+            metrics.counter("media_sends_total", "Envios de imagens de produto por status", status=NO_IMAGE).inc()
+            return MediaItemResult(index, name, caption, NO_IMAGE)
+        started = time.monotonic()
+        self.throttle_time.observe(await self.per_number.acquire(remotejid))
+        ok = await outbound.send_image(
+            phone_number=phone_number,
+            image_url=image_url,
+            caption=numbered,
+            remotejid=remotejid,
+            message_key_id=message_key_id,
+            message_text=message_text,
+        )
+        self.send_time.observe(time.monotonic() - started)
+        status = SENT if ok else FAILED
+        metrics.counter("media_sends_total", "Envios de imagens de produto por status", status=status).inc()
+        if not ok:
+            logger.error("[%s] Falha ao enviar imagem do produto: %s", remotejid, image_url)
+        return MediaItemResult(index, name, caption, status)
+
+    async def send_products(
+        self,
+        phone_number: str,
+        products: List[Dict],
+        query: str,
+        remotejid: Optional[str] = None,
+        message_key_id: Optional[str] = None,
+        message_text: Optional[str] = None,
+        offset: int = 0,
+    ) -> ProductBatchResult:
+        """Send one page of `products` starting at `offset` and remember the rest for "ver mais"."""
+        remotejid = remotejid or phone_number
+        page = products[offset:offset + self.max_images]
+        next_offset = offset + len(page)
+        # The dispatcher sends one chat's messages one at a time, so the whole page is queued at once.
+        items = await asyncio.gather(*(
+            self.send_one(phone_number, product, offset + i, len(products), remotejid, message_key_id, message_text)
+            for i, product in enumerate(page)
+        ))
+        result = ProductBatchResult(query=query, total=len(products), items=list(items), remaining=len(products) - next_offset)
+        if result.remaining:
+            self.pages.set(remotejid, {"products": products, "query": query, "offset": next_offset})
+        else:
+            self.pages.invalidate(remotejid)
+        logger.info("[%s] %s/%s imagens enviadas, %s restantes", remotejid, result.sent, len(page), result.remaining)
+        return result
+
+    def stash(self, remotejid: str, products: List[Dict], query: str, offset: int) -> None:
+        """Keep products that were not sent (e.g. beyond the cap of a streamed reply) for "ver mais"."""
+        if offset < len(products):
+            self.pages.set(remotejid, {"products": products, "query": query, "offset": offset})
+
+    async def next_page(self, phone_number: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> Optional[ProductBatchResult]:
+        remotejid = remotejid or phone_number
+        page = self.pages.get(remotejid)
+        if not page:
+            return None
+        return await self.send_products(
+            phone_number, page["products"], page["query"], remotejid, message_key_id, message_text, offset=page["offset"]
+        )
+
+    def stats(self) -> dict:
+        return {
+            "tracked_numbers": len(self.per_number),
+            "pages": self.pages.stats(),
+            "send_seconds": self.send_time.snapshot(),
+            "rate_limit_wait_seconds": self.throttle_time.snapshot(),
+        }
+
+
+media_sender = MediaSender(
+    max_images=MEDIA_MAX_IMAGES_PER_REPLY,
+    per_number=KeyedRateLimiter(MEDIA_RATE_PER_NUMBER, MEDIA_BURST_PER_NUMBER),
+)
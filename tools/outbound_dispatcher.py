@@ -0,0 +1,247 @@
+# tools/outbound_dispatcher.py
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from config.config import (
+    OUTBOUND_WORKERS, OUTBOUND_MAX_BATCH, OUTBOUND_MAX_TEXT_CHARS, OUTBOUND_PRESENCE,
+    OUTBOUND_RATE_PER_INSTANCE, OUTBOUND_BURST_PER_INSTANCE, EVOLUTION_PRESENCE_CONNECTION_LIMIT,
+)
+from tools.whatsapp_tools import send_whatsapp_message, send_whatsapp_image, send_whatsapp_audio, send_whatsapp_presence
+from utils import metrics
+from utils.logging_setup import setup_logging
+from utils.rate_limiter import TokenBucket
+
+logger = setup_logging(__name__)
+
+TEXT = "text"
+IMAGE = "image"
+AUDIO = "audio"
+# How long one presence update stays visible in the chat.
+PRESENCE_SECONDS = 3.0
+
+
+@dataclass
+class OutboundMessage:
+    kind: str
+    phone_number: str
+    remotejid: str
+    text: Optional[str] = None
+    image_url: Optional[str] = None
+    audio_path: Optional[str] = None
+    message_key_id: Optional[str] = None
+    message_text: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: Optional[asyncio.Future] = None
+
+
+class OutboundDispatcher:
+    """Every WhatsApp send goes through here: one ordered queue per remoteJid, drained by a shared worker pool.
+
+    A chat is held by at most one worker at a time, so its messages leave in the order they were queued,
+    also across webhooks. A worker takes everything queued for the chat as one batch: adjacent texts are
+    merged into a single sendText, "digitando..." is shown once for the batch, and every send takes a
+    token from the instance-wide rate limit. Callers get a future resolving to whether their message went out.
+    Presence updates run on their own Evolution connections and are skipped, not queued, when
+    `max_presence` of them are already open.
+    """
+
+    def __init__(self, workers: int, per_instance: TokenBucket, max_batch: int = 20, max_text_chars: int = 4000, presence: bool = True, max_presence: int = 4):
+        self.worker_count = workers
+        self.per_instance = per_instance
+        self.max_batch = max_batch
+        self.max_text_chars = max_text_chars
+        self.presence = presence
+        self.max_presence = max_presence
+        self._chats: Dict[str, Deque[OutboundMessage]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._presence_tasks: Set[asyncio.Task] = set()
+        self._presence_until: Dict[str, Tuple[float, str]] = {}
+        self.pending = metrics.gauge("outbound_pending", "Mensagens aguardando envio ao WhatsApp")
+        self.batch_size = metrics.histogram("outbound_batch_size", "Mensagens enviadas por lote de um chat", buckets=(1, 2, 3, 5, 8, 13, 21))
+        self.merged = metrics.counter("outbound_texts_merged_total", "Fragmentos de texto unidos a um sendText anterior")
+        self.wait_time = metrics.histogram("outbound_queue_wait_seconds", "Tempo entre enfileirar e iniciar o envio")
+        self.delivery_time = metrics.histogram("outbound_delivery_seconds", "Tempo entre enfileirar e a confirmação da Evolution API")
+        self.throttle_time = metrics.histogram("outbound_rate_limit_wait_seconds", "Espera imposta pelo limite de envios da instância")
+        self.presence_skipped = metrics.counter("outbound_presence_skipped_total", "Presenças descartadas por falta de conexão livre")
+
+    def _ensure_started(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i), name=f"outbound-worker-{i}") for i in range(self.worker_count)]
+        logger.info("Despachante de envios iniciado com %s workers", self.worker_count)
+
+    async def start(self) -> None:
+        self._ensure_started()
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        if not self._workers:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._chats:
+            logger.warning("Despachante encerrado com %s chat(s) pendentes", len(self._chats))
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._chats.values():
+            for message in queue:
+                self._settle(message, False)
+        self._chats.clear()
+        self.pending.set(0)
+
+    def enqueue(self, message: OutboundMessage) -> asyncio.Future:
+        """Queue `message` behind everything already queued for its chat; the future resolves to the send result."""
+        self._ensure_started()
+        message.future = asyncio.get_running_loop().create_future()
+        queue = self._chats.get(message.remotejid)
+        if queue is None:
+            # A chat is in `_chats` exactly while it is scheduled or being sent, so it is never scheduled twice.
+            queue = self._chats[message.remotejid] = deque()
+            self._ready.put_nowait(message.remotejid)
+        queue.append(message)
+        self.pending.inc()
+        return message.future
+
+    def enqueue_text(self, phone_number: str, text: str, remotejid: Optional[str] = None) -> asyncio.Future:
+        return self.enqueue(OutboundMessage(TEXT, phone_number, remotejid or phone_number, text=text))
+
+    def enqueue_image(self, phone_number: str, image_url: str, caption: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> asyncio.Future:
+        return self.enqueue(OutboundMessage(
+            IMAGE, phone_number, remotejid or phone_number, text=caption, image_url=image_url,
+            message_key_id=message_key_id, message_text=message_text,
+        ))
+
+    async def send_text(self, phone_number: str, text: str, remotejid: Optional[str] = None) -> bool:
+        return await self.enqueue_text(phone_number, text, remotejid)
+
+    async def send_image(self, phone_number: str, image_url: str, caption: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> bool:
+        return await self.enqueue_image(phone_number, image_url, caption, remotejid, message_key_id, message_text)
+
+    async def send_audio(self, phone_number: str, audio_path: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> bool:
+        return await self.enqueue(OutboundMessage(
+            AUDIO, phone_number, remotejid or phone_number, audio_path=audio_path,
+            message_key_id=message_key_id, message_text=message_text,
+        ))
+
+    def _group(self, batch: List[OutboundMessage]) -> List[List[OutboundMessage]]:
+        """Split a batch into sends: runs of adjacent texts become one message, up to `max_text_chars`."""
+        groups: List[List[OutboundMessage]] = []
+        for message in batch:
+            last = groups[-1] if groups else None
+            if (
+                last and message.kind == TEXT and last[0].kind == TEXT
+                and sum(len(m.text) + 2 for m in last) + len(message.text) <= self.max_text_chars
+            ):
+                last.append(message)
+                self.merged.inc()
+            else:
+                groups.append([message])
+        return groups
+
+    def _settle(self, message: OutboundMessage, ok: bool) -> None:
+        metrics.counter("outbound_messages_total", "Mensagens enviadas ao WhatsApp por tipo e status", kind=message.kind, status="sent" if ok else "failed").inc()
+        self.delivery_time.observe(time.monotonic() - message.enqueued_at)
+        if message.future is not None and not message.future.done():
+            message.future.set_result(ok)
+
+    def show_presence(self, phone_number: str, presence: str = "composing", remotejid: Optional[str] = None) -> None:
+        """Show "digitando..."/"gravando..." unless the chat is still showing the same one from an earlier batch."""
+        remotejid = remotejid or phone_number
+        now = time.monotonic()
+        shown_until, shown = self._presence_until.get(remotejid, (0.0, None))
+        if shown == presence and shown_until > now:
+            return
+        if len(self._presence_tasks) >= self.max_presence:
+            # A late "digitando..." is worthless; never let it wait for a connection.
+            self.presence_skipped.inc()
+            return
+        if len(self._presence_until) >= 10000:
+            self._presence_until = {jid: shown for jid, shown in self._presence_until.items() if shown[0] > now}
+        self._presence_until[remotejid] = (now + PRESENCE_SECONDS, presence)
+        # Not awaited: Evolution holds the request for the whole presence delay.
+        task = asyncio.create_task(send_whatsapp_presence(phone_number, presence, delay_ms=int(PRESENCE_SECONDS * 1000), remotejid=remotejid))
+        self._presence_tasks.add(task)
+        task.add_done_callback(self._presence_tasks.discard)
+
+    async def _send(self, group: List[OutboundMessage]) -> bool:
+        head = group[0]
+        if head.kind == TEXT:
+            return await send_whatsapp_message(head.phone_number, "\n\n".join(m.text for m in group), remotejid=head.remotejid)
+        if head.kind == IMAGE:
+            return await send_whatsapp_image(
+                phone_number=head.phone_number, image_url=head.image_url, caption=head.text, remotejid=head.remotejid,
+                message_key_id=head.message_key_id, message_text=head.message_text,
+            )
+        return await send_whatsapp_audio(
+            phone_number=head.phone_number, audio_path=head.audio_path, remotejid=head.remotejid,
+            message_key_id=head.message_key_id, message_text=head.message_text,
+        )
+
+    async def _send_batch(self, batch: List[OutboundMessage]) -> None:
+        self.batch_size.observe(len(batch))
+        if self.presence:
+            self.show_presence(batch[0].phone_number, "recording" if any(m.kind == AUDIO for m in batch) else "composing", batch[0].remotejid)
+        for group in self._group(batch):
+            now = time.monotonic()
+            for message in group:
+                self.wait_time.observe(now - message.enqueued_at)
+            self.throttle_time.observe(await self.per_instance.acquire())
+            try:
+                ok = await self._send(group)
+            except Exception as e:
+                logger.error("[%s] Erro ao enviar %s: %s", group[0].remotejid, group[0].kind, e)
+                ok = False
+            for message in group:
+                self._settle(message, ok)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            remotejid = await self._ready.get()
+            queue = self._chats[remotejid]
+            batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch))]
+            self.pending.dec(len(batch))
+            try:
+                await self._send_batch(batch)
+            except asyncio.CancelledError:
+                for message in batch:
+                    self._settle(message, False)
+                raise
+            except Exception as e:
+                logger.error("Erro no worker %s do despachante: %s", index, e)
+                for message in batch:
+                    self._settle(message, False)
+            finally:
+                if queue:
+                    self._ready.put_nowait(remotejid)
+                else:
+                    del self._chats[remotejid]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.worker_count,
+            "active_chats": len(self._chats),
+            "pending": self.pending.value,
+            "texts_merged": self.merged.value,
+            "presence_in_flight": len(self._presence_tasks),
+            "presence_skipped": self.presence_skipped.value,
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait_seconds": self.wait_time.snapshot(),
+            "delivery_seconds": self.delivery_time.snapshot(),
+            "rate_limit_wait_seconds": self.throttle_time.snapshot(),
+        }
+
+
+outbound = OutboundDispatcher(
+    workers=OUTBOUND_WORKERS,
+    per_instance=TokenBucket(OUTBOUND_RATE_PER_INSTANCE, OUTBOUND_BURST_PER_INSTANCE),
+    max_batch=OUTBOUND_MAX_BATCH,
+    max_text_chars=OUTBOUND_MAX_TEXT_CHARS,
+    presence=OUTBOUND_PRESENCE,
+    max_presence=EVOLUTION_PRESENCE_CONNECTION_LIMIT,
+)
@@ -0,0 +1,238 @@
+# tools/product_catalog.py
+import asyncio
+import math
+import re
+import time
+import unicodedata
+from collections import Counter as TermCounter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.config import PRODUCT_CATALOG_REFRESH_SECONDS
+from tools.supabase_client import supabase_pool
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "da", "do", "das", "dos", "em", "no", "na",
+    "nos", "nas", "para", "pra", "pro", "por", "com", "sem", "e", "ou", "que", "qual", "quais", "se",
+    "me", "eu", "voce", "voces", "vc", "vcs", "tem", "tens", "ter", "tenho", "ha", "quero", "queria",
+    "gostaria", "ver", "mostrar", "mostra", "manda", "mande", "enviar", "algum", "alguma", "alguns",
+    "algumas", "esse", "essa", "este", "esta", "isso", "meu", "minha", "seu", "sua", "mais", "muito",
+    "bom", "dia", "tarde", "noite", "ola", "oi", "favor", "obrigado", "obrigada", "ai", "ate", "tamanho",
+    "numero", "n", "preco", "reais", "r", "produto", "produtos", "catalogo", "modelo", "modelos",
+}
+
+# Light Portuguese stemmer: ordered (suffix, replacement, min stem length) rules, first match wins.
+_SUFFIX_RULES: Tuple[Tuple[str, str, int], ...] = (
+    ("zinhos", "", 3), ("zinhas", "", 3), ("zinho", "", 3), ("zinha", "", 3),
+    ("inhos", "", 3), ("inhas", "", 3), ("inho", "", 3), ("inha", "", 3),
+    ("oes", "ao", 2), ("aes", "ao", 2), ("ais", "al", 2), ("eis", "el", 2), ("ois", "ol", 2),
+    ("ns", "m", 2), ("res", "r", 2), ("les", "l", 2), ("zes", "z", 2), ("ses", "s", 2),
+    ("s", "", 2),
+)
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents ("Tênis Média" -> "tenis media")."""
+    normalized = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    for suffix, replacement, min_len in _SUFFIX_RULES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_len:
+            token = token[: -len(suffix)] + replacement
+            break
+    # Drop the final gender/number vowel so "preto"/"preta" and "sapato"/"sapatos" meet.
+    if len(token) > 3 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str, drop_stopwords: bool = True) -> List[str]:
+    tokens = re.findall(r"[a-z0-9]+", fold(text))
+    return [stem(t) for t in tokens if not (drop_stopwords and t in STOPWORDS) and not t.isdigit()]
+
+
+def parse_sizes(value) -> List[float]:
+    """Sizes offered by a product: '38', '34-39', '35, 36 e 37' -> numbers (ranges expanded)."""
+    text = str(value or "")
+    sizes = set()
+    for start, end in re.findall(r"(\d{2})\s*(?:-|a|ao|até)\s*(\d{2})", text):
+        sizes.update(float(n) for n in range(int(start), int(end) + 1))
+    sizes.update(float(n) for n in re.findall(r"\d{2}(?:[.,]5)?", text.replace(",5", ".5")))
+    return sorted(sizes)
+
+
+def parse_price(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace("R$", "").replace(",", ".").strip())
+    except ValueError:
+        return None
+
+
+def parse_query_filters(text: str) -> Dict[str, float]:
+    """Pull size and price hints out of a free-text request ("tênis 38 até 200 reais")."""
+    folded = fold(text)
+    filters: Dict[str, float] = {}
+    size = re.search(r"(?:tamanho|tam|numero|n[º°o]?)\s*(\d{2})\b", folded) or re.search(r"\b(3\d|4[0-8])\b(?!\s*(?:reais|r\$))", folded)
+    if size:
+        filters["size"] = float(size.group(1))
+    max_price = re.search(r"(?:ate|max(?:imo)?|menos de|abaixo de)\s*r?\$?\s*(\d+(?:[.,]\d+)?)", folded)
+    if max_price:
+        filters["max_price"] = float(max_price.group(1).replace(",", "."))
+    min_price = re.search(r"(?:acima de|mais de|a partir de|minimo)\s*r?\$?\s*(\d+(?:[.,]\d+)?)", folded)
+    if min_price:
+        filters["min_price"] = float(min_price.group(1).replace(",", "."))
+    return filters
+
+
+def matches_filters(product: Dict, size: Optional[float] = None, min_price: Optional[float] = None, max_price: Optional[float] = None) -> bool:
+    """Size/price check for a single product outside the index (e.g. semantic search hits)."""
+    sizes = parse_sizes(product.get("size"))
+    if size is not None and sizes and size not in sizes:
+        return False
+    price = parse_price(product.get("price"))
+    if price is not None:
+        if min_price is not None and price < min_price:
+            return False
+        if max_price is not None and price > max_price:
+            return False
+    return True
+
+
+class ProductCatalog:
+    """In-memory BM25 index over the `products` table, reloaded every `refresh_interval` seconds."""
+
+    K1 = 1.2
+    B = 0.75
+    NAME_BOOST = 2
+
+    def __init__(self, refresh_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self.products: List[Dict] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_len: List[int] = []
+        self._avg_len = 0.0
+        self._sizes: List[List[float]] = []
+        self._prices: List[Optional[float]] = []
+        self._loaded_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[List[Dict]], Awaitable[None]]] = []
+        self.search_time = metrics.histogram("product_search_seconds", "Tempo de busca no índice de produtos", buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+        self.refresh_errors = metrics.counter("product_catalog_refresh_errors_total", "Falhas ao recarregar o catálogo")
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def build(self, products: List[Dict]) -> None:
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_len = []
+        for idx, product in enumerate(products):
+            terms = tokenize(product.get("name", "")) * self.NAME_BOOST + tokenize(product.get("description", ""))
+            doc_len.append(len(terms))
+            for term, count in TermCounter(terms).items():
+                postings.setdefault(term, {})[idx] = count
+        # Swap everything at once so concurrent searches never see a half-built index.
+        self.products = products
+        self._postings = postings
+        self._doc_len = doc_len
+        self._avg_len = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+        self._sizes = [parse_sizes(p.get("size")) for p in products]
+        self._prices = [parse_price(p.get("price")) for p in products]
+        self._loaded_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        async with self._refresh_lock:
+            try:
+                response = await supabase_pool.execute(lambda client: client.table("products").select("*"), operation="load_products")
+                self.build(response.data or [])
+                logger.info("Catálogo de produtos carregado: %s produtos", len(self.products))
+            except Exception as e:
+                self.refresh_errors.inc()
+                logger.error("Erro ao carregar catálogo de produtos: %s", str(e))
+                raise
+            for listener in self._listeners:
+                try:
+                    await listener(self.products)
+                except Exception as e:
+                    logger.error("Erro ao notificar atualização do catálogo: %s", str(e))
+
+    def add_listener(self, callback: Callable[[List[Dict]], Awaitable[None]]) -> None:
+        """Register a coroutine called with the product list after every successful refresh."""
+        self._listeners.append(callback)
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.refresh()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                pass  # Already logged; keep serving the previous snapshot.
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """Load the catalog now and reload it every `refresh_interval` seconds."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    def _passes(self, idx: int, size: Optional[float], min_price: Optional[float], max_price: Optional[float]) -> bool:
+        if size is not None and self._sizes[idx] and size not in self._sizes[idx]:
+            return False
+        price = self._prices[idx]
+        if price is not None:
+            if min_price is not None and price < min_price:
+                return False
+            if max_price is not None and price > max_price:
+                return False
+        return True
+
+    def search(self, query: str, k: int = 10, size: Optional[float] = None, min_price: Optional[float] = None, max_price: Optional[float] = None) -> List[Dict]:
+        """Top-k products for `query`, ranked by BM25, after size/price filtering.
+
+        A query with no searchable terms ("tem catálogo?") browses the catalog in table order.
+        """
+        started = time.perf_counter()
+        try:
+            terms = tokenize(query)
+            if not terms:
+                return [p for i, p in enumerate(self.products) if self._passes(i, size, min_price, max_price)][:k]
+            n_docs = len(self.products)
+            scores: Dict[int, float] = {}
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for idx, tf in postings.items():
+                    norm = tf + self.K1 * (1 - self.B + self.B * self._doc_len[idx] / (self._avg_len or 1))
+                    scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.K1 + 1) / norm
+            ranked = sorted((idx for idx in scores if self._passes(idx, size, min_price, max_price)), key=lambda i: (-scores[i], i))
+            return [self.products[i] for i in ranked[:k]]
+        finally:
+            self.search_time.observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self.products),
+            "terms": len(self._postings),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            "search_seconds": self.search_time.snapshot(),
+        }
+
+
+product_catalog = ProductCatalog(refresh_interval=PRODUCT_CATALOG_REFRESH_SECONDS)
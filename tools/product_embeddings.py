@@ -0,0 +1,172 @@
+# tools/product_embeddings.py
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+from config.config import OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_CACHE_DIR
+from utils import metrics
+from utils.llm_cache import llm_cache
+from utils.logging_setup import setup_logging
+from utils.tracing import record_llm_call
+
+logger = setup_logging(__name__)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+EMBEDDING_BATCH_SIZE = 256
+
+
+def product_text(product: Dict) -> str:
+    return f"{product.get('name') or ''}\n{product.get('description') or ''}".strip()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding store keyed by content hash.
+
+    Vectors live in a single float32 `.npy` matrix opened with mmap, and a JSON file keeps the
+    hash of each row. Both files are replaced atomically when new rows are added.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.hashes_path = os.path.join(directory, "hashes.json")
+        self.vectors: Optional[np.ndarray] = None
+        self.rows: Dict[str, int] = {}
+
+    def load(self) -> None:
+        if not (os.path.exists(self.vectors_path) and os.path.exists(self.hashes_path)):
+            return
+        try:
+            with open(self.hashes_path, "r", encoding="utf-8") as f:
+                hashes = json.load(f)
+            vectors = np.load(self.vectors_path, mmap_mode="r")
+            if len(hashes) != vectors.shape[0]:
+                logger.warning("Cache de embeddings inconsistente, descartando")
+                return
+            self.vectors = vectors
+            self.rows = {h: i for i, h in enumerate(hashes)}
+        except Exception as e:
+            logger.error("Erro ao carregar cache de embeddings: %s", e)
+
+    def missing(self, hashes: List[str]) -> List[str]:
+        return [h for h in dict.fromkeys(hashes) if h not in self.rows]
+
+    def write(self, hashes: List[str], vectors: np.ndarray) -> None:
+        """Persist exactly `hashes` -> `vectors` and remap the file."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        tmp_hashes = self.hashes_path + ".tmp"
+        np.save(tmp_vectors, vectors.astype(np.float32, copy=False))
+        with open(tmp_hashes, "w", encoding="utf-8") as f:
+            json.dump(hashes, f)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_hashes, self.hashes_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
+        self.rows = {h: i for i, h in enumerate(hashes)}
+
+    def extend(self, hashes: List[str], vectors: np.ndarray, keep: Optional[set] = None) -> None:
+        """Append new rows; when `keep` is given, rows whose hash is not in it are dropped."""
+        old_hashes = sorted(self.rows, key=self.rows.get)
+        if keep is not None:
+            old_hashes = [h for h in old_hashes if h in keep]
+        old = np.asarray(self.vectors[[self.rows[h] for h in old_hashes]]) if old_hashes else np.empty((0, vectors.shape[1]), np.float32)
+        self.write(old_hashes + hashes, np.vstack([old, vectors]) if len(old) else vectors)
+
+
+class ProductEmbeddingIndex:
+    """Cosine-similarity index over product name + description embeddings."""
+
+    def __init__(self, cache_dir: str, model: str = "text-embedding-3-small"):
+        self.model = model
+        self.cache = EmbeddingCache(cache_dir)
+        self.cache.load()
+        self.products: List[Dict] = []
+        self.matrix: Optional[np.ndarray] = None
+        self._sync_lock = asyncio.Lock()
+        self.embedded = metrics.counter("product_embeddings_computed_total", "Produtos embutidos via API (não encontrados no cache)")
+        self.search_time = metrics.histogram("product_semantic_search_seconds", "Tempo da busca semântica (inclui embedding da consulta)")
+
+    @property
+    def ready(self) -> bool:
+        return self.matrix is not None and len(self.products) > 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            response = await client.embeddings.create(model=self.model, input=texts[start:start + EMBEDDING_BATCH_SIZE])
+            vectors.extend(item.embedding for item in response.data)
+            record_llm_call(self.model, getattr(response.usage, "prompt_tokens", 0) or 0, operation="embedding")
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        """Normalized embedding of a search query, memoized in the LLM cache as base64 float32 bytes."""
+        async def call() -> str:
+            return base64.b64encode((await self.embed([query or " "]))[0].tobytes()).decode("ascii")
+
+        encoded = await llm_cache.get_or_call("query_embedding", llm_cache.key(self.model, query, casefold=True), call)
+        return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+    async def sync(self, products: List[Dict]) -> None:
+        """Rebuild the index for `products`, embedding only rows whose content hash is not cached."""
+        async with self._sync_lock:
+            hashes = [content_hash(product_text(p)) for p in products]
+            missing = self.cache.missing(hashes)
+            if missing:
+                texts_by_hash = {h: product_text(p) for h, p in zip(hashes, products)}
+                vectors = await self.embed([texts_by_hash[h] or " " for h in missing])
+                self.embedded.inc(len(missing))
+                # Drop rows for products that left the catalog once they dominate the file.
+                keep = set(hashes) if len(self.cache.rows) > 2 * len(products) else None
+                await asyncio.to_thread(self.cache.extend, missing, vectors, keep)
+                logger.info("%s produtos embutidos; %s vieram do cache", len(missing), len(products) - len(missing))
+            rows = [self.cache.rows[h] for h in hashes]
+            self.matrix = np.asarray(self.cache.vectors[rows]) if rows else None
+            self.products = products
+
+    def rank(self, query_vectors: np.ndarray, k: int, min_score: float = 0.0) -> List[List[Tuple[Dict, float]]]:
+        """Top-k products for each query row, from a single (products x dim) @ (dim x queries) product."""
+        if not self.ready:
+            return [[] for _ in range(len(query_vectors))]
+        scores = self.matrix @ query_vectors.T
+        k = min(k, scores.shape[0])
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append([(self.products[i], float(column[i])) for i in top if column[i] >= min_score])
+        return results
+
+    async def search_many(self, queries: List[str], k: int = 5, min_score: float = 0.0) -> List[List[Tuple[Dict, float]]]:
+        if not self.ready or not queries:
+            return [[] for _ in queries]
+        started = time.perf_counter()
+        try:
+            vectors = await asyncio.gather(*(self.embed_query(query) for query in queries))
+            return self.rank(np.stack(vectors), k, min_score)
+        finally:
+            self.search_time.observe(time.perf_counter() - started)
+
+    async def search(self, query: str, k: int = 5, min_score: float = 0.0) -> List[Tuple[Dict, float]]:
+        return (await self.search_many([query], k, min_score))[0]
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self.products),
+            "cached_vectors": len(self.cache.rows),
+            "embedded": self.embedded.value,
+            "search_seconds": self.search_time.snapshot(),
+        }
+
+
+product_embeddings = ProductEmbeddingIndex(EMBEDDING_CACHE_DIR, model=EMBEDDING_MODEL)
@@ -1,32 +1,65 @@
 from pydantic import BaseModel, Field
-from supabase import create_client, Client
-import asyncio
+from typing import Optional
 import json
-from config.config import SUPABASE_URL, SUPABASE_KEY
+from tools.supabase_client import supabase_pool
+from tools.product_catalog import product_catalog, parse_query_filters, matches_filters
+from tools.product_embeddings import product_embeddings
+from config.config import SEMANTIC_MIN_SCORE, SEMANTIC_FILL_BELOW
 from utils.logging_setup import setup_logging
+from utils.tracing import traced
 from agents import function_tool
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 class ProductQuery(BaseModel):
     query: str = Field(..., description="Termo de busca para os produtos")
+    size: Optional[float] = Field(None, description="Tamanho desejado (ex.: 38)")
+    min_price: Optional[float] = Field(None, description="Preço mínimo em reais")
+    max_price: Optional[float] = Field(None, description="Preço máximo em reais")
+    limit: int = Field(10, description="Número máximo de produtos retornados")
 
-@function_tool
-async def query_products(query: ProductQuery) -> str:
-    if not all([SUPABASE_URL, SUPABASE_KEY]):
+def _product_key(product: dict):
+    return product.get("id") or product.get("name")
+
+@traced("query_products")
+async def search_products(query: ProductQuery) -> str:
+    """Search the in-memory catalog index; size/price hints in the text are used when not given explicitly.
+
+    When keyword search finds fewer than SEMANTIC_FILL_BELOW products, semantic (embedding) matches fill up to `limit`;
+    a query that already matched a few products by keyword does not pay for an embedding call.
+    """
+    if not supabase_pool.configured:
         return json.dumps({"error": "Configurações do Supabase não estão completas"})
     try:
-        client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        loop = asyncio.get_running_loop()
-        query_lower = query.query.lower()
-        response = await loop.run_in_executor(None, lambda: client.table("products")
-            .select("*")
-            .or_(f"name.ilike.%{query_lower}%,description.ilike.%{query_lower}%")
-            .execute())
-        if not response.data:
+        await product_catalog.ensure_loaded()
+        parsed = parse_query_filters(query.query)
+        filters = {
+            "size": query.size if query.size is not None else parsed.get("size"),
+            "min_price": query.min_price if query.min_price is not None else parsed.get("min_price"),
+            "max_price": query.max_price if query.max_price is not None else parsed.get("max_price"),
+        }
+        results = product_catalog.search(query.query, k=query.limit, **filters)
+        if len(results) < min(SEMANTIC_FILL_BELOW, query.limit) and product_embeddings.ready:
+            try:
+                semantic = await product_embeddings.search(query.query, k=query.limit, min_score=SEMANTIC_MIN_SCORE)
+            except Exception as e:
+                logger.error("Erro na busca semântica de produtos: %s", str(e))
+                semantic = []
+            seen = {_product_key(p) for p in results}
+            for product, score in semantic:
+                if len(results) >= query.limit:
+                    break
+                if _product_key(product) not in seen and matches_filters(product, **filters):
+                    results.append(product)
+                    seen.add(_product_key(product))
+        if not results:
             return json.dumps({"error": f"Nenhum produto encontrado para: {query.query}"})
-        return json.dumps(response.data)
+        return json.dumps(results)
     except Exception as e:
         if "relation \"products\" does not exist" in str(e):
             return json.dumps({"error": "Tabela de produtos não existe no Supabase"})
-        return json.dumps({"error": f"Erro ao consultar produtos: {str(e)}"})
\ No newline at end of file
+        return json.dumps({"error": f"Erro ao consultar produtos: {str(e)}"})
+
+@function_tool
+async def query_products(query: ProductQuery) -> str:
+    return await search_products(query)
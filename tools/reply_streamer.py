@@ -0,0 +1,122 @@
+# tools/reply_streamer.py
+import asyncio
+import json
+import re
+import time
+from typing import Dict, List, Optional, Tuple, Union
+from agents import Agent, Runner
+from openai.types.responses import ResponseTextDeltaEvent
+from config.config import STREAM_MIN_CHUNK_CHARS
+from tools.media_sender import media_sender, NO_IMAGE
+from tools.outbound_dispatcher import outbound
+from utils import metrics
+from utils.json_stream import ReplyStreamParser
+from utils.logging_setup import setup_logging
+from utils.tracing import span, record_run_usage
+
+logger = setup_logging(__name__)
+
+first_message_latency = metrics.histogram("stream_first_message_seconds", "Tempo até a primeira mensagem enviada em respostas em streaming")
+stream_chunks = metrics.counter("stream_chunks_sent_total", "Trechos de texto enviados durante o streaming")
+stream_products = metrics.counter("stream_products_sent_total", "Produtos enviados durante o streaming")
+
+
+def _parse_final_output(output) -> Dict:
+    try:
+        parsed = json.loads(str(output))
+        return parsed if isinstance(parsed, dict) else {"text": str(parsed)}
+    except json.JSONDecodeError:
+        return {"text": str(output)}
+
+
+async def stream_agent_reply(
+    agent: Agent,
+    input: Union[str, List[Dict[str, str]]],
+    phone_number: str,
+    remotejid: str,
+    message_key_id: Optional[str] = None,
+    message_text: Optional[str] = None,
+) -> Tuple[Dict, bool, Agent]:
+    """Run `agent` streamed and deliver its reply to WhatsApp while it is being generated.
+
+    The chat shows "digitando..." right away and text goes out one sentence-sized chunk at a time.
+    Product images are sent through `media_sender.send_products` once the list is complete, because
+    their captions are numbered against the total ("2/7"). Returns the parsed final output
+    (for the conversation history), whether every send succeeded and the agent that answered.
+    """
+    started = time.monotonic()
+    outbound.show_presence(phone_number, "composing", remotejid=remotejid)
+
+    outbox: asyncio.Queue = asyncio.Queue()
+    state = {"success": True, "sent": 0, "products": 0}
+    queued: List[asyncio.Future] = []
+
+    def settle(ok: bool) -> None:
+        if ok and state["sent"] == 0:
+            first_message_latency.observe(time.monotonic() - started)
+        state["sent"] += ok
+        state["success"] = state["success"] and ok
+
+    async def deliver() -> None:
+        while True:
+            kind, value = await outbox.get()
+            if kind is None:
+                return
+            if kind == "product":
+                # Counted only; sent from the final output with the same captions as non-streamed replies.
+                state["products"] += 1
+            else:
+                # Text is queued without waiting for the send: chunks produced while an earlier one is
+                # still in flight leave together as one message.
+                image_match = re.match(r'!\[(.*?)\]\((.*?)\)', value)
+                if image_match:
+                    future = outbound.enqueue_image(
+                        phone_number, image_match.group(2), image_match.group(1) or "Imagem do produto",
+                        remotejid=remotejid, message_key_id=message_key_id, message_text=message_text,
+                    )
+                else:
+                    future = outbound.enqueue_text(phone_number, value, remotejid=remotejid)
+                future.add_done_callback(lambda f: settle(f.result()))
+                queued.append(future)
+                stream_chunks.inc()
+
+    sender = asyncio.create_task(deliver())
+    parser = ReplyStreamParser(min_chunk_chars=STREAM_MIN_CHUNK_CHARS)
+    try:
+        with span("agent_run"):
+            result = Runner.run_streamed(agent, input=input)
+            async for event in result.stream_events():
+                if event.type == "agent_updated_stream_event":
+                    logger.debug("[%s] Agente em execução: %s", remotejid, event.new_agent.name)
+                    # Each agent produces its own output; start parsing from scratch after a handoff.
+                    for pending in parser.close():
+                        outbox.put_nowait(pending)
+                    parser = ReplyStreamParser(min_chunk_chars=STREAM_MIN_CHUNK_CHARS)
+                elif event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    for parsed in parser.feed(event.data.delta):
+                        outbox.put_nowait(parsed)
+        for parsed in parser.close():
+            outbox.put_nowait(parsed)
+        record_run_usage(result)
+        response_data = _parse_final_output(result.final_output)
+    finally:
+        outbox.put_nowait((None, None))
+        await sender
+        if queued:
+            await asyncio.gather(*queued)
+
+    products = response_data.get("products")
+    if isinstance(products, list) and products:
+        # Images beyond the per-reply cap become the "ver mais" page.
+        batch = await media_sender.send_products(
+            phone_number, products, message_text or "", remotejid=remotejid, message_key_id=message_key_id, message_text=message_text
+        )
+        for item in batch.items:
+            if item.status != NO_IMAGE:
+                settle(item.ok)
+                if item.ok:
+                    stream_products.inc()
+        settle(await outbound.send_text(phone_number, batch.summary_text(), remotejid=remotejid))
+
+    logger.info("[%s] Resposta em streaming: %s envio(s), %s produto(s) em %.2fs", remotejid, state['sent'], state['products'], time.monotonic() - started)
+    return response_data, state["success"] and state["sent"] > 0, result.last_agent
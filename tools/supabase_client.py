@@ -0,0 +1,90 @@
+# tools/supabase_client.py
+import asyncio
+import time
+from typing import Any, Callable, Optional
+from supabase import acreate_client, AsyncClient
+from config.config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_MAX_CONCURRENCY
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+
+class SupabaseUnavailableError(Exception):
+    """Raised when the Supabase settings are missing."""
+
+
+class SupabasePool:
+    """Long-lived async Supabase client shared by every data-access function.
+
+    The async client keeps one pooled HTTP connection set for the whole process, so requests
+    run on the event loop without a thread-pool hop. A semaphore bounds how many requests are in
+    flight at once; callers beyond the limit wait and that wait time is recorded.
+    """
+
+    def __init__(self, url: Optional[str], key: Optional[str], max_concurrency: int = 10):
+        self.url = url
+        self.key = key
+        self.max_concurrency = max_concurrency
+        self._client: Optional[AsyncClient] = None
+        self._client_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = metrics.gauge("supabase_in_flight", "Requisições ao Supabase em andamento")
+        self.waiting = metrics.gauge("supabase_waiting", "Requisições aguardando vaga no pool do Supabase")
+        self.wait_time = metrics.histogram("supabase_pool_wait_seconds", "Espera por vaga no pool do Supabase")
+        self.errors = metrics.counter("supabase_errors_total", "Requisições ao Supabase com erro")
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.key)
+
+    async def get_client(self) -> AsyncClient:
+        if self._client is not None:
+            return self._client
+        if not self.configured:
+            raise SupabaseUnavailableError("Configurações do Supabase não estão completas")
+        async with self._client_lock:
+            if self._client is None:
+                self._client = await acreate_client(self.url, self.key)
+                logger.info("Cliente Supabase criado")
+        return self._client
+
+    async def execute(self, build: Callable[[AsyncClient], Any], operation: str = "query") -> Any:
+        """Build a query from the shared client and execute it within the concurrency limit."""
+        client = await self.get_client()
+        queued_at = time.monotonic()
+        self.waiting.inc()
+        async with self._semaphore:
+            self.waiting.dec()
+            self.wait_time.observe(time.monotonic() - queued_at)
+            self.in_flight.inc()
+            started = time.monotonic()
+            try:
+                return await build(client).execute()
+            except Exception:
+                self.errors.inc()
+                raise
+            finally:
+                self.in_flight.dec()
+                metrics.histogram("supabase_request_seconds", "Duração das requisições ao Supabase", operation=operation).observe(time.monotonic() - started)
+
+    async def close(self) -> None:
+        if self._client is None:
+            return
+        try:
+            await self._client.postgrest.aclose()
+        except Exception as e:
+            logger.warning("Erro ao fechar cliente Supabase: %s", str(e))
+        self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight.value,
+            "waiting": self.waiting.value,
+            "errors": self.errors.value,
+            "wait_seconds": self.wait_time.snapshot(),
+        }
+
+
+supabase_pool = SupabasePool(SUPABASE_URL, SUPABASE_KEY, max_concurrency=SUPABASE_MAX_CONCURRENCY)
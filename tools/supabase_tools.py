@@ -1,45 +1,51 @@
 from typing import Dict
 from datetime import datetime
-import asyncio
-from supabase import create_client, Client
-from config.config import SUPABASE_URL, SUPABASE_KEY
 from models.lead_data import LeadData
+from tools.supabase_client import supabase_pool
+from tools.lead_store import lead_store
 from utils.validation import validate_lead_data
+from utils.cache import Cache, make_backend
+from config.config import LEAD_CACHE_TTL_SECONDS, LEAD_CACHE_MAX_ENTRIES
 from utils.logging_setup import setup_logging
+from utils.tracing import traced
 
-logger = setup_logging()
+logger = setup_logging(__name__)
+lead_cache = Cache("leads", make_backend(LEAD_CACHE_MAX_ENTRIES), ttl=LEAD_CACHE_TTL_SECONDS)
 
+@traced("upsert_lead")
 async def upsert_lead(remotejid: str, data: LeadData) -> Dict:
-    if not all([SUPABASE_URL, SUPABASE_KEY]):
+    """Stage the lead changes in the write-behind store and return the pending row.
+
+    The row is written to Supabase by the next batched flush; `get_lead` already sees it.
+    """
+    if not supabase_pool.configured:
         logger.error("Configurações do Supabase não estão completas")
         return {}
     try:
-        client = create_client(SUPABASE_URL, SUPABASE_KEY)
         valid_data = validate_lead_data(data.dict(exclude_unset=True))
         valid_data["remotejid"] = remotejid
         valid_data["data_ultima_alteracao"] = datetime.now().isoformat()
-        logger.debug(f"Upserting lead data: {valid_data}")
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: client.table("leads").upsert(
-            valid_data,
-            on_conflict="remotejid",
-            returning="representation"
-        ).execute())
-        logger.info(f"Upserted lead for remotejid: {remotejid}, data: {valid_data}")
-        return response.data[0] if response.data else {}
+        logger.debug("Staging lead data: %s", valid_data)
+        lead_cache.update(remotejid, valid_data)
+        return lead_store.stage(remotejid, valid_data)
     except Exception as e:
-        logger.error(f"Error upserting lead for remotejid {remotejid}: {e}")
+        logger.error("Error upserting lead for remotejid %s: %s", remotejid, e)
         return {}
 
+@traced("get_lead")
 async def get_lead(remotejid: str) -> Dict:
-    if not all([SUPABASE_URL, SUPABASE_KEY]):
+    if not supabase_pool.configured:
         logger.error("Configurações do Supabase não estão completas")
         return {}
+    cached = lead_cache.get(remotejid)
+    if cached is not None:
+        return lead_store.view(remotejid, cached)
     try:
-        client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: client.table("leads").select("*").eq("remotejid", remotejid).execute())
-        return response.data[0] if response.data else {}
+        response = await supabase_pool.execute(lambda client: client.table("leads").select("*").eq("remotejid", remotejid), operation="get_lead")
+        lead = response.data[0] if response.data else {}
+        if lead:
+            lead_cache.set(remotejid, lead)
+        return lead_store.view(remotejid, lead)
     except Exception as e:
-        logger.error(f"Error retrieving lead for remotejid {remotejid}: {e}")
-        return {}
\ No newline at end of file
+        logger.error("Error retrieving lead for remotejid %s: %s", remotejid, e)
+        return lead_store.view(remotejid) if lead_store.has_pending(remotejid) else {}
\ No newline at end of file
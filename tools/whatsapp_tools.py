@@ -1,22 +1,23 @@
-import aiohttp
 import re
-import json
-import base64
 import os
-import tempfile
 import hashlib
 from typing import Optional, Dict, Any
-from config.config import EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME
+from tools.evolution_client import evolution_client, evolution_presence_client
 from openai import AsyncOpenAI
 from config.config import OPENAI_API_KEY
-from utils.image_processing import resize_image_to_thumbnail
 from utils.logging_setup import setup_logging
+from utils.tracing import traced, record_llm_call
+from utils.media_codec import decode_base64, encode_base64, encode_file_base64
+from utils.cache import Cache, MemoryCacheBackend
+from config.config import TRANSCRIPTION_CACHE_TTL_SECONDS, TRANSCRIPTION_CACHE_MAX_ENTRIES
 
-logger = setup_logging()
+logger = setup_logging(__name__)
+transcription_cache = Cache("transcriptions", MemoryCacheBackend(TRANSCRIPTION_CACHE_MAX_ENTRIES), ttl=TRANSCRIPTION_CACHE_TTL_SECONDS)
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+@traced("send_whatsapp_text")
 async def send_whatsapp_message(phone_number: str, message: str, remotejid: Optional[str] = None) -> bool:
-    if not all([EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME]):
+    if not evolution_client.configured:
         logger.error("Configurações da Evolution API não estão completas")
         return False
     remotejid = remotejid or phone_number
@@ -26,35 +27,50 @@ async def send_whatsapp_message(phone_number: str, message: str, remotejid: Opti
         "text": message,
         "options": {"delay": 0, "presence": "composing"}
     }
-    url = f"{EVOLUTION_API_URL}/message/sendText/{EVOLUTION_INSTANCE_NAME}"
-    headers = {"apikey": EVOLUTION_API_TOKEN, "Content-Type": "application/json"}
-    logger.debug(f"[{remotejid}] Enviando mensagem para: {phone_number}, payload: {json.dumps(payload, indent=2)}")
+    logger.debug("[%s] Enviando mensagem para: %s, payload: %s", remotejid, phone_number, payload)
     try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(url, json=payload) as response:
-                response_text = await response.text()
-                logger.debug(f"[{remotejid}] Resposta do sendText: {response.status} - {response_text}")
-                success = response.status in (200, 201)
-                if success:
-                    logger.info(f"[{remotejid}] Mensagem enviada com sucesso")
-                else:
-                    logger.error(f"[{remotejid}] Falha ao enviar: {response.status} - {response_text}")
-                return success
+        response = await evolution_client.post("message/sendText", payload, remotejid=remotejid)
+        logger.debug("[%s] Resposta do sendText: %s - %s", remotejid, response.status, response.text)
+        if response.ok:
+            logger.info("[%s] Mensagem enviada com sucesso", remotejid)
+        else:
+            logger.error("[%s] Falha ao enviar: %s - %s", remotejid, response.status, response.text)
+        return response.ok
+    except Exception as e:
+        logger.error("[%s] Erro ao enviar mensagem: %s", remotejid, e)
+        return False
+
+@traced("send_whatsapp_presence")
+async def send_whatsapp_presence(phone_number: str, presence: str = "composing", delay_ms: int = 3000, remotejid: Optional[str] = None) -> bool:
+    """Show "digitando..." (or "gravando..." with presence="recording") for `delay_ms` in the chat."""
+    if not evolution_presence_client.configured:
+        return False
+    remotejid = remotejid or phone_number
+    payload = {"number": phone_number, "delay": delay_ms, "presence": presence}
+    try:
+        response = await evolution_presence_client.post("chat/sendPresence", payload, remotejid=remotejid)
+        if not response.ok:
+            logger.warning("[%s] Falha ao enviar presença: %s - %s", remotejid, response.status, response.text)
+        return response.ok
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao enviar mensagem: {e}")
+        logger.warning("[%s] Erro ao enviar presença: %s", remotejid, e)
         return False
 
-async def send_whatsapp_audio(phone_number: str, audio_path: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> bool:
-    if not all([EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME]):
+@traced("send_whatsapp_audio")
+async def send_whatsapp_audio(phone_number: str, audio_path: Optional[str] = None, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None, audio_bytes: Optional[bytes] = None) -> bool:
+    """Send an MP3 as a voice note, from in-memory `audio_bytes` or from `audio_path`."""
+    if not evolution_client.configured:
         logger.error("Configurações da Evolution API não estão completas")
         return False
     remotejid = remotejid or phone_number
     try:
-        if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-            logger.error(f"[{remotejid}] Arquivo de áudio inválido ou vazio: {audio_path}")
+        if audio_bytes:
+            audio_data = await encode_base64(audio_bytes)
+        elif audio_path and os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
+            audio_data = await encode_file_base64(audio_path)
+        else:
+            logger.error("[%s] Arquivo de áudio inválido ou vazio: %s", remotejid, audio_path)
             return False
-        with open(audio_path, "rb") as audio_file:
-            audio_data = base64.b64encode(audio_file.read()).decode("utf-8")
         payload = {
             "number": phone_number,
             "audio": audio_data,
@@ -72,30 +88,26 @@ async def send_whatsapp_audio(phone_number: str, audio_path: str, remotejid: Opt
                 "key": {"id": message_key_id},
                 "message": {"conversation": message_text}
             }
-        url = f"{EVOLUTION_API_URL}/message/sendWhatsAppAudio/{EVOLUTION_INSTANCE_NAME}"
-        headers = {"apikey": EVOLUTION_API_TOKEN, "Content-Type": "application/json"}
-        logger.debug(f"[{remotejid}] Enviando áudio, payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(url, json=payload) as response:
-                response_text = await response.text()
-                logger.debug(f"[{remotejid}] Resposta do sendWhatsAppAudio: {response.status} - {response_text}")
-                success = response.status in (200, 201)
-                if success:
-                    logger.info(f"[{remotejid}] Áudio enviado com sucesso")
-                else:
-                    logger.error(f"[{remotejid}] Falha ao enviar áudio: {response.status} - {response_text}")
-                return success
+        logger.debug("[%s] Enviando áudio, payload: %s", remotejid, payload)
+        response = await evolution_client.post("message/sendWhatsAppAudio", payload, remotejid=remotejid)
+        logger.debug("[%s] Resposta do sendWhatsAppAudio: %s - %s", remotejid, response.status, response.text)
+        if response.ok:
+            logger.info("[%s] Áudio enviado com sucesso", remotejid)
+        else:
+            logger.error("[%s] Falha ao enviar áudio: %s - %s", remotejid, response.status, response.text)
+        return response.ok
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao enviar áudio: {e}")
+        logger.error("[%s] Erro ao enviar áudio: %s", remotejid, e)
         return False
 
+@traced("send_whatsapp_image")
 async def send_whatsapp_image(phone_number: str, image_url: str, caption: str, remotejid: Optional[str] = None, message_key_id: Optional[str] = None, message_text: Optional[str] = None) -> bool:
-    if not all([EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME]):
+    if not evolution_client.configured:
         logger.error("Configurações da Evolution API não estão completas")
         return False
     remotejid = remotejid or phone_number
     if not phone_number:
-        logger.error(f"[{remotejid}] Número de telefone inválido: {phone_number}")
+        logger.error("[%s] Número de telefone inválido: %s", remotejid, phone_number)
         return False
     try:
         payload = {
@@ -117,29 +129,23 @@ async def send_whatsapp_image(phone_number: str, image_url: str, caption: str, r
                 "key": {"id": message_key_id},
                 "message": {"conversation": message_text}
             }
-        url = f"{EVOLUTION_API_URL}/message/sendMedia/{EVOLUTION_INSTANCE_NAME}"
-        headers = {"apikey": EVOLUTION_API_TOKEN, "Content-Type": "application/json"}
-        logger.debug(f"[{remotejid}] Enviando imagem via URL, payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(url, json=payload) as response:
-                response_text = await response.text()
-                logger.debug(f"[{remotejid}] Resposta do sendMedia: {response.status} - {response_text}")
-                success = response.status in (200, 201)
-                if success:
-                    logger.info(f"[{remotejid}] Imagem enviada com sucesso")
-                else:
-                    logger.error(f"[{remotejid}] Falha ao enviar imagem: {response.status} - {response_text}")
-                return success
+        logger.debug("[%s] Enviando imagem via URL, payload: %s", remotejid, payload)
+        response = await evolution_client.post("message/sendMedia", payload, remotejid=remotejid)
+        logger.debug("[%s] Resposta do sendMedia: %s - %s", remotejid, response.status, response.text)
+        if response.ok:
+            logger.info("[%s] Imagem enviada com sucesso", remotejid)
+        else:
+            logger.error("[%s] Falha ao enviar imagem: %s - %s", remotejid, response.status, response.text)
+        return response.ok
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao enviar imagem: {e}")
+        logger.error("[%s] Erro ao enviar imagem: %s", remotejid, e)
         return False
 
+@traced("fetch_media_base64")
 async def fetch_media_base64(message_key_id: str, media_type: str, remotejid: Optional[str] = None) -> Dict[str, Any]:
-    if not all([EVOLUTION_API_URL, EVOLUTION_API_TOKEN, EVOLUTION_INSTANCE_NAME]):
+    if not evolution_client.configured:
         logger.error("Configurações da Evolution API não estão completas")
         return {"error": "Configurações da Evolution API não estão completas"}
-    url = f"{EVOLUTION_API_URL}/chat/getBase64FromMediaMessage/{EVOLUTION_INSTANCE_NAME}"
-    headers = {"apikey": EVOLUTION_API_TOKEN, "Content-Type": "application/json"}
     payload = {
         "message": {
             "key": {
@@ -148,67 +154,71 @@ async def fetch_media_base64(message_key_id: str, media_type: str, remotejid: Op
         },
         "convertToMp4": media_type == "image"
     }
-    logger.debug(f"[{remotejid}] Buscando base64 para {media_type} com message_key_id: {message_key_id}, payload: {json.dumps(payload, indent=2)}")
+    if media_type == "audio" and message_key_id:
+        # Evolution redelivers webhooks on timeout; reuse the transcript instead of paying Whisper again.
+        cached_text = transcription_cache.get(f"msg:{message_key_id}")
+        if cached_text is not None:
+            logger.info("[%s] Transcrição reaproveitada do cache para a mensagem %s", remotejid, message_key_id)
+            return {"type": "audio", "transcription": cached_text}
+    logger.debug("[%s] Buscando base64 para %s com message_key_id: %s, payload: %s", remotejid, media_type, message_key_id, payload)
     try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(url, json=payload) as response:
-                response_text = await response.text()
-                logger.debug(f"[{remotejid}] Resposta do getBase64FromMediaMessage: {response.status} - {response_text}")
-                if response.status not in (200, 201):
-                    logger.error(f"[{remotejid}] Falha ao buscar base64: {response.status} - {response_text}")
-                    return {"error": f"Falha ao buscar base64: {response.status}"}
-                response_data = await response.json()
-                base64_data = response_data.get("base64")
-                if not base64_data:
-                    logger.error(f"[{remotejid}] Nenhum dado base64 retornado pela API")
-                    return {"error": "Nenhum dado base64 retornado"}
+        response = await evolution_client.post("chat/getBase64FromMediaMessage", payload, remotejid=remotejid)
+        logger.debug("[%s] Resposta do getBase64FromMediaMessage: %s - %s", remotejid, response.status, response.text)
+        if not response.ok:
+            logger.error("[%s] Falha ao buscar base64: %s - %s", remotejid, response.status, response.text)
+            return {"error": f"Falha ao buscar base64: {response.status}"}
+        response_data = response.json()
+        base64_data = response_data.get("base64")
+        if not base64_data:
+            logger.error("[%s] Nenhum dado base64 retornado pela API", remotejid)
+            return {"error": "Nenhum dado base64 retornado"}
 
-                logger.debug(f"[{remotejid}] Primeiros 50 caracteres do base64: {base64_data[:50]}")
-                
-                try:
-                    decoded_data = base64.b64decode(base64_data, validate=True)
-                    if media_type == "image":
-                        if decoded_data.startswith(b'\xff\xd8\xff'):
-                            mimetype = "image/jpeg"
-                        elif decoded_data.startswith(b'\x89PNG\r\n\x1a\n'):
-                            mimetype = "image/png"
-                        else:
-                            logger.warning(f"[{remotejid}] Formato de imagem desconhecido")
-                            return {"error": f"Formato de imagem desconhecido"}
-                        thumbnail_data = await resize_image_to_thumbnail(decoded_data)
-                        if not thumbnail_data:
-                            logger.warning(f"[{remotejid}] Falha ao gerar thumbnail, usando imagem original")
-                            thumbnail_data = base64_data
-                        logger.info(f"[{remotejid}] Base64 de imagem obtido com sucesso, mimetype: {mimetype}")
-                        return {"type": "image", "base64": thumbnail_data, "mimetype": mimetype}
-                    elif media_type == "audio":
-                        if decoded_data.startswith(b'OggS'):
-                            mimetype = "audio/ogg"
-                        elif decoded_data.startswith(b'ID3') or decoded_data.startswith(b'\xff\xfb'):
-                            mimetype = "audio/mpeg"
-                        else:
-                            logger.warning(f"[{remotejid}] Formato de áudio desconhecido")
-                            return {"error": f"Formato de áudio desconhecido"}
-                        temp_path = os.path.join(tempfile.gettempdir(), f"audio_temp_{hashlib.md5(base64_data.encode()).hexdigest()}.ogg")
-                        with open(temp_path, "wb") as f:
-                            f.write(decoded_data)
-                        logger.debug(f"[{remotejid}] Arquivo de áudio salvo: {temp_path}")
-                        with open(temp_path, "rb") as audio_file:
-                            transcription = await client.audio.transcriptions.create(
-                                model="whisper-1",
-                                file=audio_file,
-                                language="pt"
-                            )
-                        logger.info(f"[{remotejid}] Áudio transcrito com sucesso: {transcription.text}")
-                        os.remove(temp_path)
-                        logger.debug(f"[{remotejid}] Arquivo temporário removido: {temp_path}")
-                        return {"type": "audio", "transcription": transcription.text}
-                    else:
-                        logger.error(f"[{remotejid}] Tipo de mídia não suportado: {media_type}")
-                        return {"error": f"Tipo de mídia não suportado: {media_type}"}
-                except Exception as e:
-                    logger.error(f"[{remotejid}] Erro ao verificar ou processar mídia: {str(e)}")
-                    return {"error": f"Erro ao verificar ou processar mídia: {str(e)}"}
+        
+        try:
+            decoded_data = await decode_base64(base64_data)
+            if media_type == "image":
+                if decoded_data.startswith(b'\xff\xd8\xff'):
+                    mimetype = "image/jpeg"
+                elif decoded_data.startswith(b'\x89PNG\r\n\x1a\n'):
+                    mimetype = "image/png"
+                else:
+                    logger.warning("[%s] Formato de imagem desconhecido", remotejid)
+                    return {"error": f"Formato de imagem desconhecido"}
+                # Raw bytes are returned; callers resize once for their own use (see prepare_image_for_vision).
+                logger.info("[%s] Imagem obtida com sucesso, mimetype: %s, %s bytes", remotejid, mimetype, len(decoded_data))
+                return {"type": "image", "data": decoded_data, "mimetype": mimetype}
+            elif media_type == "audio":
+                if decoded_data.startswith(b'OggS'):
+                    mimetype = "audio/ogg"
+                elif decoded_data.startswith(b'ID3') or decoded_data.startswith(b'\xff\xfb'):
+                    mimetype = "audio/mpeg"
+                else:
+                    logger.warning("[%s] Formato de áudio desconhecido", remotejid)
+                    return {"error": f"Formato de áudio desconhecido"}
+                content_key = hashlib.sha256(decoded_data).hexdigest()
+                text = transcription_cache.get(content_key)
+                if text is None:
+                    extension = "ogg" if mimetype == "audio/ogg" else "mp3"
+                    transcription = await client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=(f"audio.{extension}", decoded_data, mimetype),
+                        language="pt"
+                    )
+                    record_llm_call("whisper-1", operation="transcription")
+                    text = transcription.text
+                    logger.info("[%s] Áudio transcrito com sucesso: %s", remotejid, text)
+                    transcription_cache.set(content_key, text)
+                else:
+                    logger.info("[%s] Transcrição reaproveitada do cache (mesmo conteúdo)", remotejid)
+                if message_key_id:
+                    transcription_cache.set(f"msg:{message_key_id}", text)
+                return {"type": "audio", "transcription": text}
+            else:
+                logger.error("[%s] Tipo de mídia não suportado: %s", remotejid, media_type)
+                return {"error": f"Tipo de mídia não suportado: {media_type}"}
+        except Exception as e:
+            logger.error("[%s] Erro ao verificar ou processar mídia: %s", remotejid, str(e))
+            return {"error": f"Erro ao verificar ou processar mídia: {str(e)}"}
     except Exception as e:
-        logger.error(f"[{remotejid}] Erro ao buscar base64 da Evolution API: {str(e)}")
+        logger.error("[%s] Erro ao buscar base64 da Evolution API: %s", remotejid, str(e))
         return {"error": f"Erro ao buscar base64: {str(e)}"}
\ No newline at end of file
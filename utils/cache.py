@@ -0,0 +1,216 @@
+# utils/cache.py
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from config.config import CACHE_BACKEND, CACHE_SQLITE_PATH
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+
+class CacheBackend:
+    """Key/value store with per-entry TTL and LRU eviction. Values must be JSON-serialisable."""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU with TTL; private to one worker."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """SQLite-backed LRU with TTL, shareable by every uvicorn worker on the same host."""
+
+    def __init__(self, path: str, maxsize: int = 10000):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl else None, now),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxsize
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class TieredCacheBackend(CacheBackend):
+    """Memory LRU in front of a persistent backend: hot keys never touch disk, cold ones survive restarts."""
+
+    def __init__(self, front: MemoryCacheBackend, back: CacheBackend, front_ttl: Optional[float] = None):
+        self.front = front
+        self.back = back
+        self.front_ttl = front_ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is not None:
+                self.front.set(key, value, self.front_ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.back.set(key, value, ttl)
+        ttls = [t for t in (ttl, self.front_ttl) if t]
+        self.front.set(key, value, min(ttls) if ttls else None)
+
+    def delete(self, key: str) -> None:
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def __len__(self) -> int:
+        return len(self.back)
+
+
+def make_backend(maxsize: int = 10000) -> CacheBackend:
+    """Build the backend selected by CACHE_BACKEND ('memory' or 'sqlite')."""
+    if CACHE_BACKEND == "sqlite":
+        try:
+            return SQLiteCacheBackend(CACHE_SQLITE_PATH, maxsize=maxsize)
+        except sqlite3.Error as e:
+            logger.error("Erro ao abrir cache SQLite em %s, usando memória: %s", CACHE_SQLITE_PATH, e)
+    return MemoryCacheBackend(maxsize=maxsize)
+
+
+class Cache:
+    """Namespaced cache with a default TTL and hit/miss counters."""
+
+    def __init__(self, name: str, backend: CacheBackend, ttl: Optional[float] = None):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = metrics.counter("cache_hits_total", "Acertos de cache", cache=name)
+        self.misses = metrics.counter("cache_misses_total", "Faltas de cache", cache=name)
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self.backend.get(self._key(key))
+        except Exception as e:
+            logger.error("Erro ao ler cache '%s': %s", self.name, e)
+            value = None
+        if value is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self.backend.set(self._key(key), value, ttl if ttl is not None else self.ttl)
+        except Exception as e:
+            logger.error("Erro ao gravar cache '%s': %s", self.name, e)
+
+    def update(self, key: str, fields: dict) -> None:
+        """Merge `fields` into a cached dict entry so readers see the write; no-op when not cached."""
+        try:
+            current = self.backend.get(self._key(key))
+            if isinstance(current, dict):
+                self.backend.set(self._key(key), {**current, **fields}, self.ttl)
+        except Exception as e:
+            logger.error("Erro ao atualizar cache '%s': %s", self.name, e)
+            self.invalidate(key)
+
+    def invalidate(self, key: str) -> None:
+        try:
+            self.backend.delete(self._key(key))
+        except Exception as e:
+            logger.error("Erro ao invalidar cache '%s': %s", self.name, e)
+
+    def stats(self) -> dict:
+        total = self.hits.value + self.misses.value
+        return {
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_rate": round(self.hits.value / total, 4) if total else None,
+        }
@@ -0,0 +1,108 @@
+# utils/idempotency.py
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+# Evolution API events that carry a customer message; everything else is acknowledged and dropped.
+PROCESSED_EVENTS = {"messages.upsert"}
+
+
+def skip_reason(data: Dict) -> Optional[str]:
+    """Why a webhook never needs processing (our own echoes, status updates, broadcasts), or None."""
+    event = data.get("event")
+    if event and str(event).lower().replace("_", ".") not in PROCESSED_EVENTS:
+        return "event"
+    key = data.get("data", {}).get("key", {})
+    if key.get("fromMe"):
+        return "from_me"
+    if str(key.get("remoteJid", "")).endswith("@broadcast"):
+        return "broadcast"
+    return None
+
+
+class IdempotencyStore:
+    """Bounded TTL set of message ids that were already accepted.
+
+    The in-memory OrderedDict answers in O(1) and is always consulted first. With `sqlite_path`, ids are
+    also written to SQLite so a restarted worker, or a sibling worker on the same host, recognises
+    redeliveries too.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 100000, sqlite_path: Optional[str] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        if sqlite_path:
+            try:
+                self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None, timeout=5.0)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS processed_messages (id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            except sqlite3.Error as e:
+                logger.error("Erro ao abrir armazenamento de idempotência em %s, usando só memória: %s", sqlite_path, e)
+                self._conn = None
+        self.duplicates = metrics.counter("webhook_duplicates_total", "Webhooks descartados por id de mensagem repetido")
+        self.accepted = metrics.counter("webhook_unique_total", "Webhooks aceitos com id de mensagem novo")
+
+    def _claim_memory(self, key: str, now: float) -> bool:
+        expires_at = self._seen.get(key)
+        if expires_at is not None and expires_at > now:
+            return False
+        self._seen[key] = now + self.ttl
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+        return True
+
+    def _claim_sqlite(self, key: str) -> bool:
+        now = time.time()
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._conn.execute("DELETE FROM processed_messages WHERE expires_at <= ?", (now,))
+        self._conn.execute("DELETE FROM processed_messages WHERE id = ? AND expires_at <= ?", (key, now))
+        cursor = self._conn.execute("INSERT OR IGNORE INTO processed_messages (id, expires_at) VALUES (?, ?)", (key, now + self.ttl))
+        return cursor.rowcount == 1
+
+    def claim(self, key: str) -> bool:
+        """Record `key`; False when it was already claimed within the TTL (a duplicate)."""
+        with self._lock:
+            claimed = self._claim_memory(key, time.monotonic())
+            if claimed and self._conn is not None:
+                try:
+                    claimed = self._claim_sqlite(key)
+                except sqlite3.Error as e:
+                    logger.error("Erro no armazenamento de idempotência: %s", e)
+        (self.accepted if claimed else self.duplicates).inc()
+        return claimed
+
+    def release(self, key: str) -> None:
+        """Forget `key` so a redelivery is processed (e.g. when the message could not be enqueued)."""
+        with self._lock:
+            self._seen.pop(key, None)
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM processed_messages WHERE id = ?", (key,))
+                except sqlite3.Error as e:
+                    logger.error("Erro no armazenamento de idempotência: %s", e)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._seen),
+            "duplicates": self.duplicates.value,
+            "unique": self.accepted.value,
+            "persistent": self._conn is not None,
+        }
@@ -1,19 +1,76 @@
-from PIL import Image
+from PIL import Image, ImageOps
+import asyncio
 import io
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+from config.config import IMAGE_WORKERS, VISION_IMAGE_MAX_SIZE
+from utils import metrics
 from utils.logging_setup import setup_logging
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 
-async def resize_image_to_thumbnail(image_data: bytes, max_size: int = 100) -> str:
+# Pillow releases the GIL while decoding and resampling, so a thread pool keeps this work
+# off the event loop without pickling image bytes across processes.
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+_prepare_time = metrics.histogram("image_prepare_seconds", "Tempo de decodificação, hash e redimensionamento de imagens")
+
+
+@dataclass
+class PreparedImage:
+    base64: str
+    mimetype: str
+    phash: int
+    digest: str
+    width: int
+    height: int
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash: stable across re-encoding and resizing of the same photo."""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _prepare(image_data: bytes, max_size: int) -> PreparedImage:
+    with Image.open(io.BytesIO(image_data)) as img:
+        width, height = img.size
+        # Let the JPEG decoder downscale by powers of two while decoding; the rest is resampled.
+        img.draft("RGB", (max_size, max_size))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        phash = dhash(img)
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=85)
+    return PreparedImage(
+        base64=base64.b64encode(output.getvalue()).decode("utf-8"),
+        mimetype="image/jpeg",
+        phash=phash,
+        digest=hashlib.sha256(image_data).hexdigest(),
+        width=width,
+        height=height,
+    )
+
+
+async def prepare_image_for_vision(image_data: bytes, max_size: int = VISION_IMAGE_MAX_SIZE) -> Optional[PreparedImage]:
+    """Decode once, hash and downscale for the vision model, on the image thread pool."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     try:
-        with Image.open(io.BytesIO(image_data)) as img:
-            img.thumbnail((max_size, max_size))
-            output = io.BytesIO()
-            img.save(output, format="JPEG")
-            thumbnail_data = base64.b64encode(output.getvalue()).decode("utf-8")
-            logger.info(f"Thumbnail gerado: {len(thumbnail_data)} bytes")
-            return thumbnail_data
+        prepared = await loop.run_in_executor(_image_executor, _prepare, image_data, max_size)
+        logger.info("Imagem preparada: %sx%s -> base64 %s bytes", prepared.width, prepared.height, len(prepared.base64))
+        return prepared
     except Exception as e:
-        logger.error(f"Erro ao gerar thumbnail: {e}")
-        return ""
\ No newline at end of file
+        logger.error("Erro ao preparar imagem: %s", e)
+        return None
+    finally:
+        _prepare_time.observe(loop.time() - started)
+
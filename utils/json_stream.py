@@ -0,0 +1,147 @@
+# utils/json_stream.py
+import json
+import re
+from typing import List, Optional, Tuple
+
+# A sentence ends at . ! ? or … followed by whitespace, or at a line break.
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+Event = Tuple[str, object]  # ("text", str) or ("product", dict)
+
+
+class ReplyStreamParser:
+    """Incrementally parse an agent reply of the form {"text": "..."} or {"products": [{...}, ...]}.
+
+    `feed()` takes raw output deltas and returns the events that became complete: sentence-sized
+    pieces of the "text" value and each object of the "products" array as soon as its closing brace
+    arrives. Output that is not a JSON object is streamed as plain text.
+    """
+
+    def __init__(self, min_chunk_chars: int = 40):
+        self.min_chunk_chars = min_chunk_chars
+        self.mode: Optional[str] = None  # None until the first significant char, then "json" or "plain"
+        self.fenced = False
+        self.raw: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escape: Optional[str] = None  # pending escape sequence, e.g. "\\" or "\\u00e"
+        self.key: Optional[str] = None  # current key at the top level
+        self.last_string = ""
+        self.string_buffer: List[str] = []
+        self.capturing_text = False
+        self.product_start: Optional[int] = None
+        self.pending_text = ""
+        self.position = 0
+
+    def _emit_text(self, events: List[Event], final: bool = False) -> None:
+        while True:
+            match = None
+            for candidate in _SENTENCE_END.finditer(self.pending_text):
+                if candidate.start() >= self.min_chunk_chars:
+                    match = candidate
+                    break
+            if not match:
+                break
+            chunk = self.pending_text[:match.start()].strip()
+            self.pending_text = self.pending_text[match.end():]
+            if chunk:
+                events.append(("text", chunk))
+        if final and self.pending_text.strip():
+            events.append(("text", self.pending_text.strip()))
+            self.pending_text = ""
+
+    def _string_char(self, char: str) -> None:
+        self.string_buffer.append(char)
+        if self.capturing_text:
+            self.pending_text += char
+
+    def feed(self, delta: str) -> List[Event]:
+        events: List[Event] = []
+        for char in delta:
+            self.raw.append(char)
+            self.position += 1
+            if self.mode is None:
+                # Skip leading whitespace and a ```json fence if the model added one.
+                if char == "`":
+                    self.fenced = True
+                if char.isspace() or char == "`" or (self.fenced and char != "{"):
+                    continue
+                if char != "{":
+                    self.mode = "plain"
+                    self.pending_text = "".join(self.raw).lstrip()
+                    continue
+                self.mode = "json"
+            if self.mode == "plain":
+                self.pending_text += char
+                continue
+            self._feed_json(char, events)
+        self._emit_text(events)
+        return events
+
+    def _feed_json(self, char: str, events: List[Event]) -> None:
+        if self.in_string:
+            if self.escape is not None:
+                self.escape += char
+                if self.escape[1] == "u":
+                    if len(self.escape) == 6:
+                        try:
+                            self._string_char(chr(int(self.escape[2:], 16)))
+                        except ValueError:
+                            pass
+                        self.escape = None
+                else:
+                    self._string_char(_ESCAPES.get(char, char))
+                    self.escape = None
+            elif char == "\\":
+                self.escape = "\\"
+            elif char == '"':
+                self.in_string = False
+                self.last_string = "".join(self.string_buffer)
+                self.string_buffer = []
+                if self.capturing_text:
+                    self.capturing_text = False
+                    self._emit_text(events, final=True)
+            else:
+                self._string_char(char)
+            return
+        if char == '"':
+            self.in_string = True
+            # A string that starts right after "text": at the top level is the reply text.
+            self.capturing_text = self.depth == 1 and self.key == "text" and self._after_colon()
+            return
+        if char == ":" and self.depth == 1:
+            self.key = self.last_string
+        elif char in "{[":
+            self.depth += 1
+            if char == "{" and self.depth == 3 and self.key == "products":
+                self.product_start = self.position - 1
+        elif char in "}]":
+            if char == "}" and self.depth == 3 and self.product_start is not None:
+                try:
+                    product = json.loads("".join(self.raw[self.product_start:self.position]))
+                    if isinstance(product, dict):
+                        events.append(("product", product))
+                except json.JSONDecodeError:
+                    pass
+                self.product_start = None
+            self.depth -= 1
+        elif char == "," and self.depth == 1:
+            self.key = None
+
+    def _after_colon(self) -> bool:
+        for index in range(len(self.raw) - 2, -1, -1):
+            if not self.raw[index].isspace():
+                return self.raw[index] == ":"
+        return False
+
+    def close(self) -> List[Event]:
+        """Flush whatever text is left once the stream has ended."""
+        events: List[Event] = []
+        if self.mode == "plain" or self.capturing_text:
+            self._emit_text(events, final=True)
+        return events
+
+    @property
+    def text(self) -> str:
+        return "".join(self.raw)
@@ -0,0 +1,185 @@
+# utils/llm_cache.py
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from config.config import (
+    LLM_CACHE_ENABLED, LLM_CACHE_SQLITE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MEMORY_ENTRIES,
+)
+from utils import metrics
+from utils.cache import MemoryCacheBackend, SQLiteCacheBackend
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+
+def _normalize(value: Any, casefold: bool) -> Any:
+    if isinstance(value, str):
+        # Data URLs (image bytes) are hashed as they are; only prose is normalized.
+        if value.startswith("data:"):
+            return value
+        text = re.sub(r"\s+", " ", unicodedata.normalize("NFC", value)).strip()
+        return text.casefold() if casefold else text
+    if isinstance(value, dict):
+        return {key: _normalize(item, casefold) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item, casefold) for item in value]
+    return value
+
+
+class LLMCache:
+    """Memoizes model calls that are pure functions of their request (model, messages, parameters).
+
+    Call sites opt in by routing the call through `get_or_call` with a key from `key()`. Each operation
+    gets its own namespace and hit/miss counters; concurrent identical requests share a single call.
+    A memory LRU sits in front of SQLite (`sqlite_path`, shared by workers and kept across restarts);
+    the SQLite tier is only touched from a worker thread, so a busy database never stalls the event loop.
+    """
+
+    def __init__(
+        self,
+        sqlite_path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_entries: int = 50000,
+        memory_entries: int = 2000,
+        enabled: bool = True,
+    ):
+        self.sqlite_path = sqlite_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.enabled = enabled
+        self._front: Optional[MemoryCacheBackend] = None
+        self._back: Optional[SQLiteCacheBackend] = None
+        self._start_lock = asyncio.Lock()
+        self._counters: Dict[str, Tuple[metrics.Counter, metrics.Counter]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def start(self) -> None:
+        """Open the backends; called from the app lifespan, or on first use."""
+        async with self._start_lock:
+            if self._front is not None:
+                return
+            if self.sqlite_path:
+                try:
+                    self._back = await asyncio.to_thread(SQLiteCacheBackend, self.sqlite_path, self.max_entries)
+                except sqlite3.Error as e:
+                    logger.error("Erro ao abrir cache de LLM em %s, usando memória: %s", self.sqlite_path, e)
+            self._front = MemoryCacheBackend(self.memory_entries if self._back is not None else self.max_entries)
+
+    @staticmethod
+    def key(model: str, messages: Any, casefold: bool = False, **params) -> str:
+        """Digest of the normalized request: Unicode NFC, collapsed whitespace and, with `casefold`, case."""
+        request = {"model": model, "messages": _normalize(messages, casefold), "params": params}
+        encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _counters_for(self, operation: str) -> Tuple[metrics.Counter, metrics.Counter]:
+        counters = self._counters.get(operation)
+        if counters is None:
+            name = f"llm_{operation}"
+            counters = self._counters[operation] = (
+                metrics.counter("cache_hits_total", "Acertos de cache", cache=name),
+                metrics.counter("cache_misses_total", "Faltas de cache", cache=name),
+            )
+        return counters
+
+    async def _get(self, key: str) -> Optional[Any]:
+        value = self._front.get(key)
+        if value is None and self._back is not None:
+            try:
+                value = await asyncio.to_thread(self._back.get, key)
+            except Exception as e:
+                logger.error("Erro ao ler cache de LLM: %s", e)
+                value = None
+            if value is not None:
+                self._front.set(key, value, self.ttl)
+        return value
+
+    async def _set(self, key: str, value: Any) -> None:
+        self._front.set(key, value, self.ttl)
+        if self._back is not None:
+            try:
+                await asyncio.to_thread(self._back.set, key, value, self.ttl)
+            except Exception as e:
+                logger.error("Erro ao gravar cache de LLM: %s", e)
+
+    async def get_or_call(
+        self,
+        operation: str,
+        key: str,
+        call: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = bool,
+    ) -> Any:
+        """Return the cached result for `key`, or await `call()` and store its result when `should_cache` accepts it.
+
+        Results must be JSON-serialisable. Exceptions from `call` propagate and are never cached.
+        """
+        if not self.enabled:
+            return await call()
+        if self._front is None:
+            await self.start()
+        hits, misses = self._counters_for(operation)
+        cache_key = f"llm_{operation}:{key}"
+        cached = await self._get(cache_key)
+        if cached is not None:
+            hits.inc()
+            logger.debug("Resposta de %s servida do cache de LLM (%s)", operation, key[:12])
+            return cached
+        misses.inc()
+        pending = self._inflight.get(cache_key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # The call we were waiting on was cancelled with its request; make our own.
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await call()
+            future.set_result(result)
+            if should_cache(result):
+                await self._set(cache_key, result)
+            return result
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; retrieve it so asyncio does not log "exception was never retrieved".
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    def stats(self) -> dict:
+        operations = {}
+        for operation, (hits, misses) in self._counters.items():
+            total = hits.value + misses.value
+            operations[operation] = {
+                "hits": hits.value,
+                "misses": misses.value,
+                "hit_rate": round(hits.value / total, 4) if total else None,
+            }
+        return {
+            "enabled": self.enabled,
+            "sqlite_path": self.sqlite_path if self._back is not None else None,
+            "memory_entries": len(self._front) if self._front is not None else 0,
+            "operations": operations,
+        }
+
+
+llm_cache = LLMCache(
+    LLM_CACHE_SQLITE_PATH or None,
+    ttl=LLM_CACHE_TTL_SECONDS,
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+    enabled=LLM_CACHE_ENABLED,
+)
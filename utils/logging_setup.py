@@ -1,5 +1,146 @@
+import atexit
+import hashlib
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Any, Optional
+from config.config import (
+    LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_MAX_FIELD_CHARS, LOG_MAX_MESSAGE_CHARS, LOG_HASHED_FIELDS,
+)
+from utils.request_context import request_id_var, remotejid_var
 
-def setup_logging():
-    logging.basicConfig(level=logging.INFO)
-    return logging.getLogger(__name__)
\ No newline at end of file
+# Client libraries that log every HTTP request at INFO; LOG_LEVELS can still lower them.
+DEFAULT_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING", "openai": "WARNING", "hpack": "WARNING"}
+HASHED_FIELDS = frozenset(field.strip() for field in LOG_HASHED_FIELDS.split(",") if field.strip())
+# Hashing looks at a bounded prefix: enough to tell payloads apart without reading megabytes of base64.
+_HASH_PREFIX_BYTES = 64 * 1024
+_MAX_ITEMS = 50
+_MAX_DEPTH = 6
+
+_configure_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _digest(value: Any) -> str:
+    data = value if isinstance(value, (bytes, bytearray)) else str(value).encode("utf-8", "replace")
+    return hashlib.sha256(bytes(data[:_HASH_PREFIX_BYTES])).hexdigest()[:12]
+
+
+def redact(value: Any, depth: int = 0) -> Any:
+    """Copy of `value` that is safe to log: hashed fields become digests, long strings are cut."""
+    if isinstance(value, dict):
+        if depth >= _MAX_DEPTH:
+            return f"<dict {len(value)} chaves>"
+        return {
+            key: (f"<{len(item)} chars sha256:{_digest(item)}>" if key in HASHED_FIELDS and isinstance(item, (str, bytes)) else redact(item, depth + 1))
+            for key, item in list(value.items())[:_MAX_ITEMS]
+        }
+    if isinstance(value, (list, tuple)):
+        if depth >= _MAX_DEPTH:
+            return f"<lista {len(value)} itens>"
+        items = [redact(item, depth + 1) for item in value[:_MAX_ITEMS]]
+        if len(value) > _MAX_ITEMS:
+            items.append(f"...(+{len(value) - _MAX_ITEMS} itens)")
+        return items
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes sha256:{_digest(value)}>"
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        return f"{value[:LOG_MAX_FIELD_CHARS]}...[+{len(value) - LOG_MAX_FIELD_CHARS} chars sha256:{_digest(value)}]"
+    return value
+
+
+class _ContextFilter(logging.Filter):
+    """Stamp records with the request id and remoteJid of the current task."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.remotejid = remotejid_var.get()
+        return True
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the listener thread without formatting them.
+
+    Only a redacted snapshot of the arguments is taken on the calling thread (cheap and bounded), so
+    `getMessage()`, JSON encoding and the write itself happen off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            record.args = tuple(redact(arg) for arg in args) if isinstance(record.args, tuple) else redact(record.args)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if len(message) > LOG_MAX_MESSAGE_CHARS:
+            message = f"{message[:LOG_MAX_MESSAGE_CHARS]}...[+{len(message) - LOG_MAX_MESSAGE_CHARS} chars]"
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "remotejid", None):
+            entry["remotejid"] = record.remotejid
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = record.message[:LOG_MAX_MESSAGE_CHARS]
+        return super().formatMessage(record)
+
+
+def _parse_levels(spec: str) -> dict:
+    levels = dict(DEFAULT_LEVELS)
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _configure() -> None:
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        handler = _LazyQueueHandler(log_queue)
+        handler.addFilter(_ContextFilter())
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL.upper())
+        for name, level in _parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def setup_logging(name: Optional[str] = None) -> logging.Logger:
+    """Logger for `name` (pass `__name__`); the first call installs the shared JSON queue handler."""
+    _configure()
+    return logging.getLogger(name or "app")
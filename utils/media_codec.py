@@ -0,0 +1,62 @@
+# utils/media_codec.py
+import asyncio
+import binascii
+from typing import Union
+
+# Chunk sizes keep base64 quanta aligned: 4 encoded chars <-> 3 raw bytes.
+DECODE_CHUNK_CHARS = 4 * 64 * 1024
+ENCODE_CHUNK_BYTES = 3 * 64 * 1024
+# Payloads above this size are encoded/decoded on a worker thread instead of the event loop.
+OFFLOAD_THRESHOLD = 256 * 1024
+
+
+def b64decode_chunked(data: Union[str, bytes]) -> bytes:
+    """Strictly decode base64 chunk by chunk into a preallocated buffer."""
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    data = data.strip()
+    if len(data) % 4:
+        raise binascii.Error("Comprimento de base64 inválido")
+    out = bytearray(len(data) // 4 * 3)
+    view = memoryview(out)
+    offset = 0
+    for start in range(0, len(data), DECODE_CHUNK_CHARS):
+        chunk = binascii.a2b_base64(data[start:start + DECODE_CHUNK_CHARS], strict_mode=True)
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    # Padding makes the last quantum decode to fewer than 3 bytes.
+    return view[:offset].tobytes()
+
+
+def b64encode_chunked(data: bytes) -> str:
+    view = memoryview(data)
+    parts = [binascii.b2a_base64(view[start:start + ENCODE_CHUNK_BYTES], newline=False) for start in range(0, len(view), ENCODE_CHUNK_BYTES)]
+    return b"".join(parts).decode("ascii")
+
+
+def b64encode_file(path: str) -> str:
+    """Base64-encode a file while reading it in chunks, without holding the raw bytes in memory."""
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(ENCODE_CHUNK_BYTES)
+            if not chunk:
+                break
+            parts.append(binascii.b2a_base64(chunk, newline=False))
+    return b"".join(parts).decode("ascii")
+
+
+async def decode_base64(data: Union[str, bytes]) -> bytes:
+    if len(data) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(b64decode_chunked, data)
+    return b64decode_chunked(data)
+
+
+async def encode_base64(data: bytes) -> str:
+    if len(data) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(b64encode_chunked, data)
+    return b64encode_chunked(data)
+
+
+async def encode_file_base64(path: str) -> str:
+    return await asyncio.to_thread(b64encode_file, path)
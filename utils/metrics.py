@@ -0,0 +1,200 @@
+# utils/metrics.py
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_RESERVOIR_SIZE = 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def snapshot(self) -> Dict:
+        return {"value": self._value}
+
+
+class Gauge:
+    """Value that can go up and down (queue depth, in-flight requests)."""
+
+    def __init__(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def snapshot(self) -> Dict:
+        return {"value": self._value}
+
+
+class Histogram:
+    """Bucketed histogram that also keeps a small reservoir of recent samples for quantiles."""
+
+    def __init__(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._recent = deque(maxlen=_RESERVOIR_SIZE)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+            self._recent.append(value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+        return samples[index]
+
+    def cumulative_buckets(self):
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self._count,
+            "sum": round(self._sum, 6),
+            "avg": round(self._sum / self._count, 6) if self._count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+_registry: Dict[Tuple[str, LabelKey], object] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, description: str, labels: Dict[str, str], **kwargs):
+    key = (name, _label_key(labels))
+    with _registry_lock:
+        metric = _registry.get(key)
+        if metric is None:
+            metric = cls(name, description, labels=dict(labels), **kwargs)
+            _registry[key] = metric
+        return metric
+
+
+def counter(name: str, description: str = "", **labels) -> Counter:
+    return _get_or_create(Counter, name, description, labels)
+
+
+def gauge(name: str, description: str = "", **labels) -> Gauge:
+    return _get_or_create(Gauge, name, description, labels)
+
+
+def histogram(name: str, description: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> Histogram:
+    return _get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+
+def snapshot() -> Dict[str, Dict]:
+    """Return every registered metric as a plain dict, keyed by name and labels."""
+    with _registry_lock:
+        items = list(_registry.items())
+    result: Dict[str, Dict] = {}
+    for (name, label_key), metric in sorted(items, key=lambda item: item[0]):
+        label_str = ",".join(f"{k}={v}" for k, v in label_key)
+        result[f"{name}{{{label_str}}}" if label_str else name] = metric.snapshot()
+    return result
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = tuple(labels) + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        items = sorted(_registry.items(), key=lambda item: item[0])
+    lines = []
+    current = None
+    for (name, label_key), metric in items:
+        if name != current:
+            current = name
+            kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+            lines.append(f"# HELP {name} {_escape(metric.description or name)}")
+            lines.append(f"# TYPE {name} {kind}")
+        if isinstance(metric, Histogram):
+            for bound, total in metric.cumulative_buckets():
+                lines.append(f"{name}_bucket{_format_labels(label_key, (('le', _format_value(bound)),))} {total}")
+            lines.append(f"{name}_sum{_format_labels(label_key)} {_format_value(metric.sum)}")
+            lines.append(f"{name}_count{_format_labels(label_key)} {metric.count}")
+        else:
+            lines.append(f"{name}{_format_labels(label_key)} {_format_value(metric.value)}")
+    return "\n".join(lines) + "\n"
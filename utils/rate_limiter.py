@@ -0,0 +1,72 @@
+# utils/rate_limiter.py
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, up to `burst` saved for short spikes."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Wait until `tokens` are available and take them; returns the time spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        # The lock keeps waiters in FIFO order, so a burst of sends leaves in the order it arrived.
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                delay = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self._tokens -= tokens
+        return waited
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self._tokens >= self.burst and not self._lock.locked()
+
+
+class KeyedRateLimiter:
+    """One TokenBucket per key (e.g. per WhatsApp number); idle buckets beyond `max_keys` are dropped."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            self._prune()
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def _prune(self) -> None:
+        while len(self._buckets) > self.max_keys:
+            key, oldest = next(iter(self._buckets.items()))
+            if not oldest.idle:
+                break
+            del self._buckets[key]
+
+    async def acquire(self, key: str, tokens: float = 1.0) -> float:
+        return await self.bucket(key).acquire(tokens)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
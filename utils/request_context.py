@@ -0,0 +1,7 @@
+# utils/request_context.py
+from contextvars import ContextVar
+from typing import Optional
+
+# Set by utils.tracing.trace() for the webhook being processed; read by logging to tag every line.
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+remotejid_var: ContextVar[Optional[str]] = ContextVar("remotejid", default=None)
@@ -0,0 +1,51 @@
+# utils/token_budget.py
+import functools
+from typing import Optional
+from config.config import TOKENIZER_MODEL
+from utils.logging_setup import setup_logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = setup_logging(__name__)
+
+# Without tiktoken (not installed, or its encoding cannot be downloaded): Portuguese chat text averages about 4 characters per token on the GPT-4o vocabulary.
+CHARS_PER_TOKEN = 4
+# Role and delimiter tokens the chat format adds around every input item.
+ITEM_OVERHEAD_TOKENS = 4
+
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        logger.warning("tiktoken não instalado; contagem de tokens estimada em %s caracteres por token", CHARS_PER_TOKEN)
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; offline hosts fall back to the estimate.
+        logger.warning("Tokenizer do tiktoken indisponível para %s, usando estimativa: %s", model, e)
+        return None
+
+
+def load_tokenizer(model: str = TOKENIZER_MODEL) -> bool:
+    """Load the encoding for `model` (downloading it on first use); False means counts are estimates.
+
+    Called once at startup so the download and any fallback warning happen before the first request.
+    """
+    return _encoding(model) is not None
+
+
+def count_tokens(text: Optional[str], model: str = TOKENIZER_MODEL) -> int:
+    """Token count of `text` for `model`: exact with tiktoken, a per-character estimate without it."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
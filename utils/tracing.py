@@ -0,0 +1,132 @@
+# utils/tracing.py
+import functools
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+from utils import metrics
+from utils.logging_setup import setup_logging
+from utils.request_context import request_id_var, remotejid_var
+
+logger = setup_logging(__name__)
+
+# Stage latencies reach minutes for agent runs with tool calls, so the buckets go further than the default.
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_spans_var: ContextVar[Optional[List[Tuple[str, float, bool]]]] = ContextVar("spans", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def trace(request_id: Optional[str] = None, remotejid: Optional[str] = None):
+    """Tag everything below with a request id and remoteJid; logs one summary line of all spans at the end.
+
+    Tasks created inside inherit the tags, so background work (lead enrichment, thread mirroring) is
+    attributed to the request that started it.
+    """
+    request_id = request_id or new_request_id()
+    tokens = (request_id_var.set(request_id), remotejid_var.set(remotejid), _spans_var.set([]))
+    started = time.perf_counter()
+    try:
+        yield request_id
+    finally:
+        spans = _spans_var.get() or []
+        total = time.perf_counter() - started
+        metrics.histogram("request_duration_seconds", "Duração total do processamento de um webhook", buckets=STAGE_BUCKETS).observe(total)
+        summary = " ".join(f"{stage}={duration * 1000:.0f}ms{'' if ok else '!'}" for stage, duration, ok in spans)
+        logger.info("[%s] trace %s total=%.0fms %s", remotejid, request_id, total * 1000, summary)
+        _spans_var.reset(tokens[2])
+        remotejid_var.reset(tokens[1])
+        request_id_var.reset(tokens[0])
+
+
+class span:
+    """Time one pipeline stage: `with span("agent_run"):` or `async with span("agent_run"):`.
+
+    Each stage feeds `stage_duration_seconds{stage=...}`; failures also count in `stage_errors_total`.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        ok = exc_type is None
+        metrics.histogram("stage_duration_seconds", "Duração de cada etapa do pipeline", buckets=STAGE_BUCKETS, stage=self.stage).observe(duration)
+        if not ok:
+            metrics.counter("stage_errors_total", "Etapas do pipeline que terminaram com exceção", stage=self.stage).inc()
+        spans = _spans_var.get()
+        if spans is not None:
+            spans.append((self.stage, duration, ok))
+        logger.debug("[%s] span %s %s %.1fms%s", remotejid_var.get(), request_id_var.get(), self.stage, duration * 1000, '' if ok else ' (erro)')
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def traced(stage: str):
+    """Decorator form of `span` for coroutine functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_call(model: str, input_tokens: int = 0, output_tokens: int = 0, operation: str = "completion", cached_tokens: int = 0) -> None:
+    """Count a model call and its tokens, per model. `cached_tokens` is the part of the input served from the prompt cache."""
+    model = model or "unknown"
+    metrics.counter("llm_calls_total", "Chamadas a modelos da OpenAI", model=model, operation=operation).inc()
+    if input_tokens:
+        metrics.counter("llm_tokens_total", "Tokens consumidos por modelo", model=model, kind="input").inc(input_tokens)
+    if cached_tokens:
+        metrics.counter("llm_tokens_total", "Tokens consumidos por modelo", model=model, kind="cached").inc(cached_tokens)
+    if output_tokens:
+        metrics.counter("llm_tokens_total", "Tokens consumidos por modelo", model=model, kind="output").inc(output_tokens)
+    logger.debug("[%s] %s %s: prompt=%d cached=%d completion=%d", remotejid_var.get(), operation, model, input_tokens, cached_tokens, output_tokens)
+
+
+def record_completion_usage(response, operation: str = "completion") -> None:
+    """Token accounting for a Chat Completions (or parse) response."""
+    usage = getattr(response, "usage", None)
+    record_llm_call(
+        getattr(response, "model", None),
+        getattr(usage, "prompt_tokens", 0) or 0,
+        getattr(usage, "completion_tokens", 0) or 0,
+        operation=operation,
+        cached_tokens=getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0,
+    )
+
+
+def record_run_usage(result) -> None:
+    """Token accounting for an Agents SDK run: one call per model response, tagged with the agent's model."""
+    model = getattr(getattr(result, "last_agent", None), "model", None)
+    model = model if isinstance(model, str) else "agent"
+    totals = [0, 0, 0]
+    for response in getattr(result, "raw_responses", None) or []:
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        cached_tokens = getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+        record_llm_call(model, input_tokens, output_tokens, operation="agent", cached_tokens=cached_tokens)
+        totals = [totals[0] + input_tokens, totals[1] + cached_tokens, totals[2] + output_tokens]
+    if totals[0]:
+        logger.info(
+            "[%s] tokens do agente: prompt=%d cached=%d (%.0f%%) completion=%d",
+            remotejid_var.get(), totals[0], totals[1], 100 * totals[1] / totals[0], totals[2],
+        )
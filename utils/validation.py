@@ -2,7 +2,7 @@
 from typing import Dict
 from utils.logging_setup import setup_logging
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 def validate_lead_data(data: Dict) -> Dict:
     lead_schema = {
@@ -16,11 +16,11 @@ def validate_lead_data(data: Dict) -> Dict:
     }
     valid_data = {k: v for k, v in data.items() if k in lead_schema and v is not None}
     if "tipo" in valid_data and valid_data["tipo"] not in ["lojista", "revendedor", "sacoleiro", "feirante"]:
-        logger.warning(f"Invalid tipo value: {valid_data['tipo']}, removing")
+        logger.warning("Invalid tipo value: %s, removing", valid_data['tipo'])
         del valid_data["tipo"]
     if "sentimento" in valid_data and valid_data["sentimento"] not in ["positivo", "negativo", "neutro"]:
-        logger.warning(f"Invalid sentimento value: {valid_data['sentimento']}, removing")
+        logger.warning("Invalid sentimento value: %s, removing", valid_data['sentimento'])
         del valid_data["sentimento"]
     if len(valid_data) < len(data):
-        logger.warning(f"Filtered out invalid lead columns: {set(data.keys()) - set(valid_data.keys())}")
+        logger.warning("Filtered out invalid lead columns: %s", set(data.keys()) - set(valid_data.keys()))
     return valid_data
\ No newline at end of file
@@ -0,0 +1,94 @@
+# utils/webhook_queue.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+from utils import metrics
+from utils.logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the webhook queue is at capacity."""
+
+
+class WebhookQueue:
+    """Bounded in-process queue drained by a fixed pool of async workers."""
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], maxsize: int = 1000, workers: int = 8, name: str = "webhook"):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self.depth = metrics.gauge("queue_depth", "Itens aguardando na fila", queue=name)
+        self.busy_workers = metrics.gauge("queue_busy_workers", "Workers processando um item", queue=name)
+        self.wait_time = metrics.histogram("queue_wait_seconds", "Tempo entre enfileirar e iniciar o processamento", queue=name)
+        self.processing_time = metrics.histogram("queue_processing_seconds", "Tempo de processamento de um item", queue=name)
+        self.enqueued = metrics.counter("queue_enqueued_total", "Itens enfileirados", queue=name)
+        self.rejected = metrics.counter("queue_rejected_total", "Itens rejeitados por fila cheia", queue=name)
+        self.failed = metrics.counter("queue_failed_total", "Itens cujo processamento falhou", queue=name)
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}") for i in range(self.worker_count)]
+        logger.info("Fila '%s' iniciada com %s workers (maxsize=%s)", self.name, self.worker_count, self.maxsize)
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Fila '%s' encerrada com %s itens pendentes", self.name, self._queue.qsize())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Fila '%s' encerrada", self.name)
+
+    def put_nowait(self, item: Any) -> None:
+        if self._queue is None:
+            raise RuntimeError(f"Fila '{self.name}' não foi iniciada")
+        try:
+            self._queue.put_nowait((time.monotonic(), item))
+        except asyncio.QueueFull:
+            self.rejected.inc()
+            raise QueueFullError(f"Fila '{self.name}' cheia ({self.maxsize} itens)")
+        self.enqueued.inc()
+        self.depth.set(self._queue.qsize())
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            enqueued_at, item = await self._queue.get()
+            self.depth.set(self._queue.qsize())
+            started = time.monotonic()
+            self.wait_time.observe(started - enqueued_at)
+            self.busy_workers.inc()
+            try:
+                await self.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed.inc()
+                logger.error("Erro no worker %s da fila '%s': %s", index, self.name, str(e))
+            finally:
+                self.processing_time.observe(time.monotonic() - started)
+                self.busy_workers.dec()
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+            "workers": self.worker_count,
+            "busy_workers": self.busy_workers.value,
+            "enqueued": self.enqueued.value,
+            "rejected": self.rejected.value,
+            "failed": self.failed.value,
+            "wait_seconds": self.wait_time.snapshot(),
+            "processing_seconds": self.processing_time.snapshot(),
+        }